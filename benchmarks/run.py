@@ -0,0 +1,571 @@
+"""Benchmarks of reacher's transfer, exec and forwarding paths.
+
+By default they run against the local SSH server in benchmarks/server.py,
+started in a child process, so no remote machine is needed:
+
+    python -m benchmarks.run --output results.json
+
+Pass --host/--user/--key to measure against a real remote instead. The
+results are written as JSON (and optionally CSV), one record per case with
+its duration, throughput and the number of round trips it took.
+"""
+
+import argparse
+import csv
+import getpass
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import paramiko
+
+from reacher.reacher import Manifest, MetricsRecorder, Reacher, RemoteClient, file_hash
+from benchmarks.server import serve, serve_process
+
+SCENARIOS = ["startup", "small_files", "large_file", "exec", "tunnel"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run in a fresh interpreter per sample, so nothing is imported or connected yet
+STARTUP_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+from reacher.reacher import RemoteClient
+t1 = time.perf_counter()
+timings = {"import": t1 - t0}
+if len(sys.argv) > 1:
+    host, port, user, key = sys.argv[1:5]
+    client = RemoteClient(host=host, port=int(port), user=user, ssh_key_filepath=key)
+    client.connection
+    t2 = time.perf_counter()
+    client.run("true").wait()
+    timings.update(connect=t2 - t1, first_command=time.perf_counter() - t2, total=time.perf_counter() - t0)
+    client.disconnect()
+timings["loaded"] = ",".join(m for m in ("paramiko", "scp", "asyncio", "zstandard") if m in sys.modules)
+print(json.dumps(timings))
+"""
+
+def parse_size(size: str) -> int:
+    """Parse sizes like 4096, 64K, 512M or 2G."""
+
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+    size = size.strip().upper().rstrip("B")
+
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+
+    return int(size)
+
+class BenchReacher(Reacher):
+    """Reacher with its workspace in a scratch directory instead of ~/.reacher."""
+
+    def __init__(self, workspace: str, **kwargs):
+        super().__init__(**kwargs)
+        self._workspace = workspace
+
+    @property
+    def workspace_path(self):
+        return self._workspace
+
+class Benchmark(object):
+
+    def __init__(self, args, host: str, port: int, user: str, key: str, workdir: str):
+
+        self.args = args
+        self.workdir = workdir
+        self.results = []
+        self.metrics = MetricsRecorder()
+        self.target = (host, str(port), user, key)
+
+        self.client = RemoteClient(
+            host=host, user=user, ssh_key_filepath=key, port=port, metrics=self.metrics, use_helper=args.helper,
+        )
+
+        self.reacher = BenchReacher(
+            workspace=os.path.join(args.remote_dir, f"reacher-bench-{uuid.uuid4().hex[:8]}"),
+            build_name="bench",
+            client=self.client,
+        )
+
+    def measure(self, scenario: str, case: str, fn, size: int = 0, ops: int = 1) -> dict:
+        """Time fn() and record the case. fn may return a dict of extra fields."""
+
+        mark = self.metrics.mark()
+        error = None
+        extra = None
+
+        t0 = time.perf_counter()
+
+        try:
+            extra = fn()
+        except Exception as e:
+            error = repr(e)
+
+        seconds = time.perf_counter() - t0
+        counters = self.metrics.summary(mark)["counters"]
+
+        record = {
+            "scenario": scenario,
+            "case": case,
+            "seconds": seconds,
+            "bytes": size,
+            "ops": ops,
+            "mb_per_s": size / seconds / 1e6 if size and seconds > 0 else None,
+            "ops_per_s": ops / seconds if seconds > 0 else None,
+            "round_trips": counters.get("round_trips", 0),
+            "commands": counters.get("commands", 0),
+            "error": error,
+        }
+
+        if isinstance(extra, dict):
+            record.update(extra)
+
+        self.results.append(record)
+
+        rate = f"{record['mb_per_s']:.1f} MB/s" if record["mb_per_s"] else f"{record['ops_per_s']:.1f} ops/s"
+        status = f"FAILED {error}" if error else rate
+        print(f"{scenario:<12} {case:<24} {seconds:8.3f}s  {status}", file=sys.stderr, flush=True)
+
+        return record
+
+    def local_path(self, *parts) -> str:
+        return os.path.join(self.workdir, *parts)
+
+    def startup(self):
+
+        args = self.args
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(p for p in (ROOT, env.get("PYTHONPATH")) if p)
+
+        def samples(*argv):
+            timings = []
+            for _ in range(args.startups):
+                t0 = time.perf_counter()
+                output = subprocess.check_output([sys.executable, "-c", STARTUP_SCRIPT, *argv], env=env)
+                timings.append(dict(json.loads(output), process=time.perf_counter() - t0))
+            record = {
+                f"{k}_p50": statistics.median(t[k] for t in timings)
+                for k in timings[0] if k != "loaded"
+            }
+            record["loaded"] = timings[-1]["loaded"]
+            return record
+
+        self.measure("startup", "import", samples, 0, args.startups)
+        self.measure("startup", "connect + first command", lambda: samples(*self.target), 0, args.startups)
+
+    def small_files(self):
+
+        args = self.args
+        tree = "tree"
+        per_dir = max(1, int(args.files ** 0.5))
+
+        for i in range(args.files):
+            directory = self.local_path(tree, f"dir{i // per_dir:04d}")
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"file{i:06d}.txt"), "wb") as f:
+                f.write((f"{i}\n" * args.file_size)[:args.file_size].encode("utf-8"))
+
+        size = args.files * args.file_size
+        reacher = self.reacher
+
+        for method in args.methods:
+
+            self.measure("small_files", f"cleanup before {method}", reacher.cleanup)
+
+            if method == "parallel":
+                put = lambda: reacher.put(tree, workers=args.workers)
+            else:
+                put = lambda: reacher.put(tree, method=method)
+
+            self.measure("small_files", f"put {method}", put, size, args.files)
+
+            if method == "sync":
+                self.measure("small_files", "put sync unchanged", put, 0, args.files)
+
+        self.measure("small_files", "ls", reacher.ls, 0, args.files)
+
+        destination = self.local_path("small_files_get")
+
+        self.measure(
+            "small_files", "get parallel",
+            lambda: reacher.get(tree, destination, workers=args.workers), size, args.files,
+        )
+        shutil.rmtree(destination, ignore_errors=True)
+
+        self.measure(
+            "small_files", "get compressed",
+            lambda: reacher.get(tree, destination, compress=True), size, args.files,
+        )
+        shutil.rmtree(destination, ignore_errors=True)
+
+        self.measure("small_files", "cleanup", reacher.cleanup, 0, args.files)
+
+        shutil.rmtree(self.local_path(tree), ignore_errors=True)
+
+    def large_file(self):
+
+        args = self.args
+        name = "large.bin"
+        block = os.urandom(1 << 20)
+
+        with open(self.local_path(name), "wb") as f:
+            remaining = args.large_size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+
+        size = args.large_size
+        reacher = self.reacher
+        remote = os.path.join(reacher.build_path, name)
+        destination = self.local_path("large_file_get")
+
+        cases = [
+            ("put scp", lambda: reacher.put(name)),
+            ("put parallel", lambda: reacher.put(name, workers=args.workers)),
+            ("put resumable", lambda: reacher.put(name, method="resumable", workers=args.workers)),
+        ]
+
+        for case, put in cases:
+            reacher.batch().remove(remote).run()
+            self.measure("large_file", case, put, size)
+
+        cases = [
+            ("get scp", lambda: reacher.get(name, destination)),
+            ("get parallel", lambda: reacher.get(name, destination, workers=args.workers)),
+            ("get resumable", lambda: reacher.get(name, destination, workers=args.workers, resumable=True)),
+        ]
+
+        for case, get in cases:
+            shutil.rmtree(destination, ignore_errors=True)
+            os.makedirs(destination)
+            self.measure("large_file", case, get, size)
+
+        # the same single stream and parallel transfers over a transport with
+        # the window, packet size and cipher from the command line
+        host, port, user, key = self.target
+        tuned = BenchReacher(
+            workspace=reacher.workspace_path,
+            build_name="bench",
+            client=RemoteClient(
+                host=host, user=user, ssh_key_filepath=key, port=int(port), metrics=self.metrics,
+                window_size=args.window_size, max_packet_size=args.packet_size, ciphers=args.ciphers,
+            ),
+        )
+
+        cases = [
+            ("put scp tuned", lambda: tuned.put(name)),
+            ("put parallel tuned", lambda: tuned.put(name, workers=args.workers)),
+        ]
+
+        for case, put in cases:
+            reacher.batch().remove(remote).run()
+            self.measure("large_file", case, put, size)
+
+        cases = [
+            ("get scp tuned", lambda: tuned.get(name, destination)),
+            ("get parallel tuned", lambda: tuned.get(name, destination, workers=args.workers)),
+        ]
+
+        for case, get in cases:
+            shutil.rmtree(destination, ignore_errors=True)
+            os.makedirs(destination)
+            self.measure("large_file", case, get, size)
+
+        tuned._client.disconnect()
+
+        # artifacts are downloaded to growing .part files, the file of the
+        # first sync is cut in half to measure resuming the second
+        artifact = os.path.join(reacher.artifact_path, name)
+        reacher.put(name, Reacher.ARTIFACATS_PATH, workers=args.workers)
+        shutil.rmtree(destination, ignore_errors=True)
+
+        def sync_artifacts():
+            results = reacher.sync_artifacts(destination, workers=args.workers)
+            errors = [str(result.error) for result in results if result.error is not None]
+            if errors:
+                raise IOError("; ".join(errors))
+            if file_hash(os.path.join(destination, name)) != file_hash(self.local_path(name)):
+                raise IOError(f"{name} differs after sync_artifacts")
+
+        self.measure("large_file", "sync_artifacts", sync_artifacts, size)
+
+        index_path = os.path.join(destination, Manifest.INDEX_FILENAME)
+        index = Manifest.load(index_path)
+        index.entries[name]["complete"] = False
+        index.save(index_path)
+        os.rename(os.path.join(destination, name), os.path.join(destination, name + ".part"))
+        with open(os.path.join(destination, name + ".part"), "r+b") as f:
+            f.truncate(size // 2)
+
+        self.measure("large_file", "sync_artifacts resumed", sync_artifacts, size - size // 2)
+
+        reacher.batch().remove(artifact).run()
+        shutil.rmtree(destination, ignore_errors=True)
+        os.remove(self.local_path(name))
+        reacher.batch().remove(remote).run()
+
+    def exec(self):
+
+        args = self.args
+        client = self.client
+
+        def latencies(fn):
+            samples = []
+            for _ in range(args.commands):
+                t0 = time.perf_counter()
+                fn()
+                samples.append(time.perf_counter() - t0)
+            samples.sort()
+            return {
+                "p50": statistics.median(samples),
+                "p95": samples[int(0.95 * (len(samples) - 1))],
+                "max": samples[-1],
+            }
+
+        self.measure(
+            "exec", "run true",
+            lambda: latencies(lambda: client.run("true").wait()), 0, args.commands,
+        )
+        self.measure(
+            "exec", "execute_command true",
+            lambda: latencies(lambda: self.reacher.execute_command("true", suppress=True, stream=False)),
+            0, args.commands,
+        )
+
+        def batched():
+            batch = client.batch()
+            for _ in range(args.commands):
+                batch.add("true")
+            batch.run()
+
+        self.measure("exec", "batch true", batched, 0, args.commands)
+
+        produce = f"head -c {args.output_size} /dev/zero | tr '\\0' x"
+
+        def output(result):
+            result.wait()
+            return {"received": len(result.stdout)}
+
+        self.measure(
+            "exec", "run large output",
+            lambda: output(client.run(produce, capture=args.output_size)), args.output_size,
+        )
+        self.measure(
+            "exec", "run large stderr",
+            lambda: output(client.run(f"{produce} >&2", capture=1024)), args.output_size,
+        )
+        self.measure(
+            "exec", "execute_command output",
+            lambda: client.execute_command(produce, suppress=True), args.output_size,
+        )
+
+    def tunnel(self):
+
+        args = self.args
+        payload = os.urandom(1 << 20)
+
+        service = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        service.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        service.bind((args.service_host, 0))
+        service.listen(128)
+
+        def serve_client(sock):
+            try:
+                remaining = args.tunnel_size
+                while remaining > 0:
+                    sock.sendall(payload[:remaining])
+                    remaining -= len(payload)
+            except OSError:
+                pass
+            finally:
+                sock.close()
+
+        def accept():
+            while True:
+                try:
+                    sock, _ = service.accept()
+                except OSError:
+                    return
+                threading.Thread(target=serve_client, args=(sock,), daemon=True).start()
+
+        threading.Thread(target=accept, daemon=True).start()
+
+        forwarding = self.reacher._port_forwarding
+        tunnel = forwarding.add_port_forward(
+            service.getsockname()[1], 0, remote_host=args.service_host,
+        )
+
+        def download(received, i):
+            with socket.create_connection(("127.0.0.1", tunnel.local_port)) as sock:
+                while True:
+                    data = sock.recv(1 << 20)
+                    if not data:
+                        break
+                    received[i] += len(data)
+
+        def parallel(n):
+            received = [0] * n
+            threads = [threading.Thread(target=download, args=(received, i)) for i in range(n)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if sum(received) != n * args.tunnel_size:
+                raise IOError(f"received {sum(received)} of {n * args.tunnel_size} bytes")
+            return {"clients": n, "mean_open_latency": tunnel.mean_open_latency}
+
+        self.measure("tunnel", "1 client", lambda: parallel(1), args.tunnel_size)
+        self.measure(
+            "tunnel", f"{args.tunnel_clients} clients",
+            lambda: parallel(args.tunnel_clients), args.tunnel_clients * args.tunnel_size,
+        )
+
+        forwarding.stop()
+        service.close()
+
+    def run(self):
+
+        self.reacher.setup()
+
+        try:
+            for scenario in self.args.scenarios:
+                getattr(self, scenario)()
+        finally:
+            self.reacher.batch().remove(self.reacher.workspace_path).run()
+            self.client.disconnect()
+
+        return self.results
+
+def metadata(args) -> dict:
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "time": time.time(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "paramiko": paramiko.__version__,
+        "platform": platform.platform(),
+        "server": args.host or ("local, in-process" if args.in_process else "local, child process"),
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "csv")},
+    }
+
+def write_csv(path: str, results: list):
+
+    fields = []
+    for record in results:
+        fields += [k for k in record if k not in fields]
+
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmark reacher against a local (or real) SSH server")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma separated, of {SCENARIOS}")
+    parser.add_argument("--files", type=int, default=10000, help="number of small files")
+    parser.add_argument("--file-size", type=parse_size, default=1024)
+    parser.add_argument("--methods", default="tar,sync,parallel", help="put methods for small files, scp is slow")
+    parser.add_argument("--large-size", type=parse_size, default=parse_size("2G"))
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--window-size", type=parse_size, default=parse_size("16M"), help="channel window of the tuned large file cases",
+    )
+    parser.add_argument("--packet-size", type=parse_size, help="max packet size of the tuned large file cases")
+    parser.add_argument(
+        "--ciphers", default="aes128-gcm@openssh.com,aes128-ctr", help="preferred ciphers of the tuned large file cases",
+    )
+    parser.add_argument("--startups", type=int, default=10, help="fresh interpreters for the startup cases")
+    parser.add_argument("--helper", action="store_true", help="answer metadata queries with the remote helper")
+    parser.add_argument("--commands", type=int, default=200, help="commands for the latency cases")
+    parser.add_argument("--output-size", type=parse_size, default=parse_size("64M"))
+    parser.add_argument("--tunnel-clients", type=int, default=8)
+    parser.add_argument("--tunnel-size", type=parse_size, default=parse_size("64M"), help="bytes per client")
+    parser.add_argument("--in-process", action="store_true", help="run the local server in this process")
+    parser.add_argument(
+        "--rtt", type=float, default=0, help="milliseconds of round trip time added to the local server, e.g. 40",
+    )
+    parser.add_argument("--host", help="benchmark a real remote instead of the local server")
+    parser.add_argument("--port", type=int, default=22)
+    parser.add_argument("--user", default=getpass.getuser())
+    parser.add_argument("--key", help="private key, generated for the local server if not given")
+    parser.add_argument("--remote-dir", default=tempfile.gettempdir(), help="scratch directory on the remote")
+    parser.add_argument(
+        "--service-host", default="127.0.0.1", help="address the tunnel service is reachable at from the remote",
+    )
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--csv", help="also write the results as CSV")
+    args = parser.parse_args(argv)
+
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    args.methods = [m for m in args.methods.split(",") if m]
+    args.ciphers = [c for c in args.ciphers.split(",") if c]
+
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario {scenario}")
+
+    workdir = tempfile.mkdtemp(prefix="reacher-bench-")
+    cwd = os.getcwd()
+    process = None
+
+    try:
+        key = args.key
+        if key is None:
+            key = os.path.join(workdir, "id_rsa")
+            paramiko.RSAKey.generate(2048).write_private_key_file(key)
+
+        host, port = args.host, args.port
+        if host is None:
+            host = "127.0.0.1"
+            if args.in_process:
+                port = serve(rtt=args.rtt / 1000)
+            else:
+                process, port = serve_process(rtt=args.rtt / 1000)
+
+        # uploads use paths relative to the working directory
+        os.chdir(workdir)
+
+        benchmark = Benchmark(args, host, port, args.user, key, workdir)
+        results = benchmark.run()
+
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        if process is not None:
+            process.terminate()
+
+    report = {"meta": metadata(args), "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.csv:
+        write_csv(args.csv, results)
+
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+"""A local SSH server standing in for a remote host in the benchmarks.
+
+It is built on paramiko and serves exec requests (run with bash on the
+local machine), SFTP on the local filesystem and direct-tcpip channels for
+port forwarding. Any user is accepted with any key or password.
+"""
+
+import os
+import time
+import queue
+import logging
+import select
+import socket
+import subprocess
+import threading
+import multiprocessing
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface, SFTP_OK
+
+BUFFER_SIZE = 256 * 1024
+
+# raised by channels whose connection went away
+CLOSED = (OSError, EOFError, paramiko.SSHException)
+
+class LocalSFTPHandle(SFTPHandle):
+
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+class LocalSFTPServer(SFTPServerInterface):
+    """SFTP on the local filesystem, relative paths resolve against the cwd."""
+
+    def _path(self, path: str) -> str:
+        return os.path.realpath(path if path.startswith("/") else os.path.join(os.getcwd(), path))
+
+    def list_folder(self, path):
+        path = self._path(path)
+        try:
+            attrs = []
+            for filename in os.listdir(path):
+                attr = SFTPAttributes.from_stat(os.lstat(os.path.join(path, filename)))
+                attr.filename = filename
+                attrs.append(attr)
+            return attrs
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._path(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(self._path(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+
+        path = self._path(path)
+
+        try:
+            fd = os.open(path, flags, 0o666)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+
+        handle = LocalSFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+
+        return handle
+
+    def _call(self, fn, *args):
+        try:
+            fn(*args)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def remove(self, path):
+        return self._call(os.remove, self._path(path))
+
+    def rename(self, oldpath, newpath):
+        return self._call(os.rename, self._path(oldpath), self._path(newpath))
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, self._path(oldpath), self._path(newpath))
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, self._path(path))
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, self._path(path))
+
+    def chattr(self, path, attr):
+
+        path = self._path(path)
+
+        try:
+            if attr.st_mode is not None:
+                os.chmod(path, attr.st_mode)
+            if attr.st_atime is not None:
+                os.utime(path, (attr.st_atime, attr.st_mtime))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+        return SFTP_OK
+
+    def canonicalize(self, path):
+        return self._path(path)
+
+class LocalServer(paramiko.ServerInterface):
+
+    def __init__(self):
+        self.forwards = {}
+
+    def check_auth_none(self, username):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "none,password,publickey"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, *args):
+        return True
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        # like sshd, connect before answering so a closed port fails the open
+        try:
+            self.forwards[chanid] = socket.create_connection(destination)
+        except OSError:
+            return paramiko.OPEN_FAILED_CONNECT_FAILED
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=run_command, args=(channel, command.decode("utf-8")), daemon=True).start()
+        return True
+
+    def check_global_request(self, kind, msg):
+        return True
+
+def run_command(chan, command: str):
+
+    process = subprocess.Popen(
+        ["bash", "-c", command],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    def pump_stdin():
+        try:
+            while True:
+                data = chan.recv(BUFFER_SIZE)
+                if not data:
+                    break
+                process.stdin.write(data)
+                process.stdin.flush()
+        except CLOSED:
+            pass
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+
+    def pump_stderr():
+        try:
+            while True:
+                data = process.stderr.read1(BUFFER_SIZE)
+                if not data:
+                    break
+                chan.sendall_stderr(data)
+        except CLOSED:
+            pass
+
+    threading.Thread(target=pump_stdin, daemon=True).start()
+    stderr = threading.Thread(target=pump_stderr, daemon=True)
+    stderr.start()
+
+    try:
+        while True:
+            data = process.stdout.read1(BUFFER_SIZE)
+            if not data:
+                break
+            chan.sendall(data)
+        stderr.join()
+        chan.send_exit_status(process.wait())
+    except CLOSED:
+        process.kill()
+    finally:
+        chan.close()
+
+def forward(chan, sock: socket.socket):
+
+    try:
+        while True:
+            readable, _, _ = select.select([sock, chan], [], [])
+            if sock in readable:
+                data = sock.recv(BUFFER_SIZE)
+                if not data:
+                    break
+                chan.sendall(data)
+            if chan in readable:
+                data = chan.recv(BUFFER_SIZE)
+                if not data:
+                    break
+                sock.sendall(data)
+    except CLOSED:
+        pass
+    finally:
+        chan.close()
+        sock.close()
+
+def handle(sock: socket.socket, host_key: paramiko.PKey):
+
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    transport = paramiko.Transport(sock)
+    transport.add_server_key(host_key)
+    transport.set_subsystem_handler("sftp", SFTPServer, LocalSFTPServer)
+
+    server = LocalServer()
+    transport.start_server(server=server)
+
+    # paramiko closes channels that are garbage collected, keep them
+    # referenced until they are done
+    channels = set()
+
+    while transport.is_active():
+
+        chan = transport.accept(1)
+        channels = {c for c in channels if not c.closed}
+
+        if chan is None:
+            continue
+
+        channels.add(chan)
+
+        sock = server.forwards.pop(chan.get_id(), None)
+        if sock is not None:
+            threading.Thread(target=forward, args=(chan, sock), daemon=True).start()
+
+def serve(port: int = 0, host: str = "127.0.0.1", rtt: float = 0) -> int:
+    """Serve in background threads of this process, returns the port. With
+    rtt, connections to it see that round trip time, see delay_proxy."""
+
+    host_key = paramiko.RSAKey.generate(2048)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+
+    def accept():
+        while True:
+            sock, _ = listener.accept()
+            threading.Thread(target=handle, args=(sock, host_key), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+    if rtt:
+        return delay_proxy(listener.getsockname()[1], rtt, host)
+
+    return listener.getsockname()[1]
+
+def _delay(source: socket.socket, sink: socket.socket, delay: float):
+    """Pass what arrives on source to sink delay seconds later, without
+    limiting the bandwidth."""
+
+    pending = queue.Queue()
+
+    def send():
+        while True:
+            due, data = pending.get()
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                if not data:
+                    sink.shutdown(socket.SHUT_WR)
+                    return
+                sink.sendall(data)
+            except OSError:
+                return
+
+    threading.Thread(target=send, daemon=True).start()
+
+    while True:
+        try:
+            data = source.recv(BUFFER_SIZE)
+        except OSError:
+            data = b""
+        pending.put((time.monotonic() + delay, data))
+        if not data:
+            return
+
+def delay_proxy(port: int, rtt: float, host: str = "127.0.0.1") -> int:
+    """Listen on a free port and pass connections on to port, adding rtt
+    seconds of round trip time. Returns the port to connect to.
+
+    Over loopback the round trip is a few microseconds, so flow control
+    windows never limit anything; a link to a remote in another region
+    is tens of milliseconds away.
+    """
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind((host, 0))
+    listener.listen(128)
+
+    def accept():
+        while True:
+            client, _ = listener.accept()
+            server = socket.create_connection((host, port))
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=_delay, args=(client, server, rtt / 2), daemon=True).start()
+            threading.Thread(target=_delay, args=(server, client, rtt / 2), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+    return listener.getsockname()[1]
+
+def _serve_forever(ports, port: int, host: str, rtt: float):
+
+    # clients that exit without closing their connection are expected
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    ports.put(serve(port, host, rtt))
+    threading.Event().wait()
+
+def serve_process(port: int = 0, host: str = "127.0.0.1", rtt: float = 0):
+    """Serve from a child process, so the server does not compete with the
+    client for the GIL. Returns (process, port)."""
+
+    ports = multiprocessing.Queue()
+
+    process = multiprocessing.Process(target=_serve_forever, args=(ports, port, host, rtt), daemon=True)
+    process.start()
+
+    return process, ports.get(timeout=60)
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local SSH server for benchmarking reacher")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--rtt", type=float, default=0, help="simulated round trip time in milliseconds")
+    args = parser.parse_args()
+
+    print(serve(args.port, args.host, args.rtt / 1000), flush=True)
+    threading.Event().wait()
@@ -1,3 +1,10 @@
-from reacher import *
+import importlib
 
 __author__ = 'Johannes Skog'
+
+def __getattr__(name):
+    # resolve reacher.Reacher etc. on first use, importing reacher.reacher
+    # only when something from it is needed
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module("reacher.reacher"), name)
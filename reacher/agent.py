@@ -0,0 +1,317 @@
+"""Background agent for the reacher command line.
+
+The agent keeps an authenticated RemoteClient per remote open, together
+with the port forwards set up through it, and serves the requests of
+`reacher` invocations over a Unix socket. Like an OpenSSH ControlMaster,
+only the first command to a host pays for connecting; later ones reuse
+the warm transport.
+
+Requests and responses are JSON objects, one per line. A request is
+`{"op": ..., "target": {...}, "args": {...}}`; it is answered with any
+number of `{"stdout": text}` / `{"stderr": text}` events followed by a
+final `{"result": ..., "exit_status": n}` or `{"error": message}`.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import socketserver
+from typing import Dict
+
+from reacher.reacher import LOCAL_STATE_PATH, PortForwarding, Reacher, RemoteClient
+
+AGENT_SOCKET_PATH = os.environ.get("REACHER_AGENT_SOCKET", os.path.join(LOCAL_STATE_PATH, "agent.sock"))
+
+class Agent(object):
+    """Holds warm connections and forwards, and executes requests on them."""
+
+    def __init__(self, socket_path: str = AGENT_SOCKET_PATH, idle_timeout: float = 30 * 60):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.started = time.time()
+
+        self._clients: Dict[tuple, RemoteClient] = {}
+        self._reachers: Dict[tuple, Reacher] = {}
+        self._forwards: Dict[tuple, PortForwarding] = {}
+        self._lock = threading.Lock()
+        self._last_request = time.time()
+        self._active = 0
+        self._server = None
+
+    @staticmethod
+    def _key(target: dict) -> tuple:
+        return (
+            target["user"],
+            target["host"],
+            int(target.get("port", 22)),
+            os.path.abspath(os.path.expanduser(target["ssh_key_filepath"])),
+        )
+
+    def client(self, target: dict) -> RemoteClient:
+
+        key = self._key(target)
+
+        with self._lock:
+            if key not in self._clients:
+                user, host, port, ssh_key_filepath = key
+                self._clients[key] = RemoteClient(
+                    host=host,
+                    user=user,
+                    port=port,
+                    ssh_key_filepath=ssh_key_filepath,
+                    password=target.get("password"),
+                )
+            return self._clients[key]
+
+    def reacher(self, target: dict, build_name: str) -> Reacher:
+
+        if not build_name:
+            raise ValueError("This command needs a build name")
+
+        key = self._key(target) + (build_name,)
+        client = self.client(target)
+
+        with self._lock:
+            if key not in self._reachers:
+                self._reachers[key] = Reacher(build_name=build_name, client=client)
+            return self._reachers[key]
+
+    def forwarding(self, target: dict) -> PortForwarding:
+
+        key = self._key(target)
+        client = self.client(target)
+
+        with self._lock:
+            if key not in self._forwards:
+                self._forwards[key] = PortForwarding(client=client)
+            return self._forwards[key]
+
+    @property
+    def status(self) -> dict:
+
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "uptime": time.time() - self.started,
+                "connections": [f"{user}@{host}:{port}" for user, host, port, _ in self._clients],
+                "forwards": [
+                    dict(stats, host=f"{user}@{host}:{port}")
+                    for (user, host, port, _), forwarding in self._forwards.items()
+                    for stats in forwarding.stats
+                ],
+            }
+
+    def handle(self, request: dict, emit) -> dict:
+        """Execute request, passing output events to emit, and return the final response."""
+
+        op = request.get("op")
+        target = request.get("target") or {}
+        args = request.get("args") or {}
+
+        handler = getattr(self, f"_op_{op}", None)
+
+        if handler is None:
+            return {"error": f"Unknown operation {op}"}
+
+        try:
+            return handler(target, args, emit)
+        except Exception as e:
+            logging.exception(f"{op} failed")
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    def _op_status(self, target: dict, args: dict, emit) -> dict:
+
+        return {"result": self.status}
+
+    def _op_shutdown(self, target: dict, args: dict, emit) -> dict:
+
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+        return {"result": "stopping"}
+
+    def _op_exec(self, target: dict, args: dict, emit) -> dict:
+
+        command = args["command"]
+
+        if args.get("build"):
+            command = self.reacher(target, args["build"])._build_command(command)
+
+        result = self.client(target).run(command, get_pty=args.get("pty", False))
+
+        with result:
+            for stream, text in result.events():
+                emit({stream: text})
+
+        return {"exit_status": result.exit_status}
+
+    def _op_put(self, target: dict, args: dict, emit) -> dict:
+
+        # paths are relative to the working directory of the command, which
+        # also decides where they end up on the remote
+        results = self.reacher(target, args.get("build")).put(
+            args["paths"],
+            args.get("destination"),
+            method=args.get("method", "scp"),
+            delete=args.get("delete", False),
+            workers=args.get("workers"),
+            compress=args.get("compress"),
+            root=args["cwd"],
+        )
+
+        return self._transfer_response(results)
+
+    def _op_get(self, target: dict, args: dict, emit) -> dict:
+
+        results = self.reacher(target, args.get("build")).get(
+            args["paths"],
+            args["destination"],
+            workers=args.get("workers"),
+            compress=args.get("compress"),
+            resumable=args.get("resumable", False),
+        )
+
+        return self._transfer_response(results)
+
+    @staticmethod
+    def _transfer_response(results) -> dict:
+
+        results = results if isinstance(results, list) else []
+        errors = [f"{r.source}: {r.error}" for r in results if getattr(r, "error", None) is not None]
+
+        return {
+            "result": {"files": len(results), "errors": errors},
+            "exit_status": 1 if errors else 0,
+        }
+
+    def _op_ls(self, target: dict, args: dict, emit) -> dict:
+
+        return {"result": self.reacher(target, args.get("build")).ls(args.get("folder"))}
+
+    def _op_sessions(self, target: dict, args: dict, emit) -> dict:
+
+        reacher = self.reacher(target, args.get("build"))
+
+        if args.get("kill"):
+            killed = reacher.kill_named_session(args["kill"], suppress=True)
+            return {"result": f"Killed {args['kill']}" if killed else f"{args['kill']} is not running"}
+
+        return {"result": [
+            {"name": x.name, "pid": x.pid, "state": x.state, "exit_status": x.exit_status, "log": x.log_path}
+            for x in reacher.list_named_sessions(suppress=True)
+        ]}
+
+    def _op_forward(self, target: dict, args: dict, emit) -> dict:
+
+        if args.get("stop"):
+
+            with self._lock:
+                forwarding = self._forwards.pop(self._key(target), None)
+
+            if forwarding is not None:
+                forwarding.stop()
+
+            return {"result": "stopped"}
+
+        if args.get("remote_port") is None:
+            return {"result": self.status["forwards"]}
+
+        tunnel = self.forwarding(target).add_port_forward(
+            args["remote_port"],
+            args.get("local_port") or 0,
+            remote_host=args.get("remote_host"),
+        )
+
+        return {"result": tunnel.stats}
+
+    def close(self):
+
+        with self._lock:
+            forwards, self._forwards = list(self._forwards.values()), {}
+            clients, self._clients = list(self._clients.values()), {}
+            self._reachers = {}
+
+        for forwarding in forwards:
+            forwarding.stop()
+
+        for client in clients:
+            client.disconnect()
+
+    def _watch_idle(self):
+
+        while self._server is not None:
+            time.sleep(min(self.idle_timeout, 10))
+            if self._active == 0 and time.time() - self._last_request > self.idle_timeout and not self.status["forwards"]:
+                logging.info(f"Idle for {self.idle_timeout}s, stopping")
+                self._server.shutdown()
+                return
+
+    def serve_forever(self):
+        """Serve requests on socket_path until shut down or idle for idle_timeout seconds."""
+
+        agent = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+
+                line = self.rfile.readline()
+                if not line:
+                    return
+
+                with agent._lock:
+                    agent._active += 1
+                    agent._last_request = time.time()
+
+                def emit(event):
+                    self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+
+                try:
+                    emit(agent.handle(json.loads(line), emit))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with agent._lock:
+                        agent._active -= 1
+                        agent._last_request = time.time()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                # left behind by an agent that did not shut down cleanly
+                os.remove(self.socket_path)
+            else:
+                raise RuntimeError(f"An agent is already listening on {self.socket_path}")
+            finally:
+                probe.close()
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        old_umask = os.umask(0o177)
+        try:
+            self._server = Server(self.socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+
+        if self.idle_timeout:
+            threading.Thread(target=self._watch_idle, daemon=True).start()
+
+        logging.info(f"reacher agent {os.getpid()} listening on {self.socket_path}")
+
+        try:
+            self._server.serve_forever()
+        finally:
+            server, self._server = self._server, None
+            server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.close()
@@ -0,0 +1,330 @@
+"""The `reacher` command line.
+
+    reacher exec [--build NAME] COMMAND...
+    reacher put PATH... [--build NAME] [--to FOLDER]
+    reacher get PATH... [--build NAME] [--to FOLDER]
+    reacher ls [FOLDER] --build NAME
+    reacher sessions [--kill NAME] --build NAME
+    reacher forward REMOTE_PORT [LOCAL_PORT] | --list | --stop
+    reacher agent start | stop | status | run
+
+The remote is given with --host/--user/--port/--key or the REACHER_HOST,
+REACHER_USER, REACHER_PORT, REACHER_KEY and REACHER_BUILD environment
+variables (REACHER_PASSWORD for a password). Commands are sent to the
+background agent (see reacher.agent), which is started on first use and
+keeps the connections warm, so this module only needs the standard
+library on that path. With --no-agent the command runs in this process.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+
+# the same as reacher.agent.AGENT_SOCKET_PATH, without importing paramiko
+AGENT_SOCKET_PATH = os.environ.get(
+    "REACHER_AGENT_SOCKET", os.path.join(os.path.expanduser("~"), ".reacher", "agent.sock"),
+)
+
+AGENT_START_TIMEOUT = 10
+
+def _connect_agent(socket_path: str = AGENT_SOCKET_PATH) -> socket.socket:
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        raise
+
+    return sock
+
+def start_agent(socket_path: str = AGENT_SOCKET_PATH, idle_timeout: float = 30 * 60) -> int:
+    """Start the agent detached from this process, returns its pid."""
+
+    state_path = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(state_path, exist_ok=True)
+
+    with open(os.path.join(state_path, "agent.log"), "ab") as log:
+        process = subprocess.Popen(
+            [
+                sys.executable, "-m", "reacher.cli", "agent", "run",
+                "--socket", socket_path, "--idle-timeout", str(idle_timeout),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            start_new_session=True,
+        )
+
+    deadline = time.time() + AGENT_START_TIMEOUT
+
+    while time.time() < deadline:
+        try:
+            _connect_agent(socket_path).close()
+            return process.pid
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.02)
+
+    raise RuntimeError(f"The reacher agent did not start, see {os.path.join(state_path, 'agent.log')}")
+
+def request_agent(request: dict, on_event, start: bool = True, socket_path: str = AGENT_SOCKET_PATH) -> dict:
+    """Send request to the agent, starting it if needed. Output events are
+    passed to on_event, the final response is returned."""
+
+    try:
+        sock = _connect_agent(socket_path)
+    except OSError:
+        if not start:
+            raise
+        start_agent(socket_path)
+        sock = _connect_agent(socket_path)
+
+    with sock, sock.makefile("rwb") as f:
+
+        f.write(json.dumps(request).encode("utf-8") + b"\n")
+        f.flush()
+
+        for line in f:
+            event = json.loads(line)
+            if "stdout" in event or "stderr" in event:
+                on_event(event)
+            else:
+                return event
+
+    return {"error": "The reacher agent closed the connection"}
+
+def request_local(request: dict, on_event) -> dict:
+    """Run request in this process instead of the agent."""
+
+    from reacher.agent import Agent
+
+    agent = Agent()
+
+    try:
+        response = agent.handle(request, on_event)
+        if request["op"] == "forward" and "error" not in response and request["args"].get("remote_port"):
+            # the forward only lives as long as this process
+            _print_response(request, response)
+            print("Forwarding until interrupted", file=sys.stderr)
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
+            return {"exit_status": 0}
+        return response
+    finally:
+        agent.close()
+
+def _print_event(event: dict):
+
+    if "stdout" in event:
+        sys.stdout.write(event["stdout"])
+        sys.stdout.flush()
+    else:
+        sys.stderr.write(event["stderr"])
+        sys.stderr.flush()
+
+def _print_response(request: dict, response: dict):
+
+    result = response.get("result")
+    op = request["op"]
+
+    if result is None:
+        return
+
+    if op == "ls":
+        for path in result:
+            print(path)
+    elif op == "sessions" and isinstance(result, list):
+        for session in result:
+            status = session["exit_status"] if session["exit_status"] is not None else ""
+            print(f"{session['name']}\t{session['pid']}\t{session['state']}\t{status}\t{session['log']}")
+    elif op in ("put", "get"):
+        for error in result["errors"]:
+            print(error, file=sys.stderr)
+    elif op == "forward" and isinstance(result, dict):
+        print(f"localhost:{result['local_port']} -> {result['remote']}")
+    elif op == "forward" and isinstance(result, list):
+        for stats in result:
+            print(f"{stats['host']}  localhost:{stats['local_port']} -> {stats['remote']}  "
+                  f"{stats['active']} active, {stats['connections']} connections")
+    elif isinstance(result, str):
+        print(result)
+    else:
+        print(json.dumps(result, indent=2))
+
+def _target(args) -> dict:
+
+    host, user = args.host, args.user
+
+    if host and "@" in host:
+        host_user, host = host.rsplit("@", 1)
+        user = user or host_user
+
+    return {
+        "host": host,
+        "user": user,
+        "port": args.port,
+        "ssh_key_filepath": args.key,
+        "password": os.environ.get("REACHER_PASSWORD"),
+    }
+
+def _request(parser, args) -> dict:
+
+    if args.command == "exec":
+        return {"op": "exec", "args": {
+            "command": " ".join(args.remote_command), "build": args.build, "pty": args.pty,
+        }}
+
+    if args.command == "put":
+        return {"op": "put", "args": {
+            "paths": args.paths, "cwd": os.getcwd(), "build": args.build, "destination": args.to,
+            "method": args.method, "delete": args.delete, "workers": args.workers, "compress": args.compress,
+        }}
+
+    if args.command == "get":
+        return {"op": "get", "args": {
+            "paths": args.paths, "build": args.build, "destination": os.path.abspath(args.to),
+            "workers": args.workers, "compress": args.compress, "resumable": args.resumable,
+        }}
+
+    if args.command == "ls":
+        return {"op": "ls", "args": {"folder": args.folder, "build": args.build}}
+
+    if args.command == "sessions":
+        return {"op": "sessions", "args": {"kill": args.kill, "build": args.build}}
+
+    if args.command == "forward":
+        if args.remote_port is None and not (args.list or args.stop):
+            parser.error("forward needs a remote port, --list or --stop")
+        return {"op": "forward", "args": {
+            "remote_port": args.remote_port, "local_port": args.local_port,
+            "remote_host": args.remote_host, "stop": args.stop,
+        }}
+
+def _agent_command(args) -> int:
+
+    if args.action == "run":
+
+        import logging
+        from reacher.agent import Agent
+
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+        Agent(args.socket, idle_timeout=args.idle_timeout).serve_forever()
+
+        return 0
+
+    if args.action == "start":
+        try:
+            _connect_agent(args.socket).close()
+            print("The reacher agent is already running")
+        except OSError:
+            print(f"Started the reacher agent ({start_agent(args.socket, args.idle_timeout)})")
+        return 0
+
+    op = "status" if args.action == "status" else "shutdown"
+
+    try:
+        response = request_agent({"op": op}, _print_event, start=False, socket_path=args.socket)
+    except OSError:
+        print("The reacher agent is not running")
+        return 0 if args.action == "stop" else 1
+
+    _print_response({"op": op}, response)
+
+    return 0
+
+def main(argv=None) -> int:
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--host", "-H", default=os.environ.get("REACHER_HOST"), help="host or user@host")
+    common.add_argument("--user", "-u", default=os.environ.get("REACHER_USER"))
+    common.add_argument("--port", "-p", type=int, default=int(os.environ.get("REACHER_PORT", 22)))
+    common.add_argument(
+        "--key", "-i", default=os.environ.get("REACHER_KEY", os.path.join("~", ".ssh", "id_rsa")),
+        help="private key",
+    )
+    common.add_argument("--build", "-b", default=os.environ.get("REACHER_BUILD"), help="build name")
+    common.add_argument("--no-agent", action="store_true", help="run in this process instead of the agent")
+
+    parser = argparse.ArgumentParser(prog="reacher", description="Reach out to a remote machine")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("exec", parents=[common], help="run a command, in the build path with --build")
+    p.add_argument("remote_command", nargs=argparse.REMAINDER)
+    p.add_argument("--pty", action="store_true", help="run in a pseudo terminal")
+
+    p = commands.add_parser("put", parents=[common], help="upload files to the build path")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--to", help="folder in the build path")
+    p.add_argument("--method", default="scp", choices=["scp", "sync", "tar", "resumable", "objects"])
+    p.add_argument("--delete", action="store_true", help="with sync, delete remote files missing locally")
+    p.add_argument("--workers", type=int)
+    p.add_argument("--compress", action="store_const", const="gzip", help="compress with gzip")
+    p.add_argument("--zstd", dest="compress", action="store_const", const="zstd", help="compress with zstd")
+
+    p = commands.add_parser("get", parents=[common], help="download files from the build path")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--to", default=".", help="local folder")
+    p.add_argument("--workers", type=int)
+    p.add_argument("--compress", action="store_const", const="gzip", help="compress with gzip")
+    p.add_argument("--zstd", dest="compress", action="store_const", const="zstd", help="compress with zstd")
+    p.add_argument("--resumable", action="store_true")
+
+    p = commands.add_parser("ls", parents=[common], help="list the build path")
+    p.add_argument("folder", nargs="?")
+
+    p = commands.add_parser("sessions", parents=[common], help="list or kill named sessions")
+    p.add_argument("--kill", metavar="NAME")
+
+    p = commands.add_parser("forward", parents=[common], help="forward a local port to the remote")
+    p.add_argument("remote_port", type=int, nargs="?")
+    p.add_argument("local_port", type=int, nargs="?", help="picked freely if not given")
+    p.add_argument("--remote-host", help="forward to this host as seen from the remote")
+    p.add_argument("--list", action="store_true", help="list the forwards of the agent")
+    p.add_argument("--stop", action="store_true", help="stop the forwards to the remote")
+
+    p = commands.add_parser("agent", help="manage the background agent")
+    p.add_argument("action", choices=["start", "stop", "status", "run"])
+    p.add_argument("--socket", default=AGENT_SOCKET_PATH)
+    p.add_argument("--idle-timeout", type=float, default=30 * 60, help="seconds, 0 to never stop")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "agent":
+        return _agent_command(args)
+
+    request = _request(parser, args)
+
+    if not (args.command == "forward" and args.list):
+        if not args.host or not _target(args)["user"]:
+            parser.error("the remote is required, pass --host and --user or set REACHER_HOST and REACHER_USER")
+        request["target"] = _target(args)
+
+    try:
+        if args.no_agent:
+            response = request_local(request, _print_event)
+        else:
+            response = request_agent(request, _print_event)
+    except (OSError, RuntimeError) as e:
+        print(f"reacher: {e}", file=sys.stderr)
+        return 1
+
+    if "error" in response:
+        print(f"reacher: {response['error']}", file=sys.stderr)
+        return 1
+
+    _print_response(request, response)
+
+    return response.get("exit_status") or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""Helper process run on the remote by reacher, see reacher.reacher.RemoteHelper.
+
+The script is sent over the channel it then serves and run by the remote
+python3, so it only uses the standard library and sticks to syntax old
+interpreters understand. Requests and responses are JSON objects, each
+preceded by its length as a 4 byte big endian integer, on stdin and
+stdout. A request is `{"op": name, "args": {...}}` and is answered with
+`{"result": ...}` or `{"error": message, "type": exception class}`.
+"""
+
+import os
+import sys
+import json
+import stat
+import base64
+import shutil
+import struct
+import fnmatch
+import hashlib
+
+VERSION = 1
+
+def _path(path):
+    return os.path.expanduser(path)
+
+def _walk(path):
+    """Yield the paths of everything under path, without following links."""
+
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            yield os.path.join(dirpath, name)
+
+def op_ls(path):
+    """Every path under path, like `find path -mindepth 1`."""
+
+    path = _path(path)
+
+    if not os.path.isdir(path):
+        return []
+
+    return list(_walk(path))
+
+def op_stat(path, hashes=False):
+    """{relative path: [size, mtime, sha256 or None]} of the files under path."""
+
+    path = _path(path)
+    entries = {}
+
+    if not os.path.isdir(path):
+        raise FileNotFoundError("No such directory: {}".format(path))
+
+    for p in _walk(path):
+        st = os.lstat(p)
+        if stat.S_ISREG(st.st_mode):
+            entries[os.path.relpath(p, path)] = [st.st_size, st.st_mtime, _hash(p) if hashes else None]
+
+    return entries
+
+def _hash(path, chunk_size=1 << 20):
+
+    h = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+def op_hash(paths):
+    """{path: sha256} of the files, None for the ones that do not exist."""
+
+    hashes = {}
+
+    for p in paths:
+        try:
+            hashes[p] = _hash(_path(p))
+        except FileNotFoundError:
+            hashes[p] = None
+
+    return hashes
+
+def op_missing(paths, base=""):
+    """The paths (relative to base) that do not exist."""
+
+    base = _path(base)
+
+    return [p for p in paths if not os.path.lexists(os.path.join(base, p))]
+
+def op_mkdir(paths):
+
+    for p in paths:
+        os.makedirs(_path(p), exist_ok=True)
+
+def _remove(path):
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def op_remove(paths):
+    """Remove files and trees, like `rm -rf`."""
+
+    for p in paths:
+        _remove(_path(p))
+
+def op_clean(path, keep=()):
+    """Remove everything directly under path except the names containing
+    one of keep."""
+
+    path = _path(path)
+
+    if not os.path.isdir(path):
+        return []
+
+    removed = []
+
+    for name in sorted(os.listdir(path)):
+        if any(fnmatch.fnmatch(name, "*{}*".format(k)) for k in keep):
+            continue
+        _remove(os.path.join(path, name))
+        removed.append(name)
+
+    return removed
+
+def op_chmod(paths, mode, owned=True, linked=True):
+    """Set mode on paths and everything under them, only on the files of
+    this user with owned and not on files with other hardlinks (such as
+    objects of the object store) without linked."""
+
+    uid = os.getuid()
+    changed = 0
+
+    for p in paths:
+        p = _path(p)
+        if not os.path.lexists(p):
+            continue
+        for q in [p] + (list(_walk(p)) if os.path.isdir(p) and not os.path.islink(p) else []):
+            st = os.lstat(q)
+            if stat.S_ISLNK(st.st_mode) or (owned and st.st_uid != uid):
+                continue
+            if not linked and stat.S_ISREG(st.st_mode) and st.st_nlink > 1:
+                continue
+            os.chmod(q, mode)
+            changed += 1
+
+    return changed
+
+def op_unshare(paths):
+    """Remove those of paths that are files with other hardlinks, so a
+    file written there afterwards does not change the other links."""
+
+    removed = 0
+
+    for p in paths:
+        p = _path(p)
+        try:
+            st = os.lstat(p)
+        except FileNotFoundError:
+            continue
+        if stat.S_ISREG(st.st_mode) and st.st_nlink > 1:
+            os.remove(p)
+            removed += 1
+
+    return removed
+
+def op_sessions(path):
+    """[name, pid, exit status or "running" or "lost"] of the sessions whose
+    files are in path, see reacher.reacher.Session."""
+
+    path = _path(path)
+
+    if not os.path.isdir(path):
+        return []
+
+    sessions = []
+
+    for name in sorted(os.listdir(path)):
+
+        if not name.endswith(".pid"):
+            continue
+
+        name = name[:-len(".pid")]
+
+        with open(os.path.join(path, name + ".pid")) as f:
+            pid = f.read().strip()
+
+        try:
+            with open(os.path.join(path, name + ".exit")) as f:
+                status = f.read().strip()
+        except FileNotFoundError:
+            status = ""
+
+        if not status:
+            try:
+                os.kill(int(pid), 0)
+                status = "running"
+            except PermissionError:
+                status = "running"
+            except (OSError, ValueError):
+                status = "lost"
+
+        sessions.append([name, pid, status])
+
+    return sessions
+
+def op_tail(path, offset=0, limit=1 << 20):
+    """Up to limit bytes of path from offset (from the start if the file
+    shrank below it), base64 encoded, and the offset after them."""
+
+    with open(_path(path), "rb") as f:
+
+        size = os.fstat(f.fileno()).st_size
+        if size < offset:
+            offset = 0
+
+        f.seek(offset)
+        data = f.read(limit)
+
+    return {"data": base64.b64encode(data).decode("ascii"), "offset": offset + len(data), "size": size}
+
+OPS = {name[len("op_"):]: fn for name, fn in globals().items() if name.startswith("op_")}
+
+def _read(stream, n):
+
+    data = b""
+
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+
+    return data
+
+def _send(stream, message):
+
+    data = json.dumps(message).encode("utf-8")
+    stream.write(struct.pack(">I", len(data)) + data)
+    stream.flush()
+
+def main():
+
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+
+    _send(stdout, {"version": VERSION, "pid": os.getpid(), "python": sys.version.split()[0]})
+
+    while True:
+
+        header = _read(stdin, 4)
+        if header is None:
+            return
+
+        data = _read(stdin, struct.unpack(">I", header)[0])
+        if data is None:
+            return
+
+        request = json.loads(data.decode("utf-8"))
+
+        try:
+            response = {"result": OPS[request["op"]](**request.get("args", {}))}
+        except Exception as e:
+            response = {"error": str(e), "type": type(e).__name__}
+
+        _send(stdout, response)
+
+if __name__ == "__main__":
+    main()
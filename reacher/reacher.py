@@ -1,682 +1,5796 @@
 
 import os
 from typing import List, Dict, Union
+import re
 import uuid
-from os import system
+import json
+import shlex
+import hashlib
+import secrets
+import tarfile
+import stat
+import zlib
+import mmap
+import struct
+import builtins
+import codecs
+import importlib
+import functools
+import collections
+import csv
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 import os
-from paramiko import AutoAddPolicy, RSAKey, SSHClient
-from paramiko.auth_handler import AuthenticationException, SSHException
-from scp import SCPClient, SCPException
+from contextlib import contextmanager
 import logging
 import socket
 import select
+import selectors
 import sys
 import time
+import threading
+import warnings
+
+class _LazyModule(object):
+    """Stands in for a module that is only imported once it is used.
+
+    paramiko (with cryptography), scp and asyncio make up most of the time
+    it takes to import reacher, and many scripts never need some of them.
+    """
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attr: str):
+
+        module = self.__dict__["_module"]
+
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+
+        return getattr(module, attr)
+
+paramiko = _LazyModule("paramiko")
+scp = _LazyModule("scp")
+asyncio = _LazyModule("asyncio")
+zstandard = _LazyModule("zstandard")
+subprocess = _LazyModule("subprocess")
+
+# Local directory where reacher keeps its state between runs (manifests etc)
+LOCAL_STATE_PATH = os.path.join(os.path.expanduser("~"), ".reacher")
+
+class Span(object):
+    """A timed operation such as a connect, a command or an upload."""
+
+    def __init__(self, metrics: "Metrics", name: str, tags: dict, counter: str = None):
+        self._metrics = metrics
+        self._counter = counter
+        self._counted = metrics.counters[counter] if counter is not None else 0
+        self.name = name
+        self.tags = tags
+        self.started = time.time()
+        self.duration = None
+        self.bytes = 0
+        self.error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc)
+
+    def add(self, n: int):
+        self.bytes += n
+
+    def finish(self, error=None):
+
+        if self.duration is not None:
+            return
+
+        self.duration = time.time() - self.started
+        self.error = str(error) if error is not None else None
+
+        if self._counter is not None:
+            self.bytes += self._metrics.counters[self._counter] - self._counted
+
+        self._metrics._finished(self)
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "started": self.started,
+            "duration": self.duration,
+            "bytes": self.bytes,
+            "error": self.error,
+            "tags": self.tags,
+        }
+
+class _NullSpan(object):
+
+    bytes = 0
+    started = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def add(self, n: int):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+class Metrics(object):
+    """Instrumentation hooks called by RemoteClient, Reacher and PortForwarding.
+
+    This base class ignores everything, so an uninstrumented client pays
+    no more than a method call. Use MetricsRecorder (or FileMetrics) to
+    collect spans, counters and progress.
+    """
+
+    enabled = False
+
+    def span(self, name: str, counter: str = None, **tags):
+        """Time an operation; with counter, the span's bytes are what that
+        counter grew by while the span was open."""
+        return NULL_SPAN
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+    def progress(self, name: str, done: int, total: int):
+        pass
+
+    def mark(self):
+        return None
+
+    def summary(self, mark=None) -> dict:
+        return None
+
+    def flush(self):
+        pass
+
+    def _finished(self, span: Span):
+        pass
+
+def print_progress(name: str, done: int, total: int):
+    """A progress callback for MetricsRecorder printing a single updating line."""
+
+    percent = 100.0 * done / total if total else 100.0
+    end = "\n" if done >= total else ""
+    sys.stdout.write(f"\r{name}: {percent:.2f}%   {end}")
+    sys.stdout.flush()
+
+class MetricsRecorder(Metrics):
+    """Keeps finished spans and counters in memory.
+
+    progress(name, done, total) is called at most every progress_interval
+    seconds per name, and always once done reaches total.
+    """
+
+    enabled = True
+
+    def __init__(self, progress=None, progress_interval: float = 0.5):
+        self.spans = []
+        self.counters = collections.Counter()
+        self._on_progress = progress
+        self._progress_interval = progress_interval
+        self._last_progress = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str, counter: str = None, **tags) -> Span:
+        return Span(self, name, tags, counter)
+
+    def _finished(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def progress(self, name: str, done: int, total: int):
+
+        if self._on_progress is None:
+            return
+
+        now = time.time()
+
+        if done < total and now - self._last_progress.get(name, 0.0) < self._progress_interval:
+            return
+
+        self._last_progress[name] = now
+        self._on_progress(name, done, total)
+
+    def mark(self):
+        """Token to pass to summary() to only report what happens after now."""
+
+        with self._lock:
+            return time.time(), len(self.spans), collections.Counter(self.counters)
+
+    def summary(self, mark=None) -> dict:
+        """Count, total and max duration, bytes and errors per span name, and
+        how much every counter grew, since mark (or since the start)."""
+
+        with self._lock:
+            since, first, counters = mark if mark is not None else (0.0, 0, collections.Counter())
+            spans = self.spans[first:]
+            grown = self.counters - counters
+
+        report = {}
+
+        for span in spans:
+            entry = report.setdefault(span.name, {
+                "count": 0, "duration": 0.0, "max_duration": 0.0, "bytes": 0, "errors": 0,
+            })
+            entry["count"] += 1
+            entry["duration"] += span.duration
+            entry["max_duration"] = max(entry["max_duration"], span.duration)
+            entry["bytes"] += span.bytes
+            entry["errors"] += span.error is not None
+
+        return {
+            "started": since,
+            "duration": time.time() - since if mark is not None else None,
+            "spans": report,
+            "counters": dict(grown),
+        }
+
+class FileMetrics(MetricsRecorder):
+    """MetricsRecorder that appends the spans to a local file on flush(),
+    as CSV if path ends with .csv and as JSON lines otherwise, so results
+    of many runs accumulate in one place."""
+
+    CSV_FIELDS = ["name", "started", "duration", "bytes", "error", "tags"]
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._flushed = 0
+
+    def flush(self):
+
+        with self._lock:
+            spans = self.spans[self._flushed:]
+            self._flushed = len(self.spans)
+
+        if not spans:
+            return
+
+        rows = [span.as_dict() for span in spans]
+
+        if self.path.endswith(".csv"):
+            header = not os.path.isfile(self.path)
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=FileMetrics.CSV_FIELDS)
+                if header:
+                    writer.writeheader()
+                for row in rows:
+                    writer.writerow({**row, "tags": json.dumps(row["tags"])})
+        else:
+            with open(self.path, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+
+class ConnectionManager(object):
+    """Keeps one authenticated SSH transport alive per client.
+
+    The transport is created on first use, kept alive with keepalive packets
+    and transparently re-established if it drops. Channels opened on it are
+    bounded by `max_channels`, and idle SFTP sessions are pooled for reuse.
+
+    window_size and max_packet_size set the flow control window and largest
+    packet of every channel opened on the transport (paramiko defaults to a
+    2MB window, which caps a single stream at 2MB per round trip), ciphers
+    the preferred ciphers in order, e.g. ["aes128-gcm@openssh.com"].
+    """
+
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        ssh_key_filepath: str,
+        port: int = 22,
+        password: str = None,
+        timeout: float = 10,
+        keepalive: int = 30,
+        max_channels: int = 8,
+        metrics: Metrics = None,
+        window_size: int = None,
+        max_packet_size: int = None,
+        ciphers: List[str] = None,
+    ):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.ssh_key_filepath = ssh_key_filepath
+        self.port = port
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.max_channels = max_channels
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.ciphers = ciphers
+
+        self._client = None
+        self._lock = threading.RLock()
+        self._slots = threading.BoundedSemaphore(max_channels)
+        self._sftp_pool = []
+
+    def _transport(self, sock, **kwargs) -> "paramiko.Transport":
+
+        if self.window_size is not None:
+            kwargs["default_window_size"] = self.window_size
+        if self.max_packet_size is not None:
+            kwargs["default_max_packet_size"] = self.max_packet_size
+
+        transport = paramiko.Transport(sock, **kwargs)
+
+        if self.ciphers:
+            options = transport.get_security_options()
+            # the client's order decides which of the ciphers both sides know is used
+            preferred = [c for c in self.ciphers if c in options.ciphers]
+            if not preferred:
+                raise ValueError(f"None of the ciphers {self.ciphers} is supported, pick from {options.ciphers}")
+            options.ciphers = preferred + [c for c in options.ciphers if c not in preferred]
+
+        return transport
+
+    def _connect(self):
+
+        self._close()
+
+        tunables = (self.window_size, self.max_packet_size, self.ciphers)
+        # leave the transport to paramiko unless tuned, older versions lack transport_factory
+        factory = {"transport_factory": self._transport} if any(t is not None for t in tunables) else {}
+
+        try:
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            with self.metrics.span("connect", host=self.host):
+                client.connect(
+                    self.host,
+                    username=self.user,
+                    password=self.password,
+                    key_filename=self.ssh_key_filepath,
+                    timeout=self.timeout,
+                    port=self.port,
+                    **factory,
+                )
+        except paramiko.AuthenticationException as e:
+            logging.error(
+                f"AuthenticationException occurred; did you remember to generate an SSH key "
+                f"and install it with RemoteClient.install_key()? {e}"
+            )
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error occurred while connecting to host: {e}")
+            raise
+
+        if self.keepalive:
+            client.get_transport().set_keepalive(self.keepalive)
+
+        # requests are small and latency bound, don't let Nagle hold them
+        # back waiting for the ACK of the previous packet
+        client.get_transport().sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        logging.info(
+            f"Connected to {self.user}@{self.host}:{self.port} "
+            f"({client.get_transport().remote_cipher})"
+        )
+
+        self._client = client
+
+    @property
+    def is_active(self) -> bool:
+
+        transport = self._client.get_transport() if self._client is not None else None
+
+        return transport is not None and transport.is_active()
+
+    @property
+    def client(self) -> "paramiko.SSHClient":
+
+        with self._lock:
+            if not self.is_active:
+                if self._client is not None:
+                    logging.warning(f"Connection to {self.host} dropped, reconnecting")
+                self._connect()
+            return self._client
+
+    @property
+    def transport(self):
+
+        return self.client.get_transport()
+
+    @contextmanager
+    def slot(self):
+        """Reserve one of the `max_channels` channel slots on the transport."""
+
+        self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def open_session(self):
+
+        self.metrics.count("round_trips")
+
+        try:
+            return self.transport.open_session(timeout=self.timeout)
+        except (paramiko.SSHException, EOFError, socket.error):
+            # the transport may have died between the liveness check and the
+            # request, retry once on a fresh connection. If it is still alive
+            # the remote refused the channel, and reconnecting would only
+            # tear down every other channel in use.
+            if self.is_active:
+                raise
+            return self.transport.open_session(timeout=self.timeout)
+
+    @contextmanager
+    def channel(self):
+
+        with self.slot():
+            chan = self.open_session()
+            try:
+                yield chan
+            finally:
+                chan.close()
+
+    @contextmanager
+    def sftp(self):
+
+        with self.slot():
+
+            with self._lock:
+                transport = self.transport
+                sftp = None
+                while self._sftp_pool and sftp is None:
+                    candidate = self._sftp_pool.pop()
+                    if candidate.get_channel().get_transport() is transport:
+                        sftp = candidate
+                    else:
+                        candidate.close()
+                if sftp is None:
+                    sftp = self._client.open_sftp()
+
+            try:
+                yield sftp
+            except Exception:
+                sftp.close()
+                raise
+            else:
+                with self._lock:
+                    if not sftp.get_channel().closed:
+                        self._sftp_pool.append(sftp)
+
+    def _close(self):
+
+        for sftp in self._sftp_pool:
+            try:
+                sftp.close()
+            except Exception:
+                pass
+
+        self._sftp_pool = []
+
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def close(self):
+
+        with self._lock:
+            self._close()
+
+def file_hash(filepath: str, chunk_size: int = 1 << 20) -> str:
+
+    h = hashlib.sha256()
+
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+# hashing in worker threads only pays off with this many bytes to read
+HASH_POOL_MIN_BYTES = 32 * 1024 * 1024
+
+def hash_files(filepaths: List[str], workers: int = None) -> Dict[str, str]:
+    """sha256 of every file of filepaths, computed in a pool of `workers`
+    threads (one per cpu by default) when there is enough to hash."""
+
+    workers = min(workers or os.cpu_count() or 1, len(filepaths))
+
+    if workers > 1 and sum(os.path.getsize(p) for p in filepaths) >= HASH_POOL_MIN_BYTES:
+
+        # hashlib and file reads release the GIL for chunks this large, so
+        # threads hash in parallel without forking a multithreaded process
+        with ThreadPoolExecutor(workers) as pool:
+            return dict(zip(filepaths, pool.map(file_hash, filepaths)))
+
+    return {p: file_hash(p) for p in filepaths}
+
+def write_tar(fileobj, entries: List[tuple]):
+    """Stream (local_path, path_in_archive) entries as an uncompressed tar to fileobj."""
+
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        for local_path, rel_path in entries:
+            tar.add(local_path, arcname=rel_path, recursive=False)
+
+class TransferResult(object):
+    """Outcome of transferring a single file."""
+
+    def __init__(self, source: str, destination: str, size: int = 0, error: Exception = None):
+        self.source = source
+        self.destination = destination
+        self.size = size
+        self.error = error
+        self.started = time.time()
+        self.duration = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"failed: {self.error}"
+        return f"TransferResult({self.source} -> {self.destination}, {self.size} bytes, {status})"
+
+class ChannelWriter(object):
+    """Minimal file-like object writing straight to a channel's stdin."""
+
+    def __init__(self, chan):
+        self._chan = chan
+        self.bytes = 0
+
+    def write(self, data: bytes) -> int:
+        self._chan.sendall(data)
+        self.bytes += len(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+class Codec(object):
+    """A stream compressor available both as a remote command and locally."""
+
+    def __init__(self, name: str, compress_command: str, decompress_command: str):
+        self.name = name
+        self.compress_command = compress_command
+        self.decompress_command = decompress_command
+
+    @property
+    def available(self) -> bool:
+
+        if self.name != "zstd":
+            return True
+
+        try:
+            zstandard.ZstdCompressor
+        except ImportError:
+            return False
+
+        return True
+
+    def compressobj(self):
+        if self.name == "zstd":
+            return zstandard.ZstdCompressor().compressobj()
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def decompressobj(self):
+        if self.name == "zstd":
+            return zstandard.ZstdDecompressor().decompressobj()
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+CODECS = {
+    "zstd": Codec("zstd", "zstd -c -q", "zstd -d -c -q"),
+    "gzip": Codec("gzip", "gzip -c", "gzip -d -c"),
+}
+
+# files with these extensions are already compressed and are sent as is
+COMPRESSED_EXTS = [
+    ".gz", ".tgz", ".bz2", ".xz", ".zst", ".lz4", ".zip", ".7z", ".rar",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp3", ".mp4", ".mkv", ".avi",
+    ".parquet", ".npz", ".whl",
+]
+
+def is_compressed(filepath: str) -> bool:
+    return any(filepath.lower().endswith(ext) for ext in COMPRESSED_EXTS)
+
+class CompressingWriter(ChannelWriter):
+    """Compresses everything written to it before it goes to the channel."""
+
+    def __init__(self, chan, codec: Codec):
+        super().__init__(chan)
+        self._compressor = codec.compressobj()
+
+    def write(self, data: bytes) -> int:
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self._chan.sendall(compressed)
+            self.bytes += len(compressed)
+        return len(data)
+
+    def close(self):
+        compressed = self._compressor.flush()
+        self._chan.sendall(compressed)
+        self.bytes += len(compressed)
+
+class ChannelReader(object):
+    """File-like object reading a channel's stdout, decompressing it if a codec is given."""
+
+    def __init__(self, chan, codec: Codec = None):
+        self._chan = chan
+        self._decompressor = codec.decompressobj() if codec is not None else None
+        self._buffer = bytearray()
+        self._eof = False
+        self.bytes = 0
+
+    def _fill(self):
+
+        data = self._chan.recv(RemoteClient.TRANSFER_BLOCK_SIZE)
+        self.bytes += len(data)
+
+        if not data:
+            self._eof = True
+            if self._decompressor is not None and hasattr(self._decompressor, "flush"):
+                self._buffer += self._decompressor.flush()
+            return
+
+        if self._decompressor is not None:
+            data = self._decompressor.decompress(data)
+
+        self._buffer += data
+
+    def read(self, size: int = -1) -> bytes:
+
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            self._fill()
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+
+        return data
+
+    def readinto_file(self, f) -> int:
+        """Copy the rest of the stream into f as it arrives, returns the number of bytes written."""
+
+        written = 0
+
+        while True:
+            if self._buffer:
+                f.write(self._buffer)
+                written += len(self._buffer)
+                self._buffer = bytearray()
+            if self._eof:
+                return written
+            self._fill()
+
+class IgnoreRules(object):
+    """Patterns of .gitignore style files compiled to regular expressions.
+
+    Paths are matched relative to the root of a scan with `/` separators.
+    Like git, a pattern containing a `/` is relative to the directory of
+    the file it was read from, other patterns match a name at any depth,
+    a trailing `/` only matches directories, `**` matches across
+    directories and the last matching pattern wins, so `!pattern`
+    includes again what an earlier one excluded.
+    """
+
+    # parsed ignore files, reused as long as the file does not change
+    _cache = {}
+
+    def __init__(self, rules: List[tuple] = None):
+        self.rules = rules if rules is not None else []
+        self._dirs = self._files = None
+
+        if not any(negate for _, negate, _ in self.rules):
+            # without negations a path is ignored if any pattern matches,
+            # which one alternation per kind of entry answers at once
+            self._dirs = re.compile("|".join(f"(?:{r.pattern})" for r, _, _ in self.rules) or "(?!)")
+            self._files = re.compile(
+                "|".join(f"(?:{r.pattern})" for r, _, dir_only in self.rules if not dir_only) or "(?!)"
+            )
+
+    def __len__(self):
+        return len(self.rules)
+
+    @staticmethod
+    def translate(pattern: str) -> str:
+        """Regular expression matching the same paths as the glob pattern."""
+
+        i, n = 0, len(pattern)
+        regex = []
+
+        while i < n:
+
+            c = pattern[i]
+
+            if pattern.startswith("**/", i):
+                regex.append("(?:.*/)?")
+                i += 3
+                continue
+
+            if pattern.startswith("**", i):
+                regex.append(".*")
+                i += 2
+                continue
+
+            if c == "*":
+                regex.append("[^/]*")
+            elif c == "?":
+                regex.append("[^/]")
+            elif c == "[" and pattern.find("]", i + 2) != -1:
+                j = pattern.find("]", i + 2)
+                chars = pattern[i + 1:j].replace("\\", "\\\\")
+                if chars[0] in "!^":
+                    chars = "^" + chars[1:]
+                regex.append(f"[{chars}]")
+                i = j
+            elif c == "\\" and i + 1 < n:
+                i += 1
+                regex.append(re.escape(pattern[i]))
+            else:
+                regex.append(re.escape(c))
+
+            i += 1
+
+        return "".join(regex)
+
+    @classmethod
+    def compile(cls, line: str, base: str = ""):
+        """(regex, negate, dir_only) of a line of an ignore file in the
+        directory base, None for blank lines and comments."""
+
+        line = line.rstrip("\r\n")
+        if not line.endswith("\\ "):
+            line = line.rstrip(" ")
+
+        if not line or line.startswith("#"):
+            return None
+
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+
+        if not line:
+            return None
+
+        anchored = "/" in line
+        regex = cls.translate(line.lstrip("/"))
+
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+
+        if base:
+            regex = re.escape(base + "/") + regex
+
+        return re.compile(regex + r"\Z"), negate, dir_only
+
+    @classmethod
+    def parse(cls, lines: List[str], base: str = "") -> "IgnoreRules":
+
+        return cls([rule for rule in (cls.compile(line, base) for line in lines) if rule is not None])
+
+    @classmethod
+    def load(cls, filepath: str, base: str = "") -> "IgnoreRules":
+        """The rules of the ignore file at filepath in the directory base."""
+
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return cls()
+
+        key = (os.path.abspath(filepath), base)
+        cached = cls._cache.get(key)
+
+        if cached is not None and cached[0] == (st.st_mtime_ns, st.st_size):
+            return cached[1]
+
+        try:
+            with open(filepath, "r", errors="replace") as f:
+                rules = cls.parse(f.readlines(), base)
+        except OSError:
+            return cls()
+
+        cls._cache[key] = ((st.st_mtime_ns, st.st_size), rules)
+
+        return rules
+
+    @classmethod
+    def parse_docker(cls, lines: List[str]) -> "IgnoreRules":
+        """The rules of a .dockerignore: unlike in a .gitignore every
+        pattern is relative to the root of the context and also matches
+        directories without a trailing `/`."""
+
+        rules = []
+
+        for line in lines:
+
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:].strip()
+
+            line = os.path.normpath(line.strip("/")).replace(os.sep, "/")
+            if line == ".":
+                continue
+
+            regex, _, _ = cls.compile("/" + line)
+            rules.append((regex, negate, False))
+
+        return cls(rules)
+
+    def docker_ignored(self, path: str) -> bool:
+        """Whether docker leaves path out of the build context: the last
+        of the rules matching the path or one of its parent directories
+        decides, so `!pattern` can include files of an excluded directory."""
+
+        parts = path.split("/")
+        paths = ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+        ignored = False
+
+        for regex, negate, _ in self.rules:
+            if any(regex.match(p) for p in paths):
+                ignored = not negate
+
+        return ignored
+
+    def extend(self, other: "IgnoreRules") -> "IgnoreRules":
+
+        if not other.rules:
+            return self
+        if not self.rules:
+            return other
+
+        return IgnoreRules(self.rules + other.rules)
+
+    def ignored(self, path: str, is_dir: bool = False) -> bool:
+
+        if not self.rules:
+            return False
+
+        if self._dirs is not None:
+            return (self._dirs if is_dir else self._files).match(path) is not None
+
+        for regex, negate, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path):
+                return not negate
+
+        return False
+
+class TreeScanner(object):
+    """Lists the files of local trees to upload.
+
+    Directories are read with os.scandir and pruned before descending into
+    them when their name is in excludes, they hold a virtualenv or the
+    ignore files (.gitignore and .reacherignore) of the tree or of its
+    enclosing directories up to the working directory ignore them, so a
+    .git, node_modules or venv is never read at all. Files are skipped
+    when their name is in excludes, they end with one of excluded_exts or
+    they are ignored. A file passed explicitly is only checked against
+    excluded_exts. Relative paths are resolved against root, the working
+    directory by default, and keep their path relative to it on the remote.
+    """
+
+    IGNORE_FILENAMES = (".gitignore", ".reacherignore")
+    # marks the root of a virtualenv
+    VIRTUALENV_MARKER = "pyvenv.cfg"
+
+    def __init__(
+        self,
+        excluded_exts: List[str] = [".pyc"],
+        excludes: List[str] = [],
+        ignore_filenames: List[str] = IGNORE_FILENAMES,
+        root: str = None,
+    ):
+        self.excluded_exts = tuple(excluded_exts)
+        self.excludes = set(excludes)
+        self.ignore_filenames = tuple(ignore_filenames)
+        self.cwd = os.path.abspath(root) if root is not None else None
+
+    def _rules(self, dirpath: str, base: str, rules: IgnoreRules, names) -> IgnoreRules:
+
+        for filename in self.ignore_filenames:
+            if filename in names:
+                rules = rules.extend(IgnoreRules.load(os.path.join(dirpath, filename), base))
+
+        return rules
+
+    @staticmethod
+    def root(filepath: str, cwd: str = None) -> str:
+        """The directory paths under filepath are matched relative to: cwd
+        (the working directory by default) if filepath is in it, else
+        filepath itself."""
+
+        path = os.path.abspath(filepath)
+        cwd = cwd or os.getcwd()
+
+        if path == cwd or path.startswith(os.path.join(cwd, "")):
+            return cwd
+
+        return path if os.path.isdir(path) else os.path.dirname(path)
+
+    def _root(self, filepath: str):
+        """The path of filepath the rules match against and the rules of
+        the directories enclosing it."""
+
+        path = os.path.abspath(filepath)
+        cwd = self.root(filepath, self.cwd)
+        rules = IgnoreRules()
+
+        if path == cwd:
+            return "", rules
+
+        base = os.path.relpath(path, cwd).replace(os.sep, "/")
+        dirpath, parts = cwd, base.split("/")[:-1]
+
+        for i in range(len(parts) + 1):
+            try:
+                names = os.listdir(dirpath)
+            except OSError:
+                break
+            rules = self._rules(dirpath, "/".join(parts[:i]), rules, names)
+            if i < len(parts):
+                dirpath = os.path.join(dirpath, parts[i])
+
+        return base, rules
+
+    def resolve(self, filepath: str) -> str:
+        """filepath as the local paths scan yields for it start."""
+
+        return os.path.join(self.cwd, filepath) if self.cwd is not None else filepath
+
+    def scan(self, filepath: str):
+        """Yield (local_path, relative_remote_path, entry) for the files
+        under filepath, in the order of os.walk. entry is the os.DirEntry
+        of the file (None for filepath itself) and caches its stat."""
+
+        top = self.resolve(filepath)
+
+        if not os.path.isdir(top):
+            if os.path.isfile(top) and not top.endswith(self.excluded_exts):
+                yield top, os.path.basename(top), None
+            return
+
+        # remote paths are those of the files relative to root
+        prefix = os.path.relpath(top, self.cwd) if self.cwd is not None else top
+        base, rules = self._root(top)
+        stack = [(top, base, rules, True)]
+
+        while stack:
+
+            dirpath, base, rules, root = stack.pop()
+
+            try:
+                with os.scandir(dirpath) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError:
+                continue
+
+            names = {entry.name for entry in entries}
+
+            if not root and TreeScanner.VIRTUALENV_MARKER in names:
+                continue
+
+            rules = self._rules(dirpath, base, rules, names)
+            subdirs = []
+
+            for entry in entries:
+
+                name = entry.name
+
+                if name in self.excludes:
+                    continue
+
+                path = f"{base}/{name}" if base else name
+
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                if is_dir:
+                    # like os.walk, links to directories are not followed
+                    if not entry.is_symlink() and not rules.ignored(path, True):
+                        subdirs.append((entry.path, path, rules, False))
+                elif not name.endswith(self.excluded_exts) and not rules.ignored(path):
+                    yield entry.path, os.path.normpath(prefix + entry.path[len(top):]), entry
+
+            stack.extend(reversed(subdirs))
+
+    def walk(self, filepath: str):
+        """Yield (local_path, relative_remote_path) for the files under filepath."""
+
+        for local_path, rel_path, _ in self.scan(filepath):
+            yield local_path, rel_path
+
+class HashIndex(object):
+    """sha256 of local files keyed by (device, inode, size, mtime).
+
+    Kept under LOCAL_STATE_PATH between runs, one per TreeScanner root,
+    so files that did not change are never read again, also when they
+    were renamed or the manifest they were recorded in is gone. Entries
+    remember the path of their file; saving drops the entries under the
+    scanned paths that were not looked up, i.e. of deleted or changed
+    files.
+    """
+
+    # files modified this recently may change again within the same mtime
+    RACY_SECONDS = 2.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries = {}
+        self._seen = {}
+        self._scanned = []
+
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    self._entries = json.load(f)
+            except ValueError:
+                logging.warning(f"Ignoring corrupt hash index {path}")
+
+    @classmethod
+    def for_root(cls, root: str) -> "HashIndex":
+
+        key = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()
+
+        return cls(os.path.join(LOCAL_STATE_PATH, "hashes", f"{key}.json"))
+
+    @staticmethod
+    def key(st: os.stat_result) -> str:
+        return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+    def scanned(self, filepath: str):
+        """Record that every file under filepath is looked up."""
+
+        self._scanned.append(os.path.abspath(filepath))
+
+    def get(self, st: os.stat_result, filepath: str) -> str:
+
+        key = self.key(st)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        self._seen[key] = [entry[0], filepath]
+
+        return entry[0]
+
+    def put(self, st: os.stat_result, filepath: str, digest: str):
+
+        if time.time() - st.st_mtime >= HashIndex.RACY_SECONDS:
+            self._seen[self.key(st)] = [digest, filepath]
+
+    def _unscanned(self, filepath: str) -> bool:
+
+        return not any(
+            filepath == path or filepath.startswith(os.path.join(path, "")) for path in self._scanned
+        )
+
+    def save(self):
+
+        entries = dict(self._seen)
+        entries.update(
+            (key, entry) for key, entry in self._entries.items()
+            if key not in self._seen and self._unscanned(entry[1])
+        )
+
+        if entries == self._entries:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.path)
+
+        self._entries = entries
+
+class Manifest(object):
+    """Size, mtime and content hash of every file of an upload.
+
+    Entries are keyed by the path of the file relative to the remote
+    destination, i.e. the same layout `RemoteClient.upload` produces.
+    """
+
+    FILENAME = ".reacher_manifest.json"
+    INDEX_FILENAME = ".reacher_index.json"
+
+    def __init__(self, entries: Dict[str, dict] = None):
+        self.entries = entries if entries is not None else {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path: str):
+        return path in self.entries
+
+    def to_json(self) -> str:
+        return json.dumps(self.entries, sort_keys=True)
+
+    @classmethod
+    def from_json(cls, data: str):
+        return cls(json.loads(data) if data else {})
+
+    @classmethod
+    def load(cls, filepath: str):
+
+        if not os.path.isfile(filepath):
+            return cls()
+
+        try:
+            with open(filepath, "r") as f:
+                return cls.from_json(f.read())
+        except ValueError:
+            logging.warning(f"Ignoring corrupt manifest {filepath}")
+            return cls()
+
+    def save(self, filepath: str):
+
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        tmp = f"{filepath}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.to_json())
+        os.replace(tmp, filepath)
+
+    @staticmethod
+    def walk(filepath: str, excluded_exts: List[str] = [".pyc"], excludes: List[str] = [], root: str = None):
+        """Yield (local_path, relative_remote_path) for everything under filepath.
+
+        Directories and files whose name is in excludes or that are
+        ignored are skipped, see TreeScanner.
+        """
+
+        return TreeScanner(excluded_exts, excludes, root=root).walk(filepath)
+
+    @classmethod
+    def scan(
+        cls,
+        filepaths: List[str],
+        excluded_exts: List[str] = [".pyc"],
+        previous: "Manifest" = None,
+        excludes: List[str] = [],
+        workers: int = None,
+        root: str = None,
+    ):
+        """Build the manifest of filepaths, relative ones resolved against root.
+
+        Files found in the HashIndex of their path, or whose size and mtime
+        match the entry in the previous manifest, are not read again; the
+        others are hashed in a pool of `workers` threads, see hash_files.
+        """
+
+        if not isinstance(filepaths, list):
+            filepaths = [filepaths]
+
+        previous = previous if previous is not None else cls()
+        scanner = TreeScanner(excluded_exts, excludes, root=root)
+        entries = {}
+        pending = []
+        indexes = {}
+
+        for filepath in filepaths:
+
+            path = scanner.resolve(filepath)
+            index_root = TreeScanner.root(path, scanner.cwd)
+            if index_root not in indexes:
+                indexes[index_root] = HashIndex.for_root(index_root)
+            index = indexes[index_root]
+            index.scanned(path)
+            prefix = os.path.abspath(path)
+
+            for local_path, rel_path, entry in scanner.scan(filepath):
+
+                st = entry.stat() if entry is not None else os.stat(local_path)
+                # local_path is path followed by the path in it
+                abs_path = prefix + local_path[len(path):] if entry is not None else prefix
+                digest = index.get(st, abs_path)
+
+                if digest is None:
+                    old = previous.entries.get(rel_path)
+                    if old is not None and old["size"] == st.st_size and old["mtime"] == st.st_mtime:
+                        digest = old["hash"]
+                        index.put(st, abs_path, digest)
+                    else:
+                        pending.append((rel_path, st, index, abs_path))
+
+                entries[rel_path] = {
+                    "size": st.st_size,
+                    "mtime": st.st_mtime,
+                    "hash": digest,
+                    "local": local_path,
+                }
+
+        hashes = hash_files(sorted(set(entries[p]["local"] for p, _, _, _ in pending)), workers)
+
+        for rel_path, st, index, abs_path in pending:
+            entries[rel_path]["hash"] = hashes[entries[rel_path]["local"]]
+            index.put(st, abs_path, entries[rel_path]["hash"])
+
+        for index in indexes.values():
+            index.save()
+
+        return cls(entries)
+
+    def diff(self, remote: "Manifest"):
+        """Return the paths that are new or changed compared to remote, and
+        the paths only present on remote."""
+
+        changed = [
+            p for p, e in self.entries.items()
+            if p not in remote.entries or remote.entries[p]["hash"] != e["hash"]
+        ]
+
+        stale = [p for p in remote.entries if p not in self.entries]
+
+        return changed, stale
+
+class TransferJournal(object):
+    """Sidecar journal of the chunks of a resumable transfer that have been
+    written and checksummed, so the transfer can continue after a failure
+    or a restart of the process."""
+
+    def __init__(self, path: str, source: str, size: int, mtime: float, chunk_size: int):
+        self.path = path
+        self.source = source
+        self.size = size
+        self.mtime = mtime
+        self.chunk_size = chunk_size
+        self.chunks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def n_chunks(self) -> int:
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    def chunk(self, index: int):
+        """(offset, length) of chunk index."""
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    @property
+    def missing(self) -> List[int]:
+        return [i for i in range(self.n_chunks) if i not in self.chunks]
+
+    @classmethod
+    def load(cls, path: str):
+
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except ValueError:
+            return None
+
+        journal = cls(path, data["source"], data["size"], data["mtime"], data["chunk_size"])
+        journal.chunks = {int(i): digest for i, digest in data["chunks"].items()}
+
+        return journal
+
+    def matches(self, source: str, size: int, mtime: float, chunk_size: int) -> bool:
+        return (self.source, self.size, self.mtime, self.chunk_size) == (source, size, mtime, chunk_size)
+
+    def save(self):
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        # chunks finish on several threads, they must not interleave writes
+        # of the temporary file
+        with self._lock:
+            data = {
+                "source": self.source,
+                "size": self.size,
+                "mtime": self.mtime,
+                "chunk_size": self.chunk_size,
+                "chunks": {str(i): digest for i, digest in self.chunks.items()},
+            }
+
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+
+    def record(self, index: int, digest: str):
+
+        with self._lock:
+            self.chunks[index] = digest
+
+        self.save()
+
+    def remove(self):
+
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+class TailBuffer(object):
+    """Keeps the last `limit` characters written to it."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.truncated = False
+        self._chunks = collections.deque()
+        self._size = 0
+
+    def write(self, text: str):
+
+        if not text:
+            return
+
+        self._chunks.append(text)
+        self._size += len(text)
+
+        while self._size > self.limit:
+            dropped = self._chunks.popleft()
+            self._size -= len(dropped)
+            self.truncated = True
+            if self._size < self.limit:
+                keep = self.limit - self._size
+                self._chunks.appendleft(dropped[-keep:])
+                self._size += keep
+
+    def getvalue(self) -> str:
+        return "".join(self._chunks)
+
+class CommandResult(object):
+    """A command running on the remote.
+
+    events() lazily yields ("stdout" | "stderr", text) as output arrives.
+    Both streams are read concurrently, so a command writing a lot to
+    stderr can not stall, and decoded incrementally so multi-byte
+    characters split across packets survive. The last `capture` characters
+    of each stream are kept in stdout/stderr, and exit_status is set once
+    the command has finished.
+    """
+
+    def __init__(
+        self,
+        chan,
+        release=None,
+        capture: int = 16 * 1024 * 1024,
+        timeout: float = None,
+        span: Span = NULL_SPAN,
+    ):
+
+        self.channel = chan
+        self.exit_status = None
+        self.timed_out = False
+        # set by RemoteClient.run_with_input if feeding stdin failed
+        self.input_error = None
+
+        self._release = release
+        self._span = span
+        self._timeout = timeout
+        self._decoders = {
+            "stdout": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+            "stderr": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+        }
+        self._captured = {
+            "stdout": TailBuffer(capture),
+            "stderr": TailBuffer(capture),
+        }
+        self._consumed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self.events()
+
+    @property
+    def stdout(self) -> str:
+        return self._captured["stdout"].getvalue()
+
+    @property
+    def stderr(self) -> str:
+        return self._captured["stderr"].getvalue()
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_status == 0
+
+    def _emit(self, stream: str, data: bytes, final: bool = False):
+
+        self._span.add(len(data))
+        text = self._decoders[stream].decode(data, final=final)
+        self._captured[stream].write(text)
+
+        return text
+
+    def events(self):
+
+        if self._consumed:
+            return
+
+        self._consumed = True
+        chan = self.channel
+        last_received = time.time()
+
+        try:
+            while True:
+
+                received = False
+
+                if chan.recv_ready():
+                    text = self._emit("stdout", chan.recv(RemoteClient.TRANSFER_BLOCK_SIZE))
+                    received = True
+                    if text:
+                        yield "stdout", text
+
+                if chan.recv_stderr_ready():
+                    text = self._emit("stderr", chan.recv_stderr(RemoteClient.TRANSFER_BLOCK_SIZE))
+                    received = True
+                    if text:
+                        yield "stderr", text
+
+                if received:
+                    last_received = time.time()
+                    continue
+
+                if (chan.closed or chan.eof_received) and chan.exit_status_ready():
+                    break
+
+                if self._timeout is not None and time.time() - last_received > self._timeout:
+                    self.timed_out = True
+                    logging.warning(f"No output for {self._timeout}s, giving up on command")
+                    return
+
+                # the exit status does not wake the channel's fd, so poll
+                select.select([chan], [], [], 0.1)
+
+            for stream in ("stdout", "stderr"):
+                text = self._emit(stream, b"", final=True)
+                if text:
+                    yield stream, text
+
+            self.exit_status = chan.recv_exit_status()
+
+        finally:
+            self.close()
+
+    def lines(self):
+        """Like events() but yields complete ("stdout" | "stderr", line) pairs."""
+
+        pending = {"stdout": "", "stderr": ""}
+
+        for stream, text in self.events():
+            pending[stream] += text
+            *complete, pending[stream] = pending[stream].split("\n")
+            for line in complete:
+                yield stream, line.rstrip("\r") + "\n"
+
+        for stream, text in pending.items():
+            if text:
+                yield stream, text
+
+    def wait(self) -> int:
+        """Consume the remaining output and return the exit status."""
+
+        for _ in self.events():
+            pass
+
+        return self.exit_status
+
+    def close(self):
+
+        if self._release is not None:
+            release, self._release = self._release, None
+            self.channel.close()
+            release()
+            if self.timed_out:
+                self._span.finish("timed out")
+            elif self.exit_status is None:
+                self._span.finish("closed before finishing")
+            else:
+                self._span.finish(None if self.ok else f"exit status {self.exit_status}")
+
+class StepResult(object):
+    """Outcome of one step of a CommandBatch."""
+
+    def __init__(self, name: str, command: str, check: bool = True):
+        self.name = name
+        self.command = command
+        self.check = check
+        self.exit_status = None
+        self.output = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_status == 0
+
+    @property
+    def skipped(self) -> bool:
+        return self.exit_status is None
+
+    def __repr__(self):
+        status = "skipped" if self.skipped else f"exit {self.exit_status}"
+        return f"StepResult({self.name}, {status})"
+
+class CommandBatch(object):
+    """Commands collected to run one after another in a single remote shell.
+
+    run() costs one round trip however many steps there are and returns a
+    StepResult per step with its exit status and combined output. A failing
+    step added with check=True ends the batch, the steps after it are
+    reported as skipped.
+    """
+
+    def __init__(self, client: "RemoteClient", wrap=None):
+        self._client = client
+        self._wrap = wrap
+        self.steps = []
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, command: str, name: str = None, check: bool = True) -> "CommandBatch":
+
+        self.steps.append(StepResult(name or command, command, check))
+
+        return self
+
+    def mkdir(self, *paths: str, check: bool = True) -> "CommandBatch":
+        return self.add(f"mkdir -p {' '.join(shlex.quote(p) for p in paths)}", name="mkdir", check=check)
+
+    def remove(self, *paths: str, check: bool = True) -> "CommandBatch":
+        return self.add(f"rm -rf {' '.join(shlex.quote(p) for p in paths)}", name="remove", check=check)
+
+    def script(self, marker: str) -> str:
+
+        lines = []
+
+        for i, step in enumerate(self.steps):
+            # the newline before ) keeps a trailing comment from eating it
+            lines.append(f"( {step.command}\n) 2>&1 </dev/null; s=$?; printf '\\n{marker} %d %d\\n' {i} $s")
+            if step.check:
+                lines.append('[ "$s" -eq 0 ] || exit "$s"')
+
+        return "\n".join(lines)
+
+    def run(self) -> List[StepResult]:
+
+        results = [StepResult(s.name, s.command, s.check) for s in self.steps]
+
+        if not results:
+            return results
+
+        marker = f"--reacher-step-{uuid.uuid4().hex}--"
+        script = self.script(marker)
+        command = self._wrap(script) if self._wrap is not None else f"sh -c {shlex.quote(script)}"
+
+        result = self._client.run(command)
+        result.wait()
+
+        pending, *parts = result.stdout.split(f"\n{marker} ")
+
+        for part in parts:
+            header, _, rest = part.partition("\n")
+            index, status = header.split()
+            results[int(index)].output = pending
+            results[int(index)].exit_status = int(status)
+            pending = rest
+
+        for step in results:
+            if not step.skipped and not step.ok:
+                log = logging.warning if step.check else logging.debug
+                log(f"{step.name} failed on {self._client.host} ({step.exit_status}): {step.output.strip()}")
+
+        if not parts:
+            logging.warning(
+                f"Command batch on {self._client.host} did not start: {(pending + result.stderr).strip()}"
+            )
+
+        return results
+
+class RemoteHelper(object):
+    """A python helper process on the remote, see reacher/helper.py.
+
+    It is started on first use over one channel that it keeps, and answers
+    metadata requests (listing and stat'ing trees, hashing, mkdir, remove,
+    chmod, listing sessions, tailing files) with structured responses at
+    the latency of a round trip on that channel instead of a new channel
+    and shell per query. wrap turns the sh script starting it into the
+    remote command, e.g. to run it in a container.
+
+    Remotes without python3 are remembered, start() then returns False
+    and callers fall back to shell commands.
+    """
+
+    BOOTSTRAP = "import sys; exec(sys.stdin.buffer.read(int(sys.stdin.buffer.readline())))"
+    SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "helper.py")
+
+    # exit status of the start script when there is no python3
+    NO_PYTHON = 127
+
+    def __init__(self, client: "RemoteClient", wrap=None):
+        self._client = client
+        self._wrap = wrap
+        self._chan = None
+        self._lock = threading.Lock()
+        self.available = None
+        self.info = None
+
+    def _command(self) -> str:
+
+        script = (
+            f"command -v python3 > /dev/null 2>&1 || exit {RemoteHelper.NO_PYTHON}; "
+            f"exec python3 -c {shlex.quote(RemoteHelper.BOOTSTRAP)}"
+        )
+
+        return self._wrap(script) if self._wrap is not None else f"sh -c {shlex.quote(script)}"
+
+    @staticmethod
+    def _read(chan, n: int) -> bytes:
+
+        data = b""
+
+        while len(data) < n:
+            chunk = chan.recv(n - len(data))
+            if not chunk:
+                return None
+            data += chunk
+
+        return data
+
+    def _receive(self, chan) -> dict:
+
+        header = self._read(chan, 4)
+        data = self._read(chan, struct.unpack(">I", header)[0]) if header is not None else None
+
+        return json.loads(data.decode("utf-8")) if data is not None else None
+
+    def _start(self) -> bool:
+
+        with open(RemoteHelper.SOURCE_PATH, "rb") as f:
+            source = f.read()
+
+        self._client.metrics.count("commands")
+
+        chan = self._client._connections.open_session()
+        chan.exec_command(self._command())
+        chan.sendall(f"{len(source)}\n".encode("utf-8") + source)
+
+        info = self._receive(chan)
+
+        if info is None:
+            status = chan.recv_exit_status()
+            error = chan.makefile_stderr("rb").read().decode("utf-8", "replace").strip()
+            chan.close()
+            if status == RemoteHelper.NO_PYTHON:
+                logging.info(f"No python3 on {self._client.host}, using shell commands")
+                self.available = False
+            else:
+                logging.warning(f"Starting the helper on {self._client.host} failed ({status}): {error}")
+            return False
+
+        self._chan = chan
+        self.info = info
+        self.available = True
+
+        return True
+
+    @property
+    def running(self) -> bool:
+
+        chan = self._chan
+
+        return chan is not None and not chan.closed and not chan.exit_status_ready()
+
+    def start(self) -> bool:
+        """Start the helper unless it runs, returns whether it is usable."""
+
+        with self._lock:
+            return self._ensure()
+
+    def _ensure(self) -> bool:
+
+        if self.available is False:
+            return False
+
+        if self.running:
+            return True
+
+        self._chan = None
+
+        return self._start()
+
+    def request(self, op: str, **args):
+        """Run op with args on the remote and return its result. The helper
+        is restarted once if it died, e.g. with a dropped connection."""
+
+        message = json.dumps({"op": op, "args": args}).encode("utf-8")
+
+        with self._lock:
+
+            response = None
+
+            for _ in range(2):
+
+                if not self._ensure():
+                    raise IOError(f"The helper on {self._client.host} is not available")
+
+                self._client.metrics.count("round_trips")
+
+                try:
+                    self._chan.sendall(struct.pack(">I", len(message)) + message)
+                    response = self._receive(self._chan)
+                except (socket.error, EOFError, paramiko.SSHException):
+                    response = None
+
+                if response is not None:
+                    break
+
+                self._chan.close()
+                self._chan = None
+
+        if response is None:
+            raise IOError(f"The helper on {self._client.host} went away during {op}")
+
+        if "error" in response:
+            error = getattr(builtins, response.get("type", ""), None)
+            if not (isinstance(error, type) and issubclass(error, OSError)):
+                error = IOError
+            raise error(f"{op} on {self._client.host} failed: {response['error']}")
+
+        return response["result"]
+
+    def close(self):
+
+        with self._lock:
+            if self._chan is not None:
+                self._chan.close()
+                self._chan = None
+
+class RemoteClient:
+    """Client to interact with a remote host via SSH & SCP.
+
+    window_size, max_packet_size and ciphers tune the transport for fast
+    links with high latency, see ConnectionManager. With use_helper,
+    metadata queries go to a RemoteHelper when the remote has python3.
+    It is off by default: the helper is a python3 process kept running on
+    the remote (and, for ReacherDocker, in the container) for as long as
+    the client is connected, which callers have to ask for.
+    """
+
+    # files larger than this are split into ranges transferred in parallel
+    TRANSFER_CHUNK_SIZE = 64 * 1024 * 1024
+    TRANSFER_BLOCK_SIZE = 1024 * 1024
+    SFTP_REQUEST_SIZE = 32768
+    READV_BATCH_SIZE = 8 * 1024 * 1024
+
+    # resumable transfers checksum and journal data in chunks of this size
+    RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024
+    # failed chunk transfers are retried after BACKOFF, 2 * BACKOFF, ... seconds
+    RETRIES = 5
+    BACKOFF = 1.0
+
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        ssh_key_filepath: str,
+        port: int = 22,
+        password: str = None,
+        keepalive: int = 30,
+        max_channels: int = 8,
+        metrics: Metrics = None,
+        install_key: bool = False,
+        window_size: int = None,
+        max_packet_size: int = None,
+        ciphers: List[str] = None,
+        use_helper: bool = False,
+    ):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.ssh_key_filepath = ssh_key_filepath
+        self.port = port
+        self._connections = ConnectionManager(
+            host=host,
+            user=user,
+            ssh_key_filepath=ssh_key_filepath,
+            port=port,
+            password=password,
+            keepalive=keepalive,
+            max_channels=max_channels,
+            metrics=metrics,
+            window_size=window_size,
+            max_packet_size=max_packet_size,
+            ciphers=ciphers,
+        )
+        self._remote_codecs = None
+        self.use_helper = use_helper
+        self._helper = RemoteHelper(self)
+
+        if install_key:
+            self.install_key()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.disconnect()
+
+    @property
+    def connection(self) -> "paramiko.SSHClient":
+        return self._connections.client
+
+    @property
+    def metrics(self) -> Metrics:
+        return self._connections.metrics
+
+    @property
+    def scp(self) -> "scp.SCPClient":
+        return self._scp("upload")
+
+    def _scp(self, direction: str) -> "scp.SCPClient":
+
+        # scp reads files in 16KB pieces by default
+        buff_size = RemoteClient.TRANSFER_BLOCK_SIZE
+
+        if not self.metrics.enabled:
+            return scp.SCPClient(self._connections.transport, buff_size=buff_size)
+
+        counter = "bytes_sent" if direction == "upload" else "bytes_received"
+
+        def progress(filename, size, sent):
+            if isinstance(filename, bytes):
+                filename = filename.decode("utf-8", "replace")
+            self.metrics.progress(f"{direction} {filename}", sent, size)
+            if sent == size:
+                self.metrics.count(counter, size)
+
+        return scp.SCPClient(self._connections.transport, buff_size=buff_size, progress=progress)
+
+    def _get_ssh_key(self):
+        try:
+            self.ssh_key = paramiko.RSAKey.from_private_key_file(self.ssh_key_filepath)
+            logging.info(f"Found SSH key at self {self.ssh_key_filepath}")
+            return self.ssh_key
+        except paramiko.SSHException as e:
+            logging.error(f"SSHException while getting SSH key: {e}")
+        except Exception as e:
+            logging.error(f"Unexpected error while getting SSH key: {e}")
+
+    def install_key(self, force: bool = False) -> bool:
+        """Add the public key of ssh_key_filepath (`<ssh_key_filepath>.pub`)
+        to ~/.ssh/authorized_keys on the remote, authenticating with the
+        password if the key is not accepted yet.
+
+        Installed keys are remembered per user, host, port and key under
+        LOCAL_STATE_PATH, so this is a no-op for a key that was installed
+        before unless force is set. Returns whether the key was installed.
+        """
+
+        public_key_path = f"{self.ssh_key_filepath}.pub"
+
+        with open(public_key_path, "r") as f:
+            public_key = f.read().strip()
+
+        cache_path = os.path.join(LOCAL_STATE_PATH, "installed_keys.json")
+        target = f"{self.user}@{self.host}:{self.port}"
+        fingerprint = hashlib.sha256(public_key.encode("utf-8")).hexdigest()
+
+        installed = {}
+        if os.path.isfile(cache_path):
+            with open(cache_path, "r") as f:
+                installed = json.load(f)
+
+        if not force and fingerprint in installed.get(target, []):
+            return False
+
+        key = shlex.quote(public_key)
+
+        result = self.run(
+            f"umask 077 && mkdir -p ~/.ssh && touch ~/.ssh/authorized_keys && "
+            f"(grep -qxF {key} ~/.ssh/authorized_keys || echo {key} >> ~/.ssh/authorized_keys)"
+        )
+        result.wait()
+
+        if not result.ok:
+            raise IOError(f"Installing {public_key_path} on {self.host} failed: {result.stderr.strip()}")
+
+        installed[target] = sorted(set(installed.get(target, [])) | {fingerprint})
+
+        os.makedirs(LOCAL_STATE_PATH, exist_ok=True)
+        with open(f"{cache_path}.tmp", "w") as f:
+            json.dump(installed, f, indent=2)
+        os.replace(f"{cache_path}.tmp", cache_path)
+
+        logging.info(f"{public_key_path} installed on {target}")
+
+        return True
+
+    @property
+    def helper(self) -> RemoteHelper:
+        """The helper of the host, started on first use. None if it is
+        disabled or the remote has no python3."""
+
+        if self.use_helper and self._helper.start():
+            return self._helper
+
+        return None
+
+    def disconnect(self):
+        self._helper.close()
+        self._connections.close()
+
+    def mkdir(self, *paths: str):
+
+        helper = self.helper
+
+        if helper is not None:
+            helper.request("mkdir", paths=list(paths))
+        else:
+            self.execute_command(f"mkdir -p {' '.join(shlex.quote(p) for p in paths)}", suppress=True)
+
+    def remove(self, *paths: str):
+
+        helper = self.helper
+
+        if helper is not None:
+            helper.request("remove", paths=list(paths))
+        else:
+            self.execute_command(f"rm -rf {' '.join(shlex.quote(p) for p in paths)}", suppress=True)
+
+    def unshare(self, *paths: str):
+        """Remove those of paths that are hardlinks to objects of the object
+        store (or other files), see upload_objects. scp and SFTP write into
+        an existing file, which would change the object and every build
+        linking it, so this is done before writing to them."""
+
+        if not paths:
+            return
+
+        helper = self.helper
+
+        if helper is not None:
+            helper.request("unshare", paths=list(paths))
+            return
+
+        result = self.run_with_input(
+            "while IFS= read -r f; do "
+            "[ -n \"$(find \"$f\" -prune -type f -links +1 2>/dev/null)\" ] && rm -f \"$f\"; done; exit 0",
+            lambda writer: writer.write("".join(f"{p}\n" for p in paths).encode("utf-8")),
+        )
+
+        with result:
+            result.wait()
+
+        if result.exit_status != 0 or result.input_error is not None:
+            raise IOError(f"Unlinking shared files on {self.host} failed: {result.stderr.strip()}")
+
+    def upload_file(self, filepath: str, remote_path: str, excluded_exts: List[str] = [".pyc"]):
+
+        if not any(filepath.endswith(ext) for ext in excluded_exts):
+            with self._connections.slot():
+                self._scp("upload").put(filepath, remote_path)
+            logging.info(f"Finished uploading {filepath} to {remote_path} on {self.host}")
+        else:
+            logging.info(f"Skipping {filepath} due to excluded extension")
+    
+    def _upload(
+        self,
+        filepath: str,
+        remote_path: str,
+        excluded_exts: List[str] = [".pyc"],
+        excludes: List[str] = [],
+        root: str = None,
+    ):
+
+        local_path = os.path.join(root, filepath) if root is not None else filepath
+
+        if os.path.isfile(local_path):
+            # Execute command to create the remote directory
+            self.batch().mkdir(remote_path).run()
+            self.unshare(os.path.join(remote_path, os.path.basename(local_path)))
+            self.upload_file(local_path, remote_path, excluded_exts)
+        else:
+        
+            try:
+                entries = list(Manifest.walk(filepath, excluded_exts, excludes, root=root))
+
+                # Create the remote directories in a single round trip
+                self.batch().mkdir(
+                    remote_path, *sorted(set(
+                        os.path.join(remote_path, os.path.dirname(rel_path)) for _, rel_path in entries
+                    ))
+                ).run()
+
+                self.unshare(*[os.path.join(remote_path, rel_path) for _, rel_path in entries])
+
+                for local_path, rel_path in entries:
+                    self.upload_file(local_path, os.path.join(remote_path, os.path.dirname(rel_path)), excluded_exts)
+                      
+                logging.info(
+                    f"Finished uploading {filepath} files to {remote_path} on {self.host}"
+                )
+
+            except Exception as e:
+                logging.error(f"Unexpected exception during bulk upload: {e}")
+
+    def upload(
+        self,
+        filepaths: List[str],
+        remote_path: str,
+        excluded_exts: List[str] = [".pyc"],
+        method: str = "scp",
+        delete: bool = False,
+        excludes: List[str] = [],
+        workers: int = None,
+        compress: Union[bool, str] = None,
+        objects_path: str = None,
+        root: str = None,
+    ):
+        """Upload filepaths to remote_path.
+
+        method is one of "scp" (one file at a time), "sync" (only changed
+        files), "tar" (a single tar stream), "resumable" (checksummed
+        chunks that survive failures, see put_resumable) or "objects"
+        (hardlinks into the object store at objects_path, see
+        upload_objects). With workers,
+        files are sent over that many SFTP channels in parallel and a
+        TransferResult per file is returned. With compress (True, "gzip" or
+        "zstd") the files are compressed on the fly. Relative filepaths are
+        resolved against root, the working directory by default, and keep
+        their path relative to it under remote_path.
+        """
+
+        if not isinstance(filepaths, list):
+            filepaths = [filepaths]
+
+        with self.metrics.span("upload", counter="bytes_sent", host=self.host, method=method):
+
+            if method == "sync":
+                return self.sync(
+                    filepaths, remote_path, excluded_exts, delete=delete, workers=workers, compress=compress,
+                    excludes=excludes, root=root,
+                )
+
+            if method == "objects":
+                if objects_path is None:
+                    raise ValueError("The objects method needs an objects_path")
+                return self.upload_objects(
+                    filepaths, remote_path, objects_path, excluded_exts, delete=delete, compress=compress,
+                    excludes=excludes, root=root,
+                )
+
+            if compress and method in ("scp", "tar"):
+                return self.upload_compressed(
+                    filepaths, remote_path, excluded_exts, excludes=excludes, compress=compress, root=root,
+                )
+
+            if method == "tar":
+                return self.upload_tar(filepaths, remote_path, excluded_exts, excludes=excludes, root=root)
+
+            if method == "resumable":
+                return self.upload_resumable(
+                    filepaths, remote_path, excluded_exts, excludes=excludes, root=root, workers=workers or 1,
+                )
+
+            if method != "scp":
+                raise ValueError(f"Unknown upload method {method}")
+
+            if workers is not None:
+                return self.parallel_upload(
+                    filepaths, remote_path, excluded_exts, excludes=excludes, workers=workers, root=root,
+                )
+
+            for filepath in filepaths:
+                self._upload(filepath, remote_path, excluded_exts, excludes, root=root)
+
+    def upload_tar(
+        self,
+        filepaths: List[str],
+        remote_path: str,
+        excluded_exts: List[str] = [".pyc"],
+        excludes: List[str] = [],
+        root: str = None,
+    ):
+        """Upload filepaths as a single tar stream piped into `tar -x` on the remote.
+
+        The archive is built on the fly while it is sent, nothing is written
+        to disk on either side. Uses one channel regardless of the number of
+        files, which makes it much faster for trees with many small files.
+        """
+
+        if not isinstance(filepaths, list):
+            filepaths = [filepaths]
+
+        entries = [
+            entry
+            for filepath in filepaths
+            for entry in Manifest.walk(filepath, excluded_exts, excludes, root=root)
+        ]
+
+        self._send_tar(entries, remote_path)
+
+        logging.info(f"Finished uploading {len(entries)} files to {remote_path} on {self.host}")
+
+    def _extract_remote(self, remote_path: str, produce, codec: Codec = None):
+        """Run `tar -x` into remote_path and call produce(writer) to write the archive to it."""
+
+        remote = shlex.quote(remote_path)
+        extract = f"tar --no-same-owner -xf - -C {remote}"
+
+        if codec is not None:
+            extract = f"{codec.decompress_command} | {extract}"
+
+        with self._connections.channel() as chan:
+
+            chan.exec_command(f"mkdir -p {remote} && {extract}")
+
+            writer = ChannelWriter(chan) if codec is None else CompressingWriter(chan, codec)
+
+            try:
+                produce(writer)
+                writer.close()
+                chan.shutdown_write()
+                broken = False
+            except socket.error:
+                # the remote end went away, the exit status tells us why
+                broken = True
+
+            self.metrics.count("bytes_sent", writer.bytes)
+
+            status = chan.recv_exit_status()
+
+            if status != 0 or broken:
+                error = chan.makefile_stderr("rb").read().decode("utf-8", "replace")
+                raise IOError(f"tar upload to {remote_path} on {self.host} failed ({status}): {error}")
+
+    def _send_tar(self, entries: List[tuple], remote_path: str, codec: Codec = None):
+        """Stream (local_path, relative_remote_path) entries as a tar into remote_path."""
+
+        self._extract_remote(remote_path, lambda writer: write_tar(writer, entries), codec)
+
+    def upload_archive(self, archive: str, remote_path: str):
+        """Unpack an existing local tar archive into remote_path."""
+
+        def produce(writer):
+            with open(archive, "rb") as f:
+                for block in iter(lambda: f.read(RemoteClient.TRANSFER_BLOCK_SIZE), b""):
+                    writer.write(block)
+
+        self._extract_remote(remote_path, produce)
+
+        logging.info(f"Finished unpacking {archive} to {remote_path} on {self.host}")
+
+    def _send_entries(self, entries: List[tuple], remote_path: str, codec: Codec = None):
+
+        if codec is None:
+            if entries:
+                self._send_tar(entries, remote_path)
+            return
+
+        packed = [e for e in entries if not is_compressed(e[0])]
+        plain = [e for e in entries if is_compressed(e[0])]
+
+        if packed:
+            self._send_tar(packed, remote_path, codec)
+        if plain:
+            self._send_tar(plain, remote_path)
+
+    @property
+    def remote_codecs(self) -> List[str]:
+        """Names of the compressors installed on the remote, looked up once."""
+
+        if self._remote_codecs is None:
+            result = self.run(
+                "for c in zstd gzip; do command -v $c >/dev/null 2>&1 && echo $c; done"
+            )
+            result.wait()
+            self._remote_codecs = result.stdout.split()
+
+        return self._remote_codecs
+
+    def codec(self, compress: Union[bool, str]) -> Codec:
+        """Resolve compress (True for the best available, or a codec name) to a
+        codec usable on both ends, falling back to gzip and then to None."""
+
+        if not compress:
+            return None
+
+        preferred = ["zstd", "gzip"] if compress is True else [compress, "gzip"]
+
+        for name in preferred:
+            if name not in CODECS:
+                raise ValueError(f"Unknown compression {name}")
+            if CODECS[name].available and name in self.remote_codecs:
+                return CODECS[name]
+            logging.info(f"{name} not available on both ends, falling back")
+
+        logging.warning(f"No compressor available on {self.host}, transferring uncompressed")
+
+        return None
+
+    def upload_compressed(
+        self,
+        filepaths: List[str],
+        remote_path: str,
+        excluded_exts: List[str] = [".pyc"],
+        excludes: List[str] = [],
+        compress: Union[bool, str] = True,
+        root: str = None,
+    ):
+        """Upload filepaths as a tar stream that is compressed locally and
+        decompressed on the remote as it arrives. Already compressed files
+        are sent in a separate, uncompressed stream."""
+
+        if not isinstance(filepaths, list):
+            filepaths = [filepaths]
+
+        entries = [
+            entry
+            for filepath in filepaths
+            for entry in Manifest.walk(filepath, excluded_exts, excludes, root=root)
+        ]
+
+        self._send_entries(entries, remote_path, self.codec(compress))
+
+        logging.info(f"Finished uploading {len(entries)} files to {remote_path} on {self.host}")
+
+    def download_compressed(
+        self,
+        remote_filepath: str,
+        local_path: str,
+        compress: Union[bool, str] = True,
+        workers: int = 4,
+    ):
+        """Download remote_filepath through a compressor running on the remote,
+        decompressing straight into the destination as data arrives.
+
+        Directories are streamed as a compressed tar; files inside them that
+        are already compressed are fetched as is afterwards.
+        """
+
+        codec = self.codec(compress)
+
+        if codec is None:
+            return self.parallel_download(remote_filepath, local_path, workers=workers)
+
+        os.makedirs(local_path, exist_ok=True)
+
+        with self._connections.sftp() as sftp:
+            is_dir = stat.S_ISDIR(sftp.stat(remote_filepath).st_mode)
+
+        if not is_dir and is_compressed(remote_filepath):
+            return self.parallel_download(remote_filepath, local_path, workers=workers)
+
+        if not is_dir:
+            destination = os.path.join(local_path, os.path.basename(remote_filepath))
+            command = f"{codec.compress_command} < {shlex.quote(remote_filepath)}"
+        else:
+            parent, name = os.path.split(os.path.normpath(remote_filepath))
+            excludes = " ".join(f"--exclude={shlex.quote('*' + ext)}" for ext in COMPRESSED_EXTS)
+            command = (
+                f"tar -cf - {excludes} -C {shlex.quote(parent or '/')} -- {shlex.quote(name)}"
+                f" | {codec.compress_command}"
+            )
+
+        with self._connections.channel() as chan:
+
+            chan.exec_command(command)
+            reader = ChannelReader(chan, codec)
+
+            try:
+                if is_dir:
+                    with tarfile.open(fileobj=reader, mode="r|") as tar:
+                        if hasattr(tarfile, "data_filter"):
+                            tar.extractall(local_path, filter="data")
+                        else:
+                            tar.extractall(local_path)
+                else:
+                    with open(destination, "wb") as f:
+                        reader.readinto_file(f)
+            except (tarfile.TarError, zlib.error) as e:
+                raise IOError(f"Corrupt compressed stream for {remote_filepath} from {self.host}: {e}")
+            finally:
+                self.metrics.count("bytes_received", reader.bytes)
+
+            status = chan.recv_exit_status()
+
+            if status != 0:
+                error = chan.makefile_stderr("rb").read().decode("utf-8", "replace")
+                if not is_dir:
+                    os.remove(destination)
+                raise IOError(f"Compressed download of {remote_filepath} from {self.host} failed ({status}): {error}")
+
+        if is_dir:
+            with self._connections.sftp() as sftp:
+                plain = [
+                    (src, os.path.join(local_path, rel_path), size)
+                    for src, rel_path, size in self._remote_walk(sftp, remote_filepath, name)
+                    if is_compressed(src)
+                ]
+            for d in set(os.path.dirname(dst) for _, dst, _ in plain):
+                os.makedirs(d, exist_ok=True)
+            return self.transfer_files(plain, upload=False, workers=workers)
+
+    def _put_range(self, filepath: str, remote_filepath: str, offset: int, length: int, create: bool = False):
+
+        with self._connections.sftp() as sftp:
+            with sftp.open(remote_filepath, "wb" if create else "r+b") as rf:
+                rf.set_pipelined(True)
+                rf.seek(offset)
+                if length > 0:
+                    with open(filepath, "rb") as lf, mmap.mmap(lf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        if len(mm) < offset + length:
+                            raise IOError(f"{filepath} was truncated during upload")
+                        # slices of the mapping are written without copying them out of the page cache
+                        view = memoryview(mm)
+                        try:
+                            block = RemoteClient.TRANSFER_BLOCK_SIZE
+                            for o in range(offset, offset + length, block):
+                                rf.write(view[o:min(o + block, offset + length)])
+                        finally:
+                            view.release()
+
+        self.metrics.count("bytes_sent", length)
+
+    def _get_range(self, remote_filepath: str, filepath: str, offset: int, length: int, create: bool = False):
+
+        block = RemoteClient.SFTP_REQUEST_SIZE
+
+        with self._connections.sftp() as sftp:
+            with sftp.open(remote_filepath, "rb") as rf, open(filepath, "w+b" if create else "r+b") as lf:
+                if length == 0:
+                    return
+                if create:
+                    lf.truncate(offset + length)
+
+                end = offset + length
+
+                def responses():
+                    # paramiko scans its buffered responses on every read, so
+                    # keep the number of requests in flight per readv bounded
+                    for batch in range(offset, end, RemoteClient.READV_BATCH_SIZE):
+                        requests = [
+                            (o, min(block, end - o))
+                            for o in range(batch, min(batch + RemoteClient.READV_BATCH_SIZE, end), block)
+                        ]
+                        for (o, _), data in zip(requests, rf.readv(requests)):
+                            yield o, data
+
+                if os.fstat(lf.fileno()).st_size >= end:
+                    # the destination is preallocated, write the responses
+                    # straight into its mapping
+                    with mmap.mmap(lf.fileno(), 0) as mm:
+                        for o, data in responses():
+                            mm[o:o + len(data)] = data
+                else:
+                    # a file growing as it is downloaded, e.g. the .part of
+                    # sync_down, is appended to in order so its size is always
+                    # how much was written and an interrupted download resumes
+                    lf.seek(offset)
+                    for _, data in responses():
+                        lf.write(data)
+
+        self.metrics.count("bytes_received", length)
+
+    def _create_remote(self, remote_filepath: str, size: int):
+
+        with self._connections.sftp() as sftp:
+            with sftp.open(remote_filepath, "wb") as rf:
+                rf.truncate(size)
+
+    def transfer_files(self, files: List[tuple], upload: bool = True, workers: int = 4) -> List[TransferResult]:
+        """Transfer (source, destination, size) triples over `workers` concurrent SFTP channels.
+
+        Files larger than TRANSFER_CHUNK_SIZE are split into ranges that are
+        written in parallel. Destination directories must already exist.
+        Errors are not raised but reported in the returned TransferResult of
+        the file they occurred for.
+        """
+
+        chunk = RemoteClient.TRANSFER_CHUNK_SIZE
+        results = [TransferResult(src, dst, size) for src, dst, size in files]
+
+        if upload:
+            self.unshare(*[dst for _, dst, _ in files])
+
+        name = "upload" if upload else "download"
+        total = sum(result.size for result in results)
+        done = [0]
+        lock = threading.Lock()
+
+        def run(result, fn, *args, length=0):
+            try:
+                fn(*args)
+            except Exception as e:
+                result.error = result.error or e
+            else:
+                with lock:
+                    done[0] += length
+                    self.metrics.progress(name, done[0], total)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+
+            ranged = []
+            prepared = []
+
+            for result in results:
+                if result.size <= chunk:
+                    fn = self._put_range if upload else self._get_range
+                    prepared.append(pool.submit(
+                        run, result, fn, result.source, result.destination, 0, result.size, True,
+                        length=result.size,
+                    ))
+                elif upload:
+                    # the remote file has to exist at its full size before
+                    # ranges can be written into it
+                    ranged.append((result, pool.submit(
+                        run, result, self._create_remote, result.destination, result.size,
+                    )))
+                else:
+                    try:
+                        with open(result.destination, "wb") as f:
+                            f.truncate(result.size)
+                    except Exception as e:
+                        result.error = e
+                    ranged.append((result, None))
+
+            futures = list(prepared)
+
+            for result, created in ranged:
+                if created is not None:
+                    created.result()
+                if result.error is not None:
+                    continue
+                fn = self._put_range if upload else self._get_range
+                for offset in range(0, result.size, chunk):
+                    futures.append(pool.submit(
+                        run, result, fn, result.source, result.destination,
+                        offset, min(chunk, result.size - offset),
+                        length=min(chunk, result.size - offset),
+                    ))
+
+            for f in futures:
+                f.result()
+
+        for result in results:
+            result.duration = time.time() - result.started
+            if result.ok:
+                logging.info(f"Finished transferring {result.source} to {result.destination} on {self.host}")
+            else:
+                logging.error(f"Failed transferring {result.source} to {result.destination} on {self.host}: {result.error}")
+
+        return results
+
+    def parallel_upload(
+        self,
+        filepaths: List[str],
+        remote_path: str,
+        excluded_exts: List[str] = [".pyc"],
+        excludes: List[str] = [],
+        workers: int = 4,
+        root: str = None,
+    ) -> List[TransferResult]:
+
+        if not isinstance(filepaths, list):
+            filepaths = [filepaths]
+
+        files = [
+            (local_path, os.path.join(remote_path, rel_path), os.path.getsize(local_path))
+            for filepath in filepaths
+            for local_path, rel_path in Manifest.walk(filepath, excluded_exts, excludes, root=root)
+        ]
+
+        remote_dirs = sorted(set(os.path.dirname(dst) for _, dst, _ in files) | {remote_path})
+
+        self.mkdir(*remote_dirs)
+
+        return self.transfer_files(files, upload=True, workers=workers)
+
+    def _remote_walk(self, sftp, remote_path: str, rel_path: str):
+
+        attr = sftp.stat(remote_path)
+
+        if not stat.S_ISDIR(attr.st_mode):
+            yield remote_path, rel_path, attr.st_size
+            return
+
+        for entry in sftp.listdir_attr(remote_path):
+            yield from self._remote_walk(
+                sftp,
+                os.path.join(remote_path, entry.filename),
+                os.path.join(rel_path, entry.filename),
+            )
+
+    def parallel_download(
+        self,
+        remote_filepaths: List[str],
+        local_path: str,
+        workers: int = 4,
+    ) -> List[TransferResult]:
+
+        if not isinstance(remote_filepaths, list):
+            remote_filepaths = [remote_filepaths]
+
+        files = []
+        missing = []
+
+        with self._connections.sftp() as sftp:
+            for remote_filepath in remote_filepaths:
+                try:
+                    for src, rel_path, size in self._remote_walk(
+                        sftp, remote_filepath, os.path.basename(os.path.normpath(remote_filepath)),
+                    ):
+                        files.append((src, os.path.join(local_path, rel_path), size))
+                except IOError as e:
+                    logging.error(f"Failed listing {remote_filepath} on {self.host}: {e}")
+                    missing.append(TransferResult(remote_filepath, local_path, error=e))
+
+        for d in set(os.path.dirname(dst) for _, dst, _ in files) | {local_path}:
+            os.makedirs(d, exist_ok=True)
+
+        return missing + self.transfer_files(files, upload=False, workers=workers)
+
+    def index(self, remote_path: str, hashes: bool = False) -> Manifest:
+        """Manifest of every file under remote_path (relative paths, size,
+        mtime and optionally sha256) from a single remote listing."""
+
+        helper = self.helper
+
+        if helper is not None:
+            return Manifest({
+                path: {"size": size, "mtime": mtime, "hash": digest}
+                for path, (size, mtime, digest) in helper.request("stat", path=remote_path, hashes=hashes).items()
+            })
+
+        remote = shlex.quote(remote_path)
+        separator = "--reacher-hashes--"
+
+        command = f"cd {remote} && find . -type f -printf '%P\\t%s\\t%T@\\n'"
+        if hashes:
+            command = f"{command} && echo {separator} && find . -type f -exec sha256sum {{}} +"
+
+        result = self.run(command)
+        result.wait()
+
+        if result.exit_status != 0:
+            if "printf" not in result.stderr:
+                raise IOError(f"Listing {remote_path} on {self.host} failed: {result.stderr.strip()}")
+            # no GNU find on the remote, walk it over SFTP instead
+            return self._sftp_index(remote_path)
+
+        listing, _, hashed = result.stdout.partition(f"{separator}\n")
+
+        entries = {}
+
+        for line in listing.splitlines():
+            path, size, mtime = line.rsplit("\t", 2)
+            entries[path] = {"size": int(size), "mtime": float(mtime), "hash": None}
+
+        for line in hashed.splitlines():
+            digest, path = line.split("  ", 1)
+            path = os.path.normpath(path)
+            if path in entries:
+                entries[path]["hash"] = digest
+
+        return Manifest(entries)
+
+    def _sftp_index(self, remote_path: str) -> Manifest:
+
+        entries = {}
+
+        with self._connections.sftp() as sftp:
+
+            def walk(path, rel_path):
+                for attr in sftp.listdir_attr(path):
+                    rel = os.path.join(rel_path, attr.filename) if rel_path else attr.filename
+                    if stat.S_ISDIR(attr.st_mode):
+                        walk(os.path.join(path, attr.filename), rel)
+                    else:
+                        entries[rel] = {"size": attr.st_size, "mtime": float(attr.st_mtime), "hash": None}
+
+            walk(remote_path, "")
+
+        return Manifest(entries)
+
+    def sync_down(
+        self,
+        remote_path: str,
+        local_path: str,
+        hashes: bool = False,
+        workers: int = 4,
+    ) -> List[TransferResult]:
+        """Download only the files under remote_path that are new or changed
+        since the last sync_down into local_path.
+
+        The remote index of the last sync is cached in local_path. Files are
+        downloaded to a `.part` file first; an interrupted download of a file
+        that has not changed since is resumed where it stopped.
+        """
+
+        with self.metrics.span("download", counter="bytes_received", host=self.host, method="sync"):
+
+            index_path = os.path.join(local_path, Manifest.INDEX_FILENAME)
+
+            cached = Manifest.load(index_path)
+            remote = self.index(remote_path, hashes=hashes)
+
+            def unchanged(path, entry):
+                old = cached.entries.get(path)
+                local_file = os.path.join(local_path, path)
+                if old is None or not old.get("complete", True):
+                    return False
+                if not os.path.isfile(local_file) or os.path.getsize(local_file) != entry["size"]:
+                    return False
+                if entry["hash"] is not None and old.get("hash") == entry["hash"]:
+                    return True
+                return old["size"] == entry["size"] and old["mtime"] == entry["mtime"]
+
+            todo = []
+
+            for path, entry in remote.entries.items():
+
+                if unchanged(path, entry):
+                    remote.entries[path] = {**cached.entries[path], **entry, "complete": True}
+                    continue
+
+                part = os.path.join(local_path, path) + ".part"
+                old = cached.entries.get(path)
+
+                offset = 0
+                if (
+                    old is not None and not old.get("complete", True)
+                    and old["size"] == entry["size"] and old["mtime"] == entry["mtime"]
+                    and os.path.isfile(part) and os.path.getsize(part) <= entry["size"]
+                ):
+                    offset = os.path.getsize(part)
+
+                remote.entries[path] = {**entry, "complete": False}
+                todo.append((path, offset))
+
+            os.makedirs(local_path, exist_ok=True)
+
+            # record the downloads as in progress so they can be resumed
+            merged = Manifest({**remote.entries})
+            merged.save(index_path)
+
+            def download(path, offset):
+
+                entry = remote.entries[path]
+                local_file = os.path.join(local_path, path)
+                part = local_file + ".part"
+
+                os.makedirs(os.path.dirname(local_file), exist_ok=True)
+
+                if offset == 0:
+                    open(part, "wb").close()
+
+                self._get_range(
+                    os.path.join(remote_path, path), part, offset, entry["size"] - offset,
+                )
+
+                os.replace(part, local_file)
+
+            results = []
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+
+                futures = []
+
+                for path, offset in todo:
+                    result = TransferResult(
+                        os.path.join(remote_path, path), os.path.join(local_path, path), remote.entries[path]["size"],
+                    )
+                    results.append(result)
+                    futures.append((result, path, pool.submit(download, path, offset)))
+
+                for result, path, future in futures:
+                    try:
+                        future.result()
+                        merged.entries[path]["complete"] = True
+                    except Exception as e:
+                        result.error = e
+                        logging.error(f"Failed downloading {result.source} from {self.host}: {e}")
+                    result.duration = time.time() - result.started
+
+            merged.save(index_path)
+
+            logging.info(
+                f"Synced {remote_path} from {self.host}: {sum(r.ok for r in results)} downloaded, "
+                f"{len(remote) - len(results)} unchanged"
+            )
+
+            return results
+
+    def _retry(self, fn, what: str, retries: int = None, backoff: float = None):
+        """Call fn, retrying failures with exponential backoff."""
+
+        retries = RemoteClient.RETRIES if retries is None else retries
+        backoff = RemoteClient.BACKOFF if backoff is None else backoff
+
+        for attempt in range(retries + 1):
+            try:
+                return fn()
+            except (OSError, EOFError, paramiko.SSHException) as e:
+                if attempt == retries:
+                    raise
+                delay = backoff * 2 ** attempt
+                logging.warning(f"{what} on {self.host} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def remote_sha256(self, remote_filepath: str) -> str:
+
+        helper = self.helper
+
+        if helper is not None:
+            digest = helper.request("hash", paths=[remote_filepath])[remote_filepath]
+            if digest is None:
+                raise IOError(f"Could not hash {remote_filepath} on {self.host}: no such file")
+            return digest
+
+        path = shlex.quote(remote_filepath)
+
+        result = self.run(f"sha256sum -- {path} 2>/dev/null || shasum -a 256 -- {path}")
+        result.wait()
+
+        if result.exit_status != 0:
+            raise IOError(f"Could not hash {remote_filepath} on {self.host}: {result.stderr.strip()}")
+
+        return result.stdout.split()[0]
+
+    def get_resumable(
+        self,
+        remote_filepath: str,
+        local_filepath: str,
+        chunk_size: int = None,
+        retries: int = None,
+        backoff: float = None,
+        workers: int = 1,
+    ) -> TransferResult:
+        """Download remote_filepath in checksummed chunks that survive failures.
+
+        Data goes to `<local_filepath>.part` and every chunk written is
+        recorded with its sha256 in a `<local_filepath>.reacher-journal`
+        sidecar. Calling this again (in this or another process) verifies the
+        recorded chunks and only fetches the rest, as long as the remote file
+        did not change. The file is only moved into place once its sha256
+        matches the remote one.
+        """
+
+        chunk_size = chunk_size or RemoteClient.RESUMABLE_CHUNK_SIZE
+
+        if os.path.isdir(local_filepath):
+            local_filepath = os.path.join(local_filepath, os.path.basename(remote_filepath))
+
+        part = f"{local_filepath}.part"
+        result = TransferResult(remote_filepath, local_filepath)
+
+        def stat_remote():
+            with self._connections.sftp() as sftp:
+                return sftp.stat(remote_filepath)
+
+        attr = self._retry(stat_remote, f"stat {remote_filepath}", retries, backoff)
+        result.size = attr.st_size
+
+        journal = TransferJournal.load(f"{local_filepath}.reacher-journal")
+
+        if (
+            journal is None or not os.path.isfile(part)
+            or not journal.matches(remote_filepath, attr.st_size, attr.st_mtime, chunk_size)
+        ):
+            journal = TransferJournal(
+                f"{local_filepath}.reacher-journal", remote_filepath, attr.st_size, attr.st_mtime, chunk_size,
+            )
+            os.makedirs(os.path.dirname(os.path.abspath(local_filepath)), exist_ok=True)
+            with open(part, "wb") as f:
+                f.truncate(attr.st_size)
+            journal.save()
+        else:
+            # only trust chunks that still checksum correctly on disk
+            with open(part, "rb") as f:
+                for index, digest in list(journal.chunks.items()):
+                    offset, length = journal.chunk(index)
+                    f.seek(offset)
+                    if hashlib.sha256(f.read(length)).hexdigest() != digest:
+                        del journal.chunks[index]
+            logging.info(
+                f"Resuming download of {remote_filepath}, {len(journal.chunks)}/{journal.n_chunks} chunks done"
+            )
+
+        def fetch(index):
+
+            offset, length = journal.chunk(index)
+
+            def attempt():
+                with self._connections.sftp() as sftp:
+                    with sftp.open(remote_filepath, "rb") as rf:
+                        return b"".join(rf.readv([(offset, length)]))
+
+            data = self._retry(attempt, f"download of {remote_filepath}", retries, backoff)
+
+            if len(data) != length:
+                raise IOError(f"Short read of {remote_filepath} at {offset}")
+
+            with open(part, "r+b") as f:
+                f.seek(offset)
+                f.write(data)
+
+            journal.record(index, hashlib.sha256(data).hexdigest())
+
+            self.metrics.count("bytes_received", length)
+            self.metrics.progress(
+                f"download {remote_filepath}", len(journal.chunks) * chunk_size, journal.n_chunks * chunk_size,
+            )
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(fetch, journal.missing))
+
+            remote_digest = self._retry(
+                lambda: self.remote_sha256(remote_filepath), f"hash of {remote_filepath}", retries, backoff,
+            )
+
+            if file_hash(part) != remote_digest:
+                # start over next time rather than resuming corrupt data
+                journal.remove()
+                raise IOError(f"Integrity check of {remote_filepath} failed, sha256 mismatch")
+
+            os.replace(part, local_filepath)
+            journal.remove()
+
+        except Exception as e:
+            result.error = e
+            logging.error(f"Resumable download of {remote_filepath} from {self.host} failed: {e}")
+
+        result.duration = time.time() - result.started
+
+        return result
+
+    def _remote_chunk_hashes(self, remote_filepath: str, journal: TransferJournal) -> Dict[int, str]:
+        """sha256 of the journaled chunks of remote_filepath, computed on the remote in one go."""
+
+        if not journal.chunks:
+            return {}
+
+        indices = " ".join(str(i) for i in sorted(journal.chunks))
+
+        result = self.run(
+            f"f={shlex.quote(remote_filepath)}; for i in {indices}; do "
+            f"printf '%s ' $i; dd if=\"$f\" bs={journal.chunk_size} skip=$i count=1 2>/dev/null | sha256sum; "
+            f"done"
+        )
+        result.wait()
+
+        hashes = {}
+
+        for line in result.stdout.splitlines():
+            parts = line.split()
+            if len(parts) >= 2:
+                hashes[int(parts[0])] = parts[1]
+
+        return hashes
+
+    def put_resumable(
+        self,
+        local_filepath: str,
+        remote_filepath: str,
+        chunk_size: int = None,
+        retries: int = None,
+        backoff: float = None,
+        workers: int = 1,
+    ) -> TransferResult:
+        """Upload local_filepath in checksummed chunks that survive failures.
+
+        Data goes to `<remote_filepath>.part`; the journal of written chunks
+        is kept locally under LOCAL_STATE_PATH. On resume the journaled chunks
+        are re-hashed on the remote in a single command and only the missing
+        or corrupt ones are sent again. The file is renamed into place once
+        its remote sha256 matches the local one.
+        """
+
+        chunk_size = chunk_size or RemoteClient.RESUMABLE_CHUNK_SIZE
+
+        st = os.stat(local_filepath)
+        source = os.path.abspath(local_filepath)
+        part = f"{remote_filepath}.part"
+        result = TransferResult(local_filepath, remote_filepath, st.st_size)
+
+        key = hashlib.sha1(
+            f"{self.user}@{self.host}:{self.port}:{remote_filepath}".encode("utf-8")
+        ).hexdigest()
+        journal_path = os.path.join(LOCAL_STATE_PATH, "journals", f"{key}.json")
+
+        journal = TransferJournal.load(journal_path)
+
+        try:
+            if journal is not None and journal.matches(source, st.st_size, st.st_mtime, chunk_size):
+
+                remote_hashes = self._retry(
+                    lambda: self._remote_chunk_hashes(part, journal), f"verify {part}", retries, backoff,
+                )
+
+                for index, digest in list(journal.chunks.items()):
+                    if remote_hashes.get(index) != digest:
+                        del journal.chunks[index]
+
+                if not journal.chunks:
+                    # nothing usable is left, the .part may well be gone
+                    # (e.g. removed by Reacher.cleanup), so start it over
+                    self._retry(
+                        lambda: self._create_remote(part, st.st_size), f"create {part}", retries, backoff,
+                    )
+
+                journal.save()
+
+                logging.info(
+                    f"Resuming upload of {local_filepath}, {len(journal.chunks)}/{journal.n_chunks} chunks done"
+                )
+
+            else:
+
+                journal = TransferJournal(journal_path, source, st.st_size, st.st_mtime, chunk_size)
+
+                self._retry(
+                    lambda: self._create_remote(part, st.st_size), f"create {part}", retries, backoff,
+                )
+
+                journal.save()
+
+            def send(index):
+
+                offset, length = journal.chunk(index)
+
+                with open(local_filepath, "rb") as f:
+                    f.seek(offset)
+                    data = f.read(length)
+
+                def attempt():
+                    with self._connections.sftp() as sftp:
+                        with sftp.open(part, "r+b") as rf:
+                            rf.set_pipelined(True)
+                            rf.seek(offset)
+                            rf.write(data)
+
+                self._retry(attempt, f"upload of {local_filepath}", retries, backoff)
+
+                journal.record(index, hashlib.sha256(data).hexdigest())
+
+                self.metrics.count("bytes_sent", length)
+                self.metrics.progress(
+                    f"upload {local_filepath}", len(journal.chunks) * chunk_size, journal.n_chunks * chunk_size,
+                )
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(send, journal.missing))
+
+            remote_digest = self._retry(
+                lambda: self.remote_sha256(part), f"hash of {part}", retries, backoff,
+            )
+
+            if remote_digest != file_hash(local_filepath):
+                journal.remove()
+                raise IOError(f"Integrity check of {remote_filepath} failed, sha256 mismatch")
+
+            with self._connections.sftp() as sftp:
+                try:
+                    sftp.posix_rename(part, remote_filepath)
+                except IOError:
+                    # servers without the posix-rename extension refuse to
+                    # rename over an existing file
+                    try:
+                        sftp.remove(remote_filepath)
+                    except IOError:
+                        pass
+                    sftp.rename(part, remote_filepath)
+
+            journal.remove()
+
+        except Exception as e:
+            result.error = e
+            logging.error(f"Resumable upload of {local_filepath} to {self.host} failed: {e}")
+
+        result.duration = time.time() - result.started
+
+        return result
+
+    def upload_resumable(
+        self,
+        filepaths: List[str],
+        remote_path: str,
+        excluded_exts: List[str] = [".pyc"],
+        excludes: List[str] = [],
+        root: str = None,
+        **kwargs,
+    ) -> List[TransferResult]:
+
+        entries = [
+            entry
+            for filepath in filepaths
+            for entry in Manifest.walk(filepath, excluded_exts, excludes, root=root)
+        ]
+
+        remote_dirs = sorted(
+            set(os.path.dirname(os.path.join(remote_path, rel)) for _, rel in entries) | {remote_path}
+        )
+
+        self.mkdir(*remote_dirs)
+
+        return [
+            self.put_resumable(local_path, os.path.join(remote_path, rel_path), **kwargs)
+            for local_path, rel_path in entries
+        ]
+
+    def download_resumable(self, remote_filepath: str, local_path: str, **kwargs) -> List[TransferResult]:
+
+        with self._connections.sftp() as sftp:
+            files = list(self._remote_walk(
+                sftp, remote_filepath, os.path.basename(os.path.normpath(remote_filepath)),
+            ))
+
+        return [
+            self.get_resumable(src, os.path.join(local_path, rel_path), **kwargs)
+            for src, rel_path, _ in files
+        ]
+
+    def read_file(self, remote_filepath: str) -> bytes:
+
+        with self._connections.sftp() as sftp:
+            with sftp.open(remote_filepath, "rb") as f:
+                return f.read()
+
+    def write_file(self, remote_filepath: str, data: bytes):
+
+        with self._connections.sftp() as sftp:
+            with sftp.open(remote_filepath, "wb") as f:
+                f.write(data)
+
+    def _local_manifest_path(self, remote_path: str) -> str:
+
+        key = hashlib.sha1(
+            f"{self.user}@{self.host}:{self.port}:{remote_path}".encode("utf-8")
+        ).hexdigest()
+
+        return os.path.join(LOCAL_STATE_PATH, "manifests", f"{key}.json")
+
+    def _remote_manifest(self, manifest_path: str) -> Manifest:
+
+        try:
+            return Manifest.from_json(self.read_file(manifest_path).decode("utf-8"))
+        except IOError:
+            return Manifest()
+        except ValueError:
+            logging.warning(f"Ignoring corrupt remote manifest {manifest_path}")
+            return Manifest()
+
+    def sync(
+        self,
+        filepaths: List[str],
+        remote_path: str,
+        excluded_exts: List[str] = [".pyc"],
+        delete: bool = False,
+        workers: int = None,
+        compress: Union[bool, str] = None,
+        manifest: Manifest = None,
+        excludes: List[str] = [],
+        root: str = None,
+    ):
+        """Upload only the files that are new or changed since the last sync.
+
+        A manifest of (size, mtime, hash) for every file is kept locally and
+        under remote_path on the remote; the two are compared to decide what
+        to send. With delete, files from a previous sync that no longer exist
+        locally are removed from the remote. An already scanned manifest of
+        filepaths can be passed to skip scanning them again.
+        """
+
+        if not isinstance(filepaths, list):
+            filepaths = [filepaths]
+
+        local_manifest_path = self._local_manifest_path(remote_path)
+        remote_manifest_path = os.path.join(remote_path, Manifest.FILENAME)
+
+        if manifest is not None:
+            local = Manifest(dict(manifest.entries))
+        else:
+            local = Manifest.scan(
+                filepaths, excluded_exts, previous=Manifest.load(local_manifest_path), excludes=excludes,
+                root=root,
+            )
+        remote = self._remote_manifest(remote_manifest_path)
+
+        changed, stale = local.diff(remote)
+
+        remote_dirs = sorted(set(
+            os.path.dirname(os.path.join(remote_path, p)) for p in changed
+        ) | {remote_path})
+
+        self.mkdir(*remote_dirs)
+
+        if compress:
+            self._send_entries(
+                [(local.entries[p]["local"], p) for p in changed],
+                remote_path,
+                self.codec(compress),
+            )
+        elif workers is not None:
+            results = self.transfer_files(
+                [
+                    (local.entries[p]["local"], os.path.join(remote_path, p), local.entries[p]["size"])
+                    for p in changed
+                ],
+                upload=True,
+                workers=workers,
+            )
+            # do not record files that failed so they are retried next time
+            for result in results:
+                if not result.ok:
+                    p = os.path.relpath(result.destination, remote_path)
+                    if p in remote.entries:
+                        local.entries[p] = remote.entries[p]
+                    else:
+                        del local.entries[p]
+        else:
+            self.unshare(*[os.path.join(remote_path, p) for p in changed])
+            for p in changed:
+                self.upload_file(
+                    local.entries[p]["local"],
+                    os.path.dirname(os.path.join(remote_path, p)),
+                    excluded_exts,
+                )
+
+        if delete and len(stale) > 0:
+            self.remove(*[os.path.join(remote_path, p) for p in stale])
+        else:
+            # keep tracking files we did not delete so a later sync with
+            # delete can still remove them
+            for p in stale:
+                local.entries.setdefault(p, remote.entries[p])
+
+        self.write_file(remote_manifest_path, local.to_json().encode("utf-8"))
+        local.save(local_manifest_path)
+
+        logging.info(
+            f"Synced {remote_path} on {self.host}: {len(changed)} uploaded, "
+            f"{len(local) - len(changed)} unchanged, {len(stale) if delete else 0} deleted"
+        )
+
+        return changed, stale
+
+    @staticmethod
+    def _object_key(local_path: str, digest: str) -> str:
+        """Path of the object holding local_path, relative to the object store.
+
+        The executable bit is part of the key since all hardlinks to an
+        object share its mode.
+        """
+
+        executable = os.stat(local_path).st_mode & stat.S_IXUSR
+
+        return f"{digest[:2]}/{digest}{'.x' if executable else ''}"
+
+    def missing_objects(self, objects_path: str, keys: List[str]) -> List[str]:
+        """The keys of the object store at objects_path that are not on the remote."""
+
+        if not keys:
+            return []
+
+        helper = self.helper
+
+        if helper is not None:
+            return helper.request("missing", paths=keys, base=objects_path)
+
+        result = self.run_with_input(
+            f"cd {shlex.quote(objects_path)} 2>/dev/null || {{ cat; exit 0; }}; "
+            f"while read -r k; do [ -e \"$k\" ] || echo \"$k\"; done",
+            lambda writer: writer.write("".join(f"{k}\n" for k in keys).encode("utf-8")),
+        )
+
+        with result:
+            missing = [line.strip() for stream, line in result.lines() if stream == "stdout" and line.strip()]
+
+        if result.exit_status != 0 or result.input_error is not None:
+            raise IOError(f"Looking up objects in {objects_path} on {self.host} failed: {result.stderr.strip()}")
+
+        return missing
+
+    def upload_objects(
+        self,
+        filepaths: List[str],
+        remote_path: str,
+        objects_path: str,
+        excluded_exts: List[str] = [".pyc"],
+        delete: bool = False,
+        compress: Union[bool, str] = None,
+        manifest: Manifest = None,
+        excludes: List[str] = [],
+        root: str = None,
+    ):
+        """Upload filepaths to remote_path through the content addressed
+        object store at objects_path.
+
+        Files are stored once per host as `<objects_path>/<hash[:2]>/<hash>`,
+        read only, and remote_path is made of hardlinks to them. Only
+        objects the remote does not have yet are sent; the rest, and a new
+        remote_path of content uploaded before, costs a single tar of link
+        entries. Like sync, a manifest under remote_path decides which files
+        changed, and with delete files no longer present locally are
+        removed. See gc_objects for reclaiming objects no longer linked.
+        remote_path and objects_path must be on the same filesystem.
+        """
+
+        if not isinstance(filepaths, list):
+            filepaths = [filepaths]
+
+        local_manifest_path = self._local_manifest_path(remote_path)
+        remote_manifest_path = os.path.join(remote_path, Manifest.FILENAME)
+
+        if manifest is not None:
+            local = Manifest(dict(manifest.entries))
+        else:
+            local = Manifest.scan(
+                filepaths, excluded_exts, previous=Manifest.load(local_manifest_path), excludes=excludes,
+                root=root,
+            )
+        remote = self._remote_manifest(remote_manifest_path)
+
+        changed, stale = local.diff(remote)
+
+        keys = {p: self._object_key(local.entries[p]["local"], local.entries[p]["hash"]) for p in changed}
+        sources = {}
+        for p, key in keys.items():
+            sources.setdefault(key, local.entries[p]["local"])
+
+        missing = self.missing_objects(objects_path, sorted(sources))
+
+        if missing:
+            # unpack next to the store and move into place once complete, so
+            # an interrupted upload never leaves a truncated object behind
+            incoming = os.path.join(objects_path, f".incoming-{uuid.uuid4().hex}")
+            self._send_entries([(sources[key], key) for key in missing], incoming, self.codec(compress) if compress else None)
+            stored = self.run(
+                f"cd {shlex.quote(incoming)} && find . -type f -name '*.x' -exec chmod 555 {{}} + && "
+                f"find . -type f ! -name '*.x' -exec chmod 444 {{}} + && "
+                f"for d in */; do mkdir -p \"../$d\" && mv -f \"$d\"* \"../$d\" || exit 1; done && "
+                f"cd .. && rm -rf {shlex.quote(incoming)}"
+            )
+            if stored.wait() != 0:
+                raise IOError(f"Storing objects in {objects_path} on {self.host} failed: {stored.stderr.strip()}")
+
+        if changed:
+            root = os.path.commonpath([remote_path, objects_path])
+
+            def produce(writer):
+                with tarfile.open(fileobj=writer, mode="w|") as tar:
+                    for p in changed:
+                        link = tarfile.TarInfo(os.path.relpath(os.path.join(remote_path, p), root))
+                        link.type = tarfile.LNKTYPE
+                        link.linkname = os.path.relpath(os.path.join(objects_path, keys[p]), root)
+                        tar.addfile(link)
+
+            self._extract_remote(root, produce)
+
+        if delete and len(stale) > 0:
+            self.remove(*[os.path.join(remote_path, p) for p in stale])
+        else:
+            for p in stale:
+                local.entries.setdefault(p, remote.entries[p])
+
+        self.write_file(remote_manifest_path, local.to_json().encode("utf-8"))
+        local.save(local_manifest_path)
+
+        logging.info(
+            f"Linked {remote_path} on {self.host}: {len(missing)} objects uploaded, {len(changed)} linked, "
+            f"{len(local) - len(changed)} unchanged, {len(stale) if delete else 0} deleted"
+        )
+
+        return changed, stale
+
+    def gc_objects(self, objects_path: str) -> int:
+        """Remove the objects no build links to anymore, returns how many.
+
+        The link count of an object is its reference count: it is one once
+        every build directory linking it has been changed or removed.
+        """
+
+        result = self.run(
+            f"cd {shlex.quote(objects_path)} 2>/dev/null || {{ echo 0; exit 0; }}; "
+            f"find . -path './.incoming-*' -prune -o -type f -links 1 -print -exec rm -f {{}} + | wc -l"
+        )
+
+        if result.wait() != 0:
+            raise IOError(f"Collecting objects in {objects_path} on {self.host} failed: {result.stderr.strip()}")
+
+        removed = int(result.stdout.strip() or 0)
+
+        logging.info(f"Removed {removed} unused objects from {objects_path} on {self.host}")
+
+        return removed
+
+    def download_file(
+        self,
+        remote_filepath: str,
+        local_path: str,
+        workers: int = None,
+        compress: Union[bool, str] = None,
+        resumable: bool = False,
+    ):
+
+        method = "resumable" if resumable else "compressed" if compress else "parallel" if workers else "scp"
+
+        with self.metrics.span("download", counter="bytes_received", host=self.host, method=method):
+
+            if resumable:
+                return self.download_resumable(remote_filepath, local_path, workers=workers or 1)
+
+            if compress:
+                return self.download_compressed(
+                    remote_filepath, local_path, compress=compress, workers=workers or 4,
+                )
+
+            if workers is not None:
+                return self.parallel_download(remote_filepath, local_path, workers=workers)
+
+            os.makedirs(local_path, exist_ok=True)
+
+            with self._connections.slot():
+                self._scp("download").get(remote_filepath, local_path=local_path, recursive=True)
+
+    def batch(self) -> CommandBatch:
+        """Collect commands to run in a single remote shell, see CommandBatch."""
+
+        return CommandBatch(self)
+
+    def run(
+        self,
+        command: str,
+        get_pty: bool = False,
+        capture: int = 16 * 1024 * 1024,
+        timeout: float = None,
+    ) -> CommandResult:
+        """Start command and return a CommandResult to consume its output from.
+
+        The channel is held until the output has been consumed or the
+        result is closed. timeout is the longest time to wait without
+        receiving any output.
+        """
+
+        self._connections._slots.acquire()
+        self.metrics.count("commands")
+
+        try:
+            chan = self._connections.open_session()
+            if get_pty:
+                chan.get_pty()
+            chan.exec_command(command)
+        except Exception:
+            self._connections._slots.release()
+            raise
+
+        return CommandResult(
+            chan, release=self._connections._slots.release, capture=capture, timeout=timeout,
+            span=self.metrics.span("exec", host=self.host, command=command[:200]),
+        )
+
+    def run_with_input(self, command: str, produce, timeout: float = None) -> CommandResult:
+        """Start command and feed it produce(writer) on stdin from a background thread.
+
+        The output is consumed from the returned CommandResult as with run(),
+        while stdin is still being written. An exception raised while
+        writing stdin is kept in the input_error of the result.
+        """
+
+        result = self.run(command, timeout=timeout)
+
+        def feed():
+
+            writer = ChannelWriter(result.channel)
+
+            try:
+                produce(writer)
+                writer.close()
+                result.channel.shutdown_write()
+            except Exception as e:
+                result.input_error = e
+
+            self.metrics.count("bytes_sent", writer.bytes)
+
+        threading.Thread(target=feed, daemon=True).start()
+
+        return result
+
+    def execute_command(
+        self,
+        command: str,
+        stream: bool = False,
+        suppress: bool = False,
+        ignore_output: bool = False,
+        timeout: int = None,
+    ):
+        """Run command and return its output. With stream the output is
+        printed as it arrives, otherwise once the command has finished."""
+
+        result = self.run(command, get_pty=True, timeout=timeout)
+
+        if ignore_output:
+            result.close()
+            return
+
+        for _, text in result.events():
+            if stream and not suppress:
+                print(text, end="", flush=True)
+
+        if not stream and not suppress:
+            print(result.stdout, end="")
+            if result.stderr:
+                print(result.stderr, end="")
+
+        return result.stdout
+
+class Session(object):
+    """A detached command started by Reacher.
+
+    Its output goes to `<name>.log` in the log path, next to `<name>.pid`
+    with the pid of its process group and `<name>.exit` with its exit
+    status once it has finished. state is "running", "exited" or "lost"
+    (gone without an exit status, e.g. after a reboot).
+    """
+
+    def __init__(self, name: str, log_path: str, pid: int = None, exit_status: int = None, running: bool = False):
+        self.name = name
+        self.log_path = log_path
+        self.pid = pid
+        self.exit_status = exit_status
+        self.running = running
+
+    @property
+    def state(self) -> str:
+        if self.running:
+            return "running"
+        return "exited" if self.exit_status is not None else "lost"
+
+    def __repr__(self):
+        status = f" {self.exit_status}" if self.exit_status is not None else ""
+        return f"Session({self.name}, pid {self.pid}, {self.state}{status})"
+
+class _FollowedLog(object):
+
+    def __init__(self, client: "RemoteClient", path: str, name: str, exit_path: str = None, offset: int = 0):
+        self.client = client
+        self.path = path
+        self.name = name
+        self.exit_path = exit_path
+        self.offset = offset
+        self.exit_status = None
+        self.finished = False
+        self.handle = None
+        self.mirror_path = None
+        self.mirror = None
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+class LogFollower(object):
+    """Follows remote log files, on any number of hosts, from one thread.
+
+    A byte offset is kept per file and every poll only reads what was
+    appended since, over a long lived SFTP session on the transport of
+    the client, so following dozens of sessions costs a stat per file and
+    interval. Files that do not exist yet are picked up once they appear,
+    truncated files are read again from the start. With mirror, the
+    bytes read are also written to `<mirror>/<host>/<file name>`.
+
+        follower = LogFollower(mirror="logs")
+        follower.follow_sessions(reacher)
+        for name, text in follower:
+            print(f"[{name}] {text}", end="")
+    """
+
+    def __init__(self, interval: float = 1.0, mirror: str = None, chunk_size: int = 1 << 20):
+        self.interval = interval
+        self.mirror = mirror
+        self.chunk_size = chunk_size
+
+        self._logs: Dict[str, _FollowedLog] = {}
+        self._sftp = {}
+
+    def __iter__(self):
+        return self.follow()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._logs)
+
+    def exit_status(self, name: str) -> int:
+        """Exit status of the session followed as name, None while it runs."""
+        return self._logs[name].exit_status
+
+    def add(
+        self,
+        client: "RemoteClient",
+        remote_path: str,
+        name: str = None,
+        from_start: bool = True,
+        exit_path: str = None,
+    ) -> str:
+        """Follow remote_path on client as name (the file name by default).
+
+        Without from_start only what is written from now on is read. With
+        exit_path the log is finished once that file exists and everything
+        before it has been read, see follow(). Returns the name.
+        """
+
+        name = name or os.path.basename(remote_path)
+
+        if name in self._logs:
+            raise ValueError(f"Already following a log named {name}")
+
+        log = _FollowedLog(client, remote_path, name, exit_path=exit_path)
+
+        if not from_start:
+            try:
+                log.offset = self._client_sftp(client).stat(remote_path).st_size
+            except IOError:
+                pass
+
+        if self.mirror is not None:
+            log.mirror_path = os.path.join(self.mirror, client.host, os.path.basename(remote_path))
+            os.makedirs(os.path.dirname(log.mirror_path), exist_ok=True)
+            if log.offset == 0:
+                open(log.mirror_path, "wb").close()
+
+        self._logs[name] = log
+
+        return name
+
+    def follow_session(self, reacher: "Reacher", named_session: str, name: str = None, from_start: bool = True) -> str:
+        """Follow the log of the session named_session of reacher until it finishes."""
+
+        session = reacher._session_name(named_session)
+
+        return self.add(
+            reacher._client,
+            os.path.join(reacher.log_path, f"{session}.log"),
+            name=name or session,
+            from_start=from_start,
+            exit_path=os.path.join(reacher.log_path, f"{session}.exit"),
+        )
+
+    def follow_sessions(self, reacher: "Reacher", prefix: str = "", running: bool = False) -> List[str]:
+        """Follow every session of reacher (only the running ones with running),
+        named prefix + the session name. Returns the names."""
+
+        return [
+            self.follow_session(reacher, session.name, name=f"{prefix}{session.name}")
+            for session in reacher.list_named_sessions(suppress=True)
+            if (session.running or not running) and f"{prefix}{session.name}" not in self._logs
+        ]
+
+    def remove(self, name: str):
+
+        log = self._logs.pop(name)
+
+        self._close_log(log)
+
+    def _client_sftp(self, client: "RemoteClient"):
+
+        sftp = self._sftp.get(client)
+        transport = client._connections.transport
+
+        if sftp is None or sftp.get_channel().closed or sftp.get_channel().get_transport() is not transport:
+            if sftp is not None:
+                # reconnected, the handles died with the old session but the offsets are still good
+                for log in self._logs.values():
+                    if log.client is client:
+                        log.handle = None
+                sftp.close()
+            client.metrics.count("round_trips")
+            sftp = paramiko.SFTPClient.from_transport(transport)
+            self._sftp[client] = sftp
+
+        return sftp
+
+    def _read(self, log: _FollowedLog) -> bytes:
+
+        sftp = self._client_sftp(log.client)
+
+        if log.handle is None:
+            log.handle = sftp.open(log.path, "rb")
+
+        size = log.handle.stat().st_size
+
+        if size < log.offset:
+            logging.info(f"{log.name} on {log.client.host} was truncated, following it from the start")
+            log.offset = 0
+            log.decoder.reset()
+            if log.mirror_path is not None:
+                if log.mirror is not None:
+                    log.mirror.close()
+                log.mirror = open(log.mirror_path, "wb")
+
+        if size == log.offset:
+            return b""
+
+        log.handle.seek(log.offset)
+        data = log.handle.read(min(size - log.offset, self.chunk_size))
+
+        log.offset += len(data)
+        log.client.metrics.count("bytes_received", len(data))
+
+        if log.mirror_path is not None:
+            if log.mirror is None:
+                log.mirror = open(log.mirror_path, "ab")
+            log.mirror.write(data)
+            log.mirror.flush()
+
+        return data
+
+    def _check_exit(self, log: _FollowedLog) -> bytes:
+        """Mark log finished once its exit status is written and nothing is
+        left to read. Returns what was appended to the log meanwhile."""
+
+        try:
+            with self._client_sftp(log.client).open(log.exit_path, "rb") as f:
+                status = f.read().decode("utf-8", "replace").strip()
+        except IOError:
+            return b""
+
+        if not status:
+            # the exit status is being written
+            return b""
+
+        # the session may have written more between the read and its exit
+        try:
+            data = self._read(log)
+        except IOError:
+            log.handle = None
+            data = b""
+
+        if data:
+            return data
+
+        log.exit_status = int(status) if status.lstrip("-").isdigit() else None
+        log.finished = True
+
+        return b""
+
+    def poll(self) -> List[tuple]:
+        """Read what was appended to every followed log since the last poll,
+        returns (name, text) pairs for the logs that grew."""
+
+        chunks = []
+
+        for log in list(self._logs.values()):
+
+            if log.finished:
+                continue
+
+            try:
+                data = self._read(log)
+            except IOError:
+                # not created yet, or removed, open it again next time
+                log.handle = None
+                data = b""
+
+            if not data and log.exit_path is not None:
+                data = self._check_exit(log)
+
+            text = log.decoder.decode(data, final=log.finished)
+            if text:
+                chunks.append((log.name, text))
+
+        return chunks
+
+    @property
+    def finished(self) -> bool:
+        """Whether every followed session has finished and been read to the end."""
+        return all(log.finished for log in self._logs.values())
+
+    def follow(self, until_finished: bool = False):
+        """Yield (name, text) as the logs grow, polling every interval seconds
+        while nothing is new. With until_finished, stop once every followed
+        session has finished; otherwise follow until the generator is closed."""
+
+        try:
+            while True:
+
+                chunks = self.poll()
+
+                yield from chunks
+
+                if until_finished and self.finished:
+                    return
+
+                if not chunks:
+                    time.sleep(self.interval)
+        finally:
+            self.close()
+
+    def _close_log(self, log: _FollowedLog):
+
+        for f in (log.handle, log.mirror):
+            if f is not None:
+                try:
+                    f.close()
+                except Exception:
+                    pass
+
+        log.handle = log.mirror = None
+
+    def close(self):
+        """Close the remote and mirror files and the SFTP sessions. The
+        offsets are kept, polling again picks up where it left off."""
+
+        for log in self._logs.values():
+            self._close_log(log)
+
+        for sftp in self._sftp.values():
+            try:
+                sftp.close()
+            except Exception:
+                pass
+
+        self._sftp = {}
+
+class Reacher(object):
+
+    ARTIFACATS_PATH = "artifacts"
+    LOGS_PATH = "logs"
+
+    WORKSPACE_PATH = "~/.reacher"
+    OBJECTS_PATH = ".objects"
+    BUILD_PATH = ""
+
+    EXCLUDES = [
+        ".git",
+        "__pycache__",
+        "logs",
+    ]
+
+    def __init__(
+        self,
+        build_name: str,
+        client: RemoteClient = None,
+        host: str = None,
+        port: int = 22,
+        user: str = None,
+        password: str = None,
+        ssh_key_filepath: str = None,
+        prefix_cmd: str = None,
+        metrics: Metrics = None,
+        install_key: bool = False,
+        use_helper: bool = False,
+    ):
+
+        if client is None:
+
+            assert (
+                host is not None
+                and user is not None
+                and ssh_key_filepath is not None
+            )
+
+            client = RemoteClient(
+                host=host,
+                user=user,
+                password=password,
+                ssh_key_filepath=ssh_key_filepath,
+                port=port,
+                metrics=metrics,
+                install_key=install_key,
+                use_helper=use_helper,
+            )
+
+        self._client = client
+    
+        self._port_forwarding = PortForwarding(client=self._client)
+
+        self._prefix_cmd = prefix_cmd
+
+        self._build_name = build_name
+    
+    @property
+    def metrics(self) -> Metrics:
+
+        return self._client.metrics
+
+    @property
+    def workspace_path(self):
+
+        return os.path.join("/home", self._client.user, ".reacher")
+
+    @property
+    def objects_path(self):
+        """The object store shared by every build on the host, see RemoteClient.upload_objects."""
+
+        return os.path.join(self.workspace_path, Reacher.OBJECTS_PATH)
+
+    def install_key(self, force: bool = False) -> bool:
+
+        return self._client.install_key(force=force)
+    
+    def add_port_forward(self, remote_port: int, local_port: int, paramiko: bool = True):
+        
+        return self._port_forwarding.add_port_forward(remote_port, local_port, paramiko)
+
+    def remove_port_forward(self, tunnel: Union["Tunnel", "SystemTunnel"]):
+
+        self._port_forwarding.remove_port_forward(tunnel)
+
+    def stop_port_forwards(self):
+
+        self._port_forwarding.stop()
+
+    @property
+    def build_path(self):
+
+        return os.path.join(self.workspace_path, self._build_name)
+
+    @property
+    def log_path(self):
+
+        return os.path.join(
+            self.workspace_path,
+            self._build_name,
+            Reacher.LOGS_PATH
+        )
+
+    @property
+    def artifact_path(self):
+
+        return os.path.join(
+            self.workspace_path,
+            self._build_name,
+            Reacher.ARTIFACATS_PATH
+        )
+
+    def batch(self) -> CommandBatch:
+        """Collect commands to run in the build path in a single remote shell."""
+
+        return CommandBatch(self._client, wrap=self._batch_command)
+
+    def _batch_command(self, script: str) -> str:
+
+        return f"cd {self.build_path} && sh -c {shlex.quote(script)}"
+
+    def _helper(self) -> RemoteHelper:
+        """The RemoteHelper seeing the build path as _helper_build_path, None
+        if there is none and shell commands have to be used."""
+
+        return self._client.helper
+
+    @property
+    def _helper_build_path(self) -> str:
+
+        return self.build_path
+
+    def _setup_steps(self, batch: CommandBatch) -> CommandBatch:
+
+        return batch.mkdir(self.build_path, self.artifact_path, self.log_path)
+
+    def setup(self):
+
+        return self._setup_steps(self._client.batch()).run()
+
+    def cleanup(self, exclude: list = ["artifacts", "logs"]):
+
+        helper = self._helper()
+
+        if helper is not None:
+            helper.request("clean", path=self._helper_build_path, keep=list(exclude))
+        else:
+            keep = " ".join(f"! -name {shlex.quote(f'*{f}*')}" for f in exclude)
+            self.batch().add(
+                f"find . -mindepth 1 -maxdepth 1 {keep} -exec rm -rf {{}} +", name="cleanup",
+            ).run()
+
+        self.setup()
+
+    def gc(self) -> int:
+        """Remove the objects in the object store of the host that no build
+        links to anymore, e.g. after cleanup or removing a build."""
+
+        return self._client.gc_objects(self.objects_path)
+
+    def ls(self, folder: str = None):
+
+        if folder is None:
+            folder = self.build_path
+        else:
+            folder = os.path.join(self.build_path, folder)
+
+        helper = self._helper()
+
+        if helper is not None:
+            return helper.request("ls", path=folder)
+
+        r = self.execute_command(
+            f"find {folder} -mindepth 1 -print",
+            suppress=True,
+            stream=False,
+        ).splitlines()
+
+        r = [x.rstrip("\r") for x in r]
+        r = [x for x in r if x != "" and x != "."]
+
+        return r
+
+    def put(
+        self,
+        path: str,
+        destination_folder: str = None,
+        excluded_exts: list = [".pyc"],
+        method: str = "scp",
+        delete: bool = False,
+        workers: int = None,
+        compress: Union[bool, str] = None,
+        root: str = None,
+    ):
+        
+        if destination_folder is None:
+            destination_folder = self.build_path
+        else:
+            destination_folder = os.path.join(self.build_path, destination_folder)
+
+        if not isinstance(path, list):
+            path = [path]
+
+        results = self._client.upload(
+            path, destination_folder, excluded_exts=excluded_exts,
+            method=method, delete=delete, excludes=Reacher.EXCLUDES, workers=workers,
+            compress=compress, objects_path=self.objects_path, root=root,
+        )
+
+        if method == "objects":
+            # objects are readable by everyone already, and their mode is
+            # shared with every other build linking them
+            return results
+
+        # make the uploaded files accessible to everyone, e.g. root in a
+        # container, leaving alone the files still linked to objects
+        uploaded = []
+        for p in path:
+            local_path = os.path.join(root, p) if root is not None else p
+            if os.path.isfile(local_path):
+                uploaded.append(os.path.join(destination_folder, os.path.basename(local_path)))
+            elif root is not None:
+                uploaded.append(os.path.join(destination_folder, os.path.relpath(local_path, root)))
+            else:
+                uploaded.append(os.path.join(destination_folder, os.path.normpath(p)))
+
+        helper = self._client.helper
+
+        if helper is not None:
+            helper.request("chmod", paths=uploaded, mode=0o777, linked=False)
+        else:
+            self._client.batch().add(
+                f"find {' '.join(shlex.quote(p) for p in uploaded)} -user $(whoami) "
+                f"\\( -type d -o -links 1 \\) -exec chmod 777 {{}} +",
+                name="chmod",
+            ).run()
+
+        return results
+
+    def get(
+        self,
+        path: Union[List[str], str],
+        destination_folder: str = None,
+        workers: int = None,
+        compress: Union[bool, str] = None,
+        resumable: bool = False,
+    ):
+
+        if destination_folder is None:
+            destination_folder = "."
+
+        if not isinstance(path, list):
+            path = [path]
+
+        if resumable:
+            results = []
+            for p in path:
+                results += self._client.download_file(
+                    os.path.join(self.build_path, p), destination_folder,
+                    workers=workers, resumable=True,
+                )
+            return results
+
+        if compress:
+            results = []
+            for p in path:
+                results += self._client.download_file(
+                    os.path.join(self.build_path, p), destination_folder,
+                    workers=workers, compress=compress,
+                ) or []
+            return results
+
+        if workers is not None:
+            return self._client.parallel_download(
+                [os.path.join(self.build_path, p) for p in path],
+                destination_folder,
+                workers=workers,
+            )
+
+        for p in path:
+            self._client.download_file(os.path.join(self.build_path, p), destination_folder)
+
+    @property
+    def artifacts(self):
+        return self.ls(self.artifact_path)
+
+    def artifact_index(self, hashes: bool = False) -> Manifest:
+        """Size, mtime and optionally sha256 of every artifact, from one remote listing."""
+
+        return self._client.index(self.artifact_path, hashes=hashes)
+
+    def sync_artifacts(
+        self,
+        destination: str = None,
+        hashes: bool = False,
+        workers: int = 4,
+        watch: bool = False,
+        interval: float = 60,
+    ) -> List[TransferResult]:
+        """Download the artifacts that are new or changed since the last sync.
+
+        With watch, keep syncing every interval seconds until interrupted.
+        """
+
+        if watch:
+            results = []
+            try:
+                for results in self.watch_artifacts(destination, interval, hashes=hashes, workers=workers):
+                    pass
+            except KeyboardInterrupt:
+                pass
+            return results
+
+        if destination is None:
+            destination = Reacher.ARTIFACATS_PATH
+
+        return self._client.sync_down(self.artifact_path, destination, hashes=hashes, workers=workers)
+
+    def watch_artifacts(self, destination: str = None, interval: float = 60, **kwargs):
+        """Yield the results of sync_artifacts every interval seconds, forever."""
+
+        while True:
+            yield self.sync_artifacts(destination, **kwargs)
+            time.sleep(interval)
+
+    def get_artifact(
+        self,
+        artifact: str,
+        destination: str = None,
+        workers: int = None,
+        compress: Union[bool, str] = None,
+    ):
+        return self.get(
+            os.path.join(self.artifact_path, artifact), destination, workers=workers, compress=compress,
+        )
+
+    def put_artifact(self, artifact: str, workers: int = None, compress: Union[bool, str] = None):
+        return self.put(artifact, self.artifact_path, workers=workers, compress=compress)
+
+    @staticmethod
+    def _session_name(named_session: str = None) -> str:
+
+        if named_session is None:
+            return str(uuid.uuid4())
+
+        return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(named_session))
+
+    def _session_files(self, name: str) -> Dict[str, str]:
+        """Paths of the files of session name, relative to the build path."""
+
+        return {
+            ext: shlex.quote(os.path.join(Reacher.LOGS_PATH, f"{name}.{ext}"))
+            for ext in ("log", "pid", "exit")
+        }
+
+    def _wrap_command_in_session(self, command: str, named_session: str = None) -> str:
+        """Script starting command as session named_session, detached from the
+        calling shell, with its output in the log path. Runs in the build path."""
+
+        name = self._session_name(named_session)
+        files = self._session_files(name)
+
+        inner = f"echo $$ > {files['pid']}; ( {command} ) > {files['log']} 2>&1; echo $? > {files['exit']}"
+
+        logging.info(f"Starting session {name}, logging to {os.path.join(self.log_path, name + '.log')}")
+
+        # wait for the pid file, by then the session runs in a session of its
+        # own and no longer gets the hangup of the calling shell
+        return (
+            f"mkdir -p {Reacher.LOGS_PATH} && rm -f {files['pid']} {files['exit']} && "
+            f"{{ $(command -v setsid) nohup sh -c {shlex.quote(inner)} > /dev/null 2>&1 < /dev/null & }}; "
+            f"i=0; while [ ! -s {files['pid']} ] && [ $i -lt 100 ]; do sleep 0.05; i=$((i+1)); done"
+        )
+
+    def _detach_command(self, script: str) -> str:
+
+        return self._batch_command(script)
+    
+    def _wrap_command_in_prefix(self, command: str):
+        
+        return f"{self._prefix_cmd};{command}"
+    
+    def execute(
+        self,
+        command: str,
+        context: Union[str, List[str]] = None,
+        named_session: str = None,
+        cleanup_before: bool = False,
+        wrap_in_screen: bool = True,
+        excluded_exts: list = [".pyc"],
+        method: str = "scp",
+        delete: bool = False,
+    ):  
+        """Upload context and run command in the build path.
+
+        With wrap_in_screen (the default) the command is started as the
+        detached session named_session, see list_named_sessions. With a
+        recording Metrics plugged in, a summary of the spans and counters
+        of this call is logged and returned.
+        """
+
+        metrics = self.metrics
+        mark = metrics.mark()
+
+        with metrics.span("execute", build=self._build_name):
+
+            if cleanup_before:
+                self.cleanup()
+
+            if context is not None:
+                self._client.upload(
+                    context, self.build_path, excluded_exts,
+                    method=method, delete=delete, excludes=Reacher.EXCLUDES,
+                    objects_path=self.objects_path,
+                )
+
+            self.execute_command(
+                command,
+                named_session=named_session,
+                wrap_in_screen=wrap_in_screen
+            )
+
+        summary = metrics.summary(mark)
+
+        if summary is not None:
+            logging.info(f"execute on {self._client.host}: {json.dumps(summary)}")
+
+        metrics.flush()
+
+        return summary
+
+    def execute_command(
+        self,
+        command,
+        stream: bool = True,
+        suppress: bool = False,
+        named_session: str = None,
+        wrap_in_screen: bool = False,
+        ignore_output: bool = False,
+        timeout: int = None,
+    ):  
+
+        command = self._build_command(command, named_session, wrap_in_screen)
+
+        return self._client.execute_command(
+            command,
+            stream=stream,
+            suppress=suppress,
+            ignore_output=ignore_output,
+            timeout=timeout,
+        )
+    
+    def start_named_sessions(self, commands: Dict[str, str]):
+        """Start every {named_session: command} as a detached session, like
+        execute_command with wrap_in_screen, all in one round trip."""
+
+        script = "; ".join(
+            self._wrap_command_in_session(self._session_command(command), name) for name, command in commands.items()
+        )
+
+        result = self._client.run(self._detach_command(script))
+
+        if result.wait() != 0:
+            raise IOError(f"Starting {', '.join(commands)} on {self._client.host} failed: {result.stderr.strip()}")
+
+    def start_services(self, services: List["Service"], paramiko: bool = True) -> List["ServiceHandle"]:
+        """Start services and forward their ports once they are ready, see ServiceLauncher."""
+
+        return ServiceLauncher(self, paramiko=paramiko).start(services)
+
+    def _session_command(self, command: str) -> str:
+
+        if self._prefix_cmd is not None:
+            return self._wrap_command_in_prefix(command)
+
+        return command
+
+    def _build_command(self, command: str, named_session: str = None, wrap_in_screen: bool = False):
+        """The remote command running command in the build path. With
+        wrap_in_screen it is started as a detached session instead, see
+        list_named_sessions."""
+
+        if self._prefix_cmd is not None:
+            command = self._wrap_command_in_prefix(command)
+
+        if wrap_in_screen:
+            return self._detach_command(self._wrap_command_in_session(command, named_session))
+
+        return f"cd {self.build_path} && {command}"
+
+    def _run_script(self, script: str) -> CommandResult:
+
+        result = self._client.run(self._batch_command(script))
+        result.wait()
+
+        return result
+
+    def list_named_sessions(self, suppress: bool = False) -> List[Session]:
+        """The sessions started in this build, from their files in the log path."""
+
+        helper = self._helper()
+
+        if helper is not None:
+            listing = helper.request("sessions", path=os.path.join(self._helper_build_path, Reacher.LOGS_PATH))
+        else:
+            result = self._run_script(
+                f"cd {Reacher.LOGS_PATH} 2>/dev/null || exit 0; "
+                f"for f in *.pid; do [ -e \"$f\" ] || continue; n=${{f%.pid}}; p=$(cat \"$f\"); "
+                f"if [ -s \"$n.exit\" ]; then s=$(cat \"$n.exit\"); "
+                f"elif kill -0 \"$p\" 2>/dev/null; then s=running; else s=lost; fi; "
+                f"printf '%s\\t%s\\t%s\\n' \"$n\" \"$p\" \"$s\"; done"
+            )
+            listing = [line.split("\t") for line in result.stdout.splitlines()]
+
+        sessions = []
+
+        for parts in listing:
+
+            if len(parts) != 3:
+                continue
+
+            name, pid, status = parts
+            sessions.append(Session(
+                name,
+                os.path.join(self.log_path, f"{name}.log"),
+                pid=int(pid) if pid.isdigit() else None,
+                exit_status=int(status) if status.lstrip("-").isdigit() else None,
+                running=status == "running",
+            ))
+
+        if not suppress:
+            for session in sessions:
+                print(session)
+
+        return sessions
+
+    def attach_named_session(self, named_session: str) -> int:
+        """Print the output of the session, from the start and as it is
+        written, until it finishes. Returns its exit status."""
+
+        name = self._session_name(named_session)
+        session = next((s for s in self.list_named_sessions(suppress=True) if s.name == name), None)
+
+        if session is None:
+            logging.error(f"No session {named_session} on {self._client.host}")
+            return None
+
+        with LogFollower(interval=0.5) as follower:
+
+            follower.follow_session(self, name)
+
+            if session.state == "lost":
+                # gone without an exit status, there is only the log left to print
+                for chunks in iter(follower.poll, []):
+                    for _, text in chunks:
+                        print(text, end="", flush=True)
+                return None
+
+            for _, text in follower.follow(until_finished=True):
+                print(text, end="", flush=True)
+
+            return follower.exit_status(name)
+
+    def follow(
+        self,
+        named_sessions: List[str] = None,
+        mirror: str = None,
+        until_finished: bool = True,
+        interval: float = 1.0,
+    ):
+        """Yield (session, text) as the logs of named_sessions (all sessions
+        by default) grow, see LogFollower. With mirror the logs are also
+        written to `<mirror>/<host>/<session>.log`."""
+
+        follower = LogFollower(interval=interval, mirror=mirror)
+
+        if named_sessions is None:
+            follower.follow_sessions(self)
+        else:
+            for named_session in named_sessions:
+                follower.follow_session(self, named_session)
+
+        return follower.follow(until_finished=until_finished)
+
+    def kill_named_session(self, named_session: str, suppress: bool = False) -> bool:
+        """Terminate the process group of the session, returns whether it was running."""
+
+        files = self._session_files(self._session_name(named_session))
+
+        result = self._run_script(
+            f"p=$(cat {files['pid']} 2>/dev/null) && [ ! -s {files['exit']} ] && kill -0 $p 2>/dev/null || exit 1; "
+            f"kill -TERM -$p 2>/dev/null || kill -TERM $p; "
+            f"[ -s {files['exit']} ] || echo 143 > {files['exit']}"
+        )
+
+        if not suppress:
+            print(f"Killed {named_session}" if result.ok else f"{named_session} is not running")
+
+        return result.ok
+
+class ContainerState(object):
+    """A docker container as reported by `docker inspect`."""
+
+    def __init__(self, name: str, data: dict = None):
+
+        data = data or {}
+        state = data.get("State") or {}
+
+        self.name = name
+        self.exists = bool(data)
+        self.status = state.get("Status")
+        self.running = bool(state.get("Running"))
+        self.exit_code = state.get("ExitCode")
+        self.health = (state.get("Health") or {}).get("Status")
+        self.started_at = state.get("StartedAt")
+        self.image_id = data.get("Image")
+        self.ports = {
+            port: [f"{b.get('HostIp', '')}:{b.get('HostPort', '')}" for b in bindings or []]
+            for port, bindings in ((data.get("NetworkSettings") or {}).get("Ports") or {}).items()
+        }
+        self.mounts = {m.get("Destination"): m.get("Source") for m in data.get("Mounts") or []}
+        self.fetched = time.time()
+
+    def __repr__(self):
+        if not self.exists:
+            return f"ContainerState({self.name}, missing)"
+        health = f", {self.health}" if self.health else ""
+        return f"ContainerState({self.name}, {self.status}{health})"
+
+class ReacherDocker(Reacher):
+
+    CON_WORKSPACE_PATH = "/workspace"
+
+    # seconds the inspected container state is trusted without events
+    STATE_TTL = 2.0
+
+    # image label holding the fingerprint of the build context
+    FINGERPRINT_LABEL = "reacher.fingerprint"
+
+    MOUNTED = [
+        Reacher.ARTIFACATS_PATH,
+        Reacher.LOGS_PATH, 
+    ]
+
+    def __init__(
+        self,
+        build_name: str,
+        image_name: str,
+        build_context: str,
+        client: RemoteClient = None,
+        host: str = None,
+        port: int = 22,
+        user: str = None,
+        password: str = None,
+        ssh_key_filepath: str = None,
+        metrics: Metrics = None,
+        install_key: bool = False,
+        use_helper: bool = False,
+    ):
+
+        super().__init__(
+            build_name=build_name,
+            client=client,
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            ssh_key_filepath=ssh_key_filepath,
+            metrics=metrics,
+            install_key=install_key,
+            use_helper=use_helper,
+        )
+
+        self._image_name = image_name
+        self._build_context = build_context 
+
+        self._state = None
+        self._state_lock = threading.Lock()
+        self._events = None
+
+        self._container_helper = RemoteHelper(
+            self._client, wrap=lambda script: f"docker exec -i {self._build_name} sh -c {shlex.quote(script)}",
+        )
+        # (running, started at) of the container when the helper failed to start in it
+        self._helper_failed = None
+
+    def _batch_command(self, script: str) -> str:
+
+        return f"docker exec {self._build_name} sh -c {shlex.quote(script)}"
+
+    def _helper(self) -> RemoteHelper:
+
+        # run in the container, which may not have python3 even if the host does
+        if not self._client.use_helper or self._container_helper.available is False:
+            return None
+
+        if self._container_helper.running:
+            return self._container_helper
+
+        # docker exec fails while the container is not running; remember a
+        # failure until the container is started again instead of paying a
+        # failed round trip and a warning on every call
+        state = self.state()
+        key = (state.running, state.started_at)
+
+        if not state.running or key == self._helper_failed:
+            return None
+
+        if not self._container_helper.start():
+            self._helper_failed = key
+            return None
+
+        return self._container_helper
+
+    @property
+    def _helper_build_path(self) -> str:
+
+        # docker exec starts in the working directory of the container
+        return "."
+
+    def _clear_steps(self, batch: CommandBatch) -> CommandBatch:
+
+        return batch.add(
+            f"docker stop {self._build_name}", check=False,
+        ).add(
+            f"docker rm {self._build_name}", check=False,
+        )
+
+    def clear(self):
+
+        try:
+            return self._clear_steps(self._client.batch()).run()
+        finally:
+            self.invalidate_state()
+
+    def ls(self, folder: str = None):
+
+        if folder is None:
+            folder = "."
+
+        helper = self._helper()
+
+        if helper is not None:
+            return helper.request("ls", path=folder)
+
+        r = self.execute_command(
+            f"find {folder} -mindepth 1 -print",
+            suppress=True,
+            stream=False,
+        ).splitlines()
+
+        r = [x.rstrip("\r") for x in r]
+        r = [x for x in r if x != "" and x != "."]
+
+        return r
+
+    def _context_entries(self) -> List[tuple]:
+        """(local_path, path in the build context) of every file sent to docker build.
+
+        Only the .dockerignore of build_context applies, not Reacher.EXCLUDES
+        or .gitignore files: a Dockerfile may well COPY files git ignores.
+        """
+
+        try:
+            with open(os.path.join(self._build_context, ".dockerignore"), "r", errors="replace") as f:
+                rules = IgnoreRules.parse_docker(f.readlines())
+        except FileNotFoundError:
+            rules = IgnoreRules()
+
+        entries = [
+            (local_path, os.path.relpath(local_path, self._build_context).replace(os.sep, "/"))
+            for local_path, _ in TreeScanner([".pyc"], ignore_filenames=()).walk(self._build_context)
+        ]
+
+        # docker needs the Dockerfile and .dockerignore even when they are ignored
+        return sorted(
+            (
+                entry for entry in entries
+                if entry[1] in ("Dockerfile", ".dockerignore") or not rules.docker_ignored(entry[1])
+            ),
+            key=lambda entry: entry[1],
+        )
+
+    def context_fingerprint(self, entries: List[tuple] = None) -> str:
+        """sha256 over the path, executable bit and content of every file in build_context."""
+
+        entries = entries if entries is not None else self._context_entries()
+
+        h = hashlib.sha256()
+
+        for local_path, rel_path in entries:
+            executable = int(os.stat(local_path).st_mode & 0o111 != 0)
+            h.update(f"{rel_path}\0{executable}\0{file_hash(local_path)}\n".encode("utf-8"))
+
+        return h.hexdigest()
+
+    def image_fingerprint(self) -> str:
+        """The context fingerprint the image on the remote was built from, None if there is no image."""
+
+        template = '{{ index .Config.Labels "%s" }}' % ReacherDocker.FINGERPRINT_LABEL
+
+        result = self._client.run(f"docker image inspect --format {shlex.quote(template)} {self._build_name}")
+        result.wait()
+
+        return result.stdout.strip() if result.ok else None
+
+    def build(self, method: str = None, force: bool = False, stream: bool = True) -> bool:
+        """Build the image of build_context on the remote, unless it is up to date.
+
+        The image is labelled with the fingerprint of the context it was
+        built from; when the remote image already carries the fingerprint of
+        the local context nothing is sent or built. Otherwise the context is
+        streamed as a tar straight into `docker build -`, without a copy on
+        the remote, and the build log is streamed back. method is deprecated
+        and ignored, the context is always streamed. Returns whether the image
+        was built.
+        """
+
+        if method is not None:
+            warnings.warn(
+                "ReacherDocker.build(method=...) is deprecated and ignored, the build context is always streamed",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+
+        entries = self._context_entries()
+        fingerprint = self.context_fingerprint(entries)
+
+        if not force and self.image_fingerprint() == fingerprint:
+            logging.info(f"Image {self._build_name} on {self._client.host} is up to date, not building")
+            return False
+
+        with self.metrics.span("build", host=self._client.host, image=self._build_name):
+
+            running = self._client.run_with_input(
+                self._docker_build_command(fingerprint), lambda writer: write_tar(writer, entries),
+            )
+
+            with running:
+                for _, line in running.lines():
+                    if stream:
+                        print(line, end="", flush=True)
+
+            if not running.ok:
+                error = f": {running.input_error}" if running.input_error is not None else ""
+                raise IOError(
+                    f"docker build of {self._build_name} on {self._client.host} failed "
+                    f"({running.exit_status}){error}"
+                )
+
+        return True
+
+    def _docker_build_command(self, fingerprint: str) -> str:
+
+        return (
+            f"docker build --label {ReacherDocker.FINGERPRINT_LABEL}={fingerprint} "
+            f"-t {self._build_name} -"
+        )
+
+    def execute_command(
+        self,
+        command,
+        stream: bool = True,
+        suppress: bool = False,
+        named_session: str = None,
+        wrap_in_screen: bool = False,
+        ignore_output: bool = False,
+    ):  
+
+        command = self._build_command(command, named_session, wrap_in_screen)
+
+        return self._client.execute_command(
+            command,
+            stream=stream,
+            suppress=suppress,
+            ignore_output=ignore_output,
+        )
+
+    def _build_command(self, command: str, named_session: str = None, wrap_in_screen: bool = False):
+
+        if wrap_in_screen or named_session is not None:
+            return self._detach_command(self._wrap_command_in_session(command, named_session))
+
+        return f"docker exec -it {self._build_name} {command}"
+
+    def _detach_command(self, script: str) -> str:
+
+        return f"docker exec -d {self._build_name} sh -c {shlex.quote(script)}"
+
+    def _session_command(self, command: str) -> str:
+
+        # the prefix is for the host, commands in the container run as they are
+        return command
+
+    def setup(
+        self,
+        ports: List[int] = None,
+        envs: Dict[str, str] = None,
+        command: str = "sleep infinity",
+        gpu: bool = False,
+    ):
+
+        extra_args = ""
+
+        if gpu:
+            extra_args = "--runtime=nvidia --gpus all"
+
+        ctx = f"docker run -dt {extra_args} -w {ReacherDocker.CON_WORKSPACE_PATH} --name {self._build_name}"
+
+        ctx = f"{ctx} -v {self.build_path}:{ReacherDocker.CON_WORKSPACE_PATH}"
+
+        if ports is not None:
+            for p in ports:
+                ctx = f"{ctx} -p {p}:{p}"
+
+        if envs is not None:
+            for k, v in envs.items():
+                ctx = f"{ctx} -e {k}={v}"
+
+        ctx = f"{ctx} {self._image_name} {command}"
+
+        # remove the old container, create the mounted directories and start
+        # the new container in one go
+        try:
+            return self._setup_steps(self._clear_steps(self._client.batch())).add(ctx, name="docker run").run()
+        finally:
+            self.invalidate_state()
+
+    def _inspect(self) -> ContainerState:
+
+        result = self._client.run(f"docker inspect --type container {self._build_name}")
+        result.wait()
+
+        try:
+            data = json.loads(result.stdout or "[]")
+        except ValueError:
+            data = []
+
+        return ContainerState(self._build_name, data[0] if data else None)
+
+    def state(self, refresh: bool = False) -> ContainerState:
+        """Status, health, ports, mounts and image of the container from a
+        single `docker inspect`.
+
+        The result is cached for STATE_TTL seconds, or for as long as
+        docker events are being watched (see watch_events), and dropped
+        whenever reacher itself starts or removes the container.
+        """
+
+        with self._state_lock:
+
+            state = self._state
+            watching = self._events is not None
+
+            if (
+                refresh or state is None
+                or (not watching and time.time() - state.fetched > ReacherDocker.STATE_TTL)
+            ):
+                state = self._state = self._inspect()
+
+            return state
+
+    def invalidate_state(self):
+
+        with self._state_lock:
+            self._state = None
+
+    def watch_events(self):
+        """Keep the cached state current from `docker events` instead of
+        inspecting again once it has expired. Holds one channel until
+        stop_watching_events is called."""
+
+        if self._events is not None:
+            return
+
+        running = self._client.run(
+            f"docker events --filter type=container --filter container={self._build_name} "
+            f"--format '{{{{.Action}}}}'",
+            capture=64 * 1024,
+        )
+
+        def watch():
+            try:
+                for _, line in running.lines():
+                    logging.debug(f"docker event for {self._build_name}: {line.strip()}")
+                    # any lifecycle or health event changes the state
+                    self.state(refresh=True)
+            except Exception as e:
+                logging.debug(f"Stopped watching docker events of {self._build_name}: {e}")
+            finally:
+                if self._events is running:
+                    self._events = None
+                    self.invalidate_state()
+
+        self._events = running
+        self.invalidate_state()
+
+        threading.Thread(target=watch, daemon=True).start()
+
+    def stop_watching_events(self):
+
+        running, self._events = self._events, None
+
+        if running is not None:
+            running.close()
+            self.invalidate_state()
+
+    @property
+    def is_running(self):
+
+        return self.state().running
+
+    @property
+    def exists(self):
+
+        return self.state().exists
+
+    if __name__ == "__main__":
+
+        pass
+
+class FleetResult(object):
+    """Outcome of running something on one host of a ReacherFleet."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.exit_status = None
+        self.duration = 0.0
+        self.error = None
+        self.output = collections.deque(maxlen=ReacherFleet.OUTPUT_LINES)
+        self.artifacts = []
+        self.value = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.exit_status in (None, 0)
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"failed: {self.error or self.exit_status}"
+        return f"FleetResult({self.host}, {self.duration:.1f}s, {status})"
+
+class ReacherFleet(object):
+    """Run the same build/command on many hosts concurrently.
+
+    hosts is a list of Reacher instances or of dicts with the RemoteClient
+    arguments (host, user, ssh_key_filepath, ...) from which one
+    `reacher_class` per host is created with the remaining kwargs.
+    Contexts are packed or scanned once locally and then uploaded to all
+    hosts in parallel. At most `concurrency` hosts are worked on at once;
+    with fail_fast the first failing host stops the others.
+    """
+
+    # number of output lines kept per host in FleetResult.output
+    OUTPUT_LINES = 1000
+
+    def __init__(
+        self,
+        hosts: List[Union[Reacher, dict]],
+        build_name: str = None,
+        reacher_class: type = Reacher,
+        concurrency: int = None,
+        fail_fast: bool = False,
+        **kwargs,
+    ):
+
+        self.concurrency = concurrency or max(len(hosts), 1)
+        self.fail_fast = fail_fast
+
+        self._print_lock = threading.Lock()
+        self._channels = set()
+        self._channels_lock = threading.Lock()
+
+        def create(host):
+            if isinstance(host, Reacher):
+                return host
+            return reacher_class(build_name=build_name, **{**kwargs, **host})
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            self._reachers = list(pool.map(create, hosts))
+
+    @property
+    def reachers(self) -> List[Reacher]:
+        return self._reachers
+
+    def _name(self, reacher: Reacher) -> str:
+
+        client = reacher._client
+        name = client.host
+
+        if sum(r._client.host == client.host for r in self._reachers) > 1:
+            name = f"{client.host}:{client.port}"
+
+        return name
+
+    def _print(self, host: str, line: str):
+
+        with self._print_lock:
+            print(f"[{host}] {line}", end="" if line.endswith("\n") else "\n")
+
+    def _abort(self):
+
+        with self._channels_lock:
+            for chan in self._channels:
+                chan.close()
+
+    def map(self, fn, fail_fast: bool = None) -> List[FleetResult]:
+        """Call fn(reacher, result) for every host in parallel and return a FleetResult per host.
+
+        Whatever fn returns is stored in result.value, exceptions in result.error.
+        """
+
+        fail_fast = self.fail_fast if fail_fast is None else fail_fast
+        failed = threading.Event()
+        lock = threading.Lock()
+
+        results = [FleetResult(self._name(r)) for r in self._reachers]
+
+        def run(reacher, result):
+
+            if fail_fast and failed.is_set():
+                result.error = RuntimeError("skipped, another host failed")
+                return
+
+            t0 = time.time()
+
+            try:
+                result.value = fn(reacher, result)
+            except Exception as e:
+                result.error = e
+                if not (fail_fast and failed.is_set()):
+                    logging.error(f"[{result.host}] failed: {e}")
+
+            result.duration = time.time() - t0
+
+            if not result.ok and fail_fast:
+                with lock:
+                    if failed.is_set():
+                        result.error = result.error or RuntimeError("aborted, another host failed")
+                    else:
+                        failed.set()
+                        self._abort()
 
-try:
-    import SocketServer
-except ImportError:
-    import socketserver as SocketServer
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            list(pool.map(run, self._reachers, results))
 
-# Define progress callback that prints the current percentage completed for the file
-def progress4(filename, size, sent, peername):
-    sys.stdout.write("(%s:%s) %s's progress: %.2f%%   \r" % (peername[0], peername[1], filename, float(sent)/float(size)*100) )
+        return results
 
-class RemoteClient:
-    """Client to interact with a remote host via SSH & SCP."""
+    def _pack(self, paths: List[str], excluded_exts: List[str]) -> str:
+        """Pack paths once into a local tarball shared by all uploads."""
 
-    def __init__(
+        fd, archive = tempfile.mkstemp(prefix="reacher-", suffix=".tar")
+
+        with os.fdopen(fd, "wb") as f, tarfile.open(fileobj=f, mode="w") as tar:
+            for path in paths:
+                for local_path, rel_path in Manifest.walk(path, excluded_exts, Reacher.EXCLUDES):
+                    tar.add(local_path, arcname=rel_path, recursive=False)
+
+        return archive
+
+    def put(
         self,
-        host: str,
-        user: str,
-        ssh_key_filepath: str,
-        port: int = 22,
-        password: str = None,
-    ):
-        self.host = host
-        self.user = user
-        self.password = password
-        self.ssh_key_filepath = ssh_key_filepath
-        self.port = port
-        self.client = None
-        self._upload_ssh_key()
+        path: Union[str, List[str]],
+        destination_folder: str = None,
+        excluded_exts: list = [".pyc"],
+        method: str = "tar",
+        delete: bool = False,
+    ) -> List[FleetResult]:
+        """Upload path to every host. With method "tar" the files are packed
+        into one local tarball, with "sync" or "objects" they are hashed
+        once, and the result is sent to all hosts in parallel."""
 
-    @property
-    def connection(self):
-        try:
-            client = SSHClient()
-            client.load_system_host_keys()
-            client.set_missing_host_key_policy(AutoAddPolicy())
-            client.connect(
-                self.host,
-                username=self.user,
-                password=self.password,
-                key_filename=self.ssh_key_filepath,
-                timeout=10000,
-                port=self.port,
-            )
-            return client
-        except AuthenticationException as e:
-            logging.error(
-                f"AuthenticationException occurred; did you remember to generate an SSH key? {e}"
+        if not isinstance(path, list):
+            path = [path]
+
+        def destination(reacher):
+            if destination_folder is None:
+                return reacher.build_path
+            return os.path.join(reacher.build_path, destination_folder)
+
+        if method == "tar":
+
+            archive = self._pack(path, excluded_exts)
+
+            try:
+                return self.map(
+                    lambda r, _: r._client.upload_archive(archive, destination(r))
+                )
+            finally:
+                os.remove(archive)
+
+        if method == "sync":
+
+            manifest = Manifest.scan(path, excluded_exts, excludes=Reacher.EXCLUDES)
+
+            return self.map(
+                lambda r, _: r._client.sync(
+                    path, destination(r), excluded_exts, delete=delete, manifest=manifest,
+                )
             )
-        except Exception as e:
-            logging.error(f"Unexpected error occurred while connecting to host: {e}")
 
-    @property
-    def scp(self) -> SCPClient:
-        conn = self.connection
-        return SCPClient(conn.get_transport(), progress4=progress4)
+        if method == "objects":
 
-    def _get_ssh_key(self):
-        try:
-            self.ssh_key = RSAKey.from_private_key_file(self.ssh_key_filepath)
-            logging.info(f"Found SSH key at self {self.ssh_key_filepath}")
-            return self.ssh_key
-        except SSHException as e:
-            logging.error(f"SSHException while getting SSH key: {e}")
-        except Exception as e:
-            logging.error(f"Unexpected error while getting SSH key: {e}")
+            manifest = Manifest.scan(path, excluded_exts, excludes=Reacher.EXCLUDES)
 
-    def _upload_ssh_key(self):
-        try:
-            system(
-                f"ssh-copy-id -i {self.ssh_key_filepath}.pub {self.user}@{self.host}>/dev/null 2>&1"
+            return self.map(
+                lambda r, _: r._client.upload_objects(
+                    path, destination(r), r.objects_path, excluded_exts, delete=delete, manifest=manifest,
+                )
             )
-            logging.info(f"{self.ssh_key_filepath} uploaded to {self.host}")
-        except FileNotFoundError as e:
-            logging.error(f"FileNotFoundError while uploading SSH key: {e}")
-        except Exception as e:
-            logging.error(f"Unexpected error while uploading SSH key: {e}")
 
-    def disconnect(self):
-        if self.connection:
-            self.client.close()
-        if self.scp:
-            self.scp.close()
+        return self.map(
+            lambda r, _: r.put(path, destination_folder, excluded_exts, method=method, delete=delete)
+        )
 
-    def upload_file(self, filepath: str, remote_path: str, excluded_exts: List[str] = [".pyc"]):
+    def _run_streamed(self, reacher: Reacher, command: str, result: FleetResult, produce=None):
 
-        if not any(filepath.endswith(ext) for ext in excluded_exts):
-            self.scp.put(filepath, remote_path)
-            logging.info(f"Finished uploading {filepath} to {remote_path} on {self.host}")
+        if produce is not None:
+            running = reacher._client.run_with_input(command, produce)
         else:
-            logging.info(f"Skipping {filepath} due to excluded extension")
-    
-    def _upload(self, filepath: str, remote_path: str, excluded_exts: List[str] = [".pyc"]):
+            running = reacher._client.run(command, get_pty=True)
 
-        # Execute command to create the remote directory
-        self.execute_command(f"mkdir -p {remote_path}")
+        with running:
+
+            with self._channels_lock:
+                self._channels.add(running.channel)
 
-        if os.path.isfile(filepath):
-            self.upload_file(filepath, remote_path, excluded_exts)
-        else:
-        
             try:
-                # Traverse the directory tree
-                for dirpath, _, filenames in os.walk(filepath):
+                for _, line in running.lines():
+                    result.output.append(line)
+                    self._print(result.host, line)
+            finally:
+                with self._channels_lock:
+                    self._channels.discard(running.channel)
 
-                    remote_dirpath = os.path.join(remote_path, dirpath)
+        result.exit_status = running.exit_status
 
-                    # Create remote directories if they don't exist
-                    self.execute_command(f"mkdir -p {remote_dirpath}")
+        return result.exit_status
 
-                    # Iterate through files
-                    for filename in filenames:
-                        local_path = os.path.join(dirpath, filename)
-                        # Upload the file
-                        self.upload_file(local_path, remote_dirpath, excluded_exts)
-                      
-                logging.info(
-                    f"Finished uploading {filepath} files to {remote_path} on {self.host}"
-                )
+    def execute(
+        self,
+        command: str,
+        context: Union[str, List[str]] = None,
+        cleanup_before: bool = False,
+        excluded_exts: list = [".pyc"],
+        method: str = "tar",
+        artifacts: List[str] = None,
+        destination: str = ".",
+        fail_fast: bool = None,
+    ) -> List[FleetResult]:
+        """Upload context to all hosts, run command everywhere and stream the
+        output prefixed with the host. Returns a FleetResult per host with the
+        exit status, duration, the tail of the output and, if artifacts are
+        given, their download results under destination/<host>. Hosts the
+        context could not be uploaded to do not run command, their upload
+        FleetResult is returned instead."""
 
-            except Exception as e:
-                logging.error(f"Unexpected exception during bulk upload: {e}")
+        if cleanup_before:
+            self.map(lambda r, _: r.cleanup(), fail_fast=False)
 
-    def upload(self, filepaths: List[str], remote_path: str, excluded_exts: List[str] = [".pyc"]):
+        failed = {}
 
-        if not isinstance(filepaths, list):
-            filepaths = [filepaths]
+        if context is not None:
+            uploads = self.put(context, excluded_exts=excluded_exts, method=method)
+            failed = {reacher: upload for reacher, upload in zip(self._reachers, uploads) if not upload.ok}
+            if failed and (self.fail_fast if fail_fast is None else fail_fast):
+                return uploads
 
-        for filepath in filepaths:
-            self._upload(filepath, remote_path, excluded_exts)
+        def run(reacher, result):
 
-    def download_file(self, remote_filepath: str, local_path: str):
+            if reacher in failed:
+                return
 
-        os.makedirs(local_path, exist_ok=True)
+            self._run_streamed(reacher, reacher._build_command(command), result)
 
-        self.scp.get(remote_filepath, local_path=local_path, recursive=True)
+            if artifacts is not None:
+                for artifact in artifacts:
+                    result.artifacts += reacher.get_artifact(
+                        artifact, os.path.join(destination, result.host), workers=4,
+                    )
 
-    def execute_command(
+        results = self.map(run, fail_fast=fail_fast)
+
+        return [failed.get(reacher, result) for reacher, result in zip(self._reachers, results)]
+
+    def follow(
         self,
-        command: str,
-        stream: bool = False,
-        suppress: bool = False,
-        ignore_output: bool = False,
-        timeout: int = None,
+        named_session: str,
+        mirror: str = None,
+        until_finished: bool = True,
+        interval: float = 1.0,
     ):
+        """Yield (host, text) as the log of named_session grows on the hosts,
+        all followed from the calling thread, see LogFollower."""
 
-        stdin, stdout, stderr = self.connection.exec_command(command, get_pty=True)
-
-        if ignore_output:
-            return
+        follower = LogFollower(interval=interval, mirror=mirror)
 
-        stdout._set_mode('rb')
+        for reacher in self._reachers:
+            follower.follow_session(reacher, named_session, name=self._name(reacher))
 
-        last_recieved = time.time()
+        return follower.follow(until_finished=until_finished)
 
-        if stream:
-            
-            response = ""
+    def collect_artifacts(self, artifact: str, destination: str = ".", **kwargs) -> List[FleetResult]:
+        """Download artifact from every host into destination/<host>."""
 
-            for line in iter(stdout.readline, ""):
-                
-                if timeout is not None and (time.time() - last_recieved > timeout):
-                    break
+        def collect(reacher, result):
+            result.artifacts = reacher.get_artifact(
+                artifact, os.path.join(destination, result.host), **{"workers": 4, **kwargs},
+            ) or []
 
-                if line == b"": # finsihed
-                    break
-                try:
-                    line = line.decode("utf-8")
-                except Exception as e:
-                    line = ""
+        return self.map(collect)
 
-                if not suppress: print(line, end="")
-                response += line
+    def setup(self, *args, **kwargs) -> List[FleetResult]:
+        return self.map(lambda r, _: r.setup(*args, **kwargs))
 
-                last_recieved = time.time()
+    def cleanup(self, *args, **kwargs) -> List[FleetResult]:
+        return self.map(lambda r, _: r.cleanup(*args, **kwargs))
 
-            response = None
-                        
-        else:
+    def build(self, force: bool = False) -> List[FleetResult]:
+        """Build the docker image of a fleet of ReacherDocker on every host
+        whose image is not up to date, see ReacherDocker.build. The build
+        context is packed once into a shared tarball that is streamed into
+        `docker build -` on each host."""
 
-            stdout.channel.recv_exit_status()
-            response = ""
-            for line in stdout.readlines():
+        reacher = self._reachers[0]
 
-                if timeout is not None and (time.time() - last_recieved > timeout):
-                    break
+        entries = reacher._context_entries()
+        fingerprint = reacher.context_fingerprint(entries)
 
-                if line == b"": # finsihed
-                    break
-                try:
-                    line = line.decode("utf-8")
-                except Exception as e:
-                    line = ""
+        fd, archive = tempfile.mkstemp(prefix="reacher-", suffix=".tar")
 
-                response += line
-                if not suppress: print(line)
+        with os.fdopen(fd, "wb") as f:
+            write_tar(f, entries)
 
-                last_recieved = time.time()
+        def produce(writer):
+            with open(archive, "rb") as f:
+                for block in iter(lambda: f.read(RemoteClient.TRANSFER_BLOCK_SIZE), b""):
+                    writer.write(block)
 
-        stderr.channel.recv_exit_status()
-        for line in stderr.readlines():
-            print(line)
+        def build(reacher, result):
 
-        return response
+            if not force and reacher.image_fingerprint() == fingerprint:
+                self._print(result.host, f"Image {reacher._build_name} is up to date")
+                result.exit_status = 0
+                return
 
-class Reacher(object):
+            self._run_streamed(reacher, reacher._docker_build_command(fingerprint), result, produce)
 
-    ARTIFACATS_PATH = "artifacts"
-    LOGS_PATH = "logs"
+        try:
+            return self.map(build)
+        finally:
+            os.remove(archive)
 
-    WORKSPACE_PATH = "~/.reacher"
-    BUILD_PATH = ""
+class AsyncRemoteClient(object):
+    """asyncio counterpart of RemoteClient.
 
-    EXCLUDES = [
-        ".git",
-        ".__pycache__",
-        "logs",
-    ]
+    Commands run on channels of the pooled transport of a RemoteClient and
+    their output is read by the event loop itself, so one loop can supervise
+    hundreds of commands without a thread each. Transfers are run in worker
+    threads. At most `max_concurrency` commands and transfers run at once.
+    """
 
     def __init__(
         self,
-        build_name: str,
         client: RemoteClient = None,
-        host: str = None,
-        port: int = 22,
-        user: str = None,
-        password: str = None,
-        ssh_key_filepath: str = None,
-        prefix_cmd: str = None,
+        max_concurrency: int = None,
+        **kwargs,
     ):
+        self._client = client if client is not None else RemoteClient(**kwargs)
+        self._max_concurrency = max_concurrency or self._client._connections.max_channels
+        self._semaphore = None
 
-        if client is None:
+    @property
+    def client(self) -> RemoteClient:
+        return self._client
 
-            assert (
-                host is not None
-                and user is not None
-                and ssh_key_filepath is not None
-            )
+    @property
+    def host(self) -> str:
+        return self._client.host
 
-            client = RemoteClient(
-                host=host,
-                user=user,
-                password=password,
-                ssh_key_filepath=ssh_key_filepath,
-                port=port,
-            )
+    @property
+    def semaphore(self) -> "asyncio.Semaphore":
 
-        self._client = client
-    
-        self._port_forwarding = PortForwarding(client=self._client)
+        # created lazily so it binds to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
 
-        self._prefix_cmd = prefix_cmd
+        return self._semaphore
 
-        self._build_name = build_name
-    
-    @property
-    def workspace_path(self):
+    async def __aenter__(self):
+        await self.connect()
+        return self
 
-        return os.path.join("/home", self._client.user, ".reacher")
-    
-    def add_port_forward(self, remote_port: int, local_port: int, paramiko: bool = True):
-        
-        self._port_forwarding.add_port_forward(remote_port, local_port, paramiko)
+    async def __aexit__(self, *args):
+        await self.disconnect()
 
-    @property
-    def build_path(self):
+    async def _in_thread(self, fn, *args, **kwargs):
 
-        return os.path.join(self.workspace_path, self._build_name)
+        loop = asyncio.get_running_loop()
 
-    @property
-    def log_path(self):
+        return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
 
-        return os.path.join(
-            self.workspace_path,
-            self._build_name,
-            Reacher.LOGS_PATH
-        )
+    async def connect(self):
+        await self._in_thread(lambda: self._client._connections.transport)
 
-    @property
-    def artifact_path(self):
+    async def disconnect(self):
+        await self._in_thread(self._client.disconnect)
 
-        return os.path.join(
-            self.workspace_path,
-            self._build_name,
-            Reacher.ARTIFACATS_PATH
-        )
+    async def events(self, command: str, get_pty: bool = False):
+        """Run command and yield ("stdout" | "stderr", bytes) as data arrives,
+        followed by ("exit", exit_status). The remote command is closed if the
+        consumer stops iterating or is cancelled."""
 
-    def setup(self):
+        async with self.semaphore:
 
-        self._client.execute_command(
-            f"mkdir -p {self.build_path} && mkdir -p {self.artifact_path} && mkdir -p {self.log_path}"
-        )
+            chan = await self._in_thread(self._client._connections.open_session)
 
-    def cleanup(self, exclude: list = ["artifacts", "logs"]):
+            loop = asyncio.get_running_loop()
+            ready = asyncio.Event()
 
-        files = self.ls()
-        files_pruned = []
+            try:
+                if get_pty:
+                    await self._in_thread(chan.get_pty)
+                await self._in_thread(chan.exec_command, command)
 
-        for x in files:
-            if any([f in x for f in exclude]):
-                continue
-            if x == "" or x == "." or x == "..":
-                continue
-            files_pruned.append(x)
+                loop.add_reader(chan.fileno(), ready.set)
 
-        if len(files_pruned) > 0:
-            cmd = f"rm -r {' '.join(files_pruned)}"
-            self.execute_command(cmd, suppress=True)
+                try:
+                    while True:
 
-        self.setup()
+                        while chan.recv_ready():
+                            yield "stdout", chan.recv(RemoteClient.TRANSFER_BLOCK_SIZE)
 
-    def ls(self, folder: str = None):
+                        while chan.recv_stderr_ready():
+                            yield "stderr", chan.recv_stderr(RemoteClient.TRANSFER_BLOCK_SIZE)
 
-        if folder is None:
-            folder = self.build_path
-        else:
-            folder = os.path.join(self.build_path, folder)
+                        if (chan.closed or chan.eof_received) and chan.exit_status_ready() \
+                                and not chan.recv_ready() and not chan.recv_stderr_ready():
+                            break
 
-        r = self.execute_command(
-            f"find {folder} -mindepth 1 -print",
-            suppress=True,
-            stream=False,
-        ).replace("\n", "").split("\r")
+                        ready.clear()
+                        try:
+                            # the exit status does not wake the channel's fd,
+                            # so never wait for it indefinitely
+                            await asyncio.wait_for(ready.wait(), 0.1)
+                        except asyncio.TimeoutError:
+                            pass
+                finally:
+                    loop.remove_reader(chan.fileno())
 
-        r = [x for x in r if x != "" and x != "."]
+                yield "exit", chan.recv_exit_status()
 
-        return r
+            finally:
+                chan.close()
 
-    def put(self, path: str, destination_folder: str = None, excluded_exts: list = [".pyc"]):
-        
-        if destination_folder is None:
-            destination_folder = self.build_path
-        else:
-            destination_folder = os.path.join(self.build_path, destination_folder)
+    async def lines(self, command: str, get_pty: bool = False):
+        """Run command and yield its output line by line as it arrives."""
 
-        if not isinstance(path, list):
-            path = [path]
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending = ""
 
-        for p in path:
-            self._client.upload(p, destination_folder, excluded_exts=excluded_exts)
+        async for stream, data in self.events(command, get_pty=get_pty):
 
-        # make sure all files are owned by the user
-        self._client.execute_command(
-            f"find {self.build_path}" + " -user $(whoami) -exec chmod 777 {} \;",
-            stream=False,
-            suppress=False,
-        )
+            if stream == "exit":
+                break
 
-    def get(self, path: Union[List[str], str], destination_folder: str = None):
+            pending += decoder.decode(data)
+            *complete, pending = pending.split("\n")
 
-        if destination_folder is None:
-            destination_folder = "."
+            for line in complete:
+                yield line.rstrip("\r") + "\n"
 
-        if not isinstance(path, list):
-            path = [path]
+        pending += decoder.decode(b"", final=True)
 
-        for p in path:
-            self._client.download_file(os.path.join(self.build_path, p), destination_folder)
+        if pending:
+            yield pending
 
-    @property
-    def artifacts(self):
-        self.ls(self.artifact_path)
+    async def run(self, command: str, get_pty: bool = False, timeout: float = None):
+        """Run command to completion, returns (exit status, stdout, stderr) as bytes."""
 
-    def get_artifact(self, artifact: str, destination: str = None):
-        self.get(os.path.join(self.artifact_path, artifact), destination)
+        async def collect():
 
-    def put_artifact(self, artifact: str):
-        self.put(artifact, self.artifact_path)
+            out, err, status = bytearray(), bytearray(), None
 
-    def _wrap_command_in_screen(self, command: str, named_session: str = None):
+            async for stream, data in self.events(command, get_pty=get_pty):
+                if stream == "stdout":
+                    out += data
+                elif stream == "stderr":
+                    err += data
+                else:
+                    status = data
 
-        named_session = named_session if named_session is not None else uuid.uuid4()
+            return status, bytes(out), bytes(err)
 
-        return f"screen -S {named_session} {command}"
-    
-    def _wrap_command_in_prefix(self, command: str):
-        
-        return f"{self._prefix_cmd};{command}"
-    
-    def execute(
+        return await asyncio.wait_for(collect(), timeout)
+
+    async def execute_command(
         self,
         command: str,
-        context: Union[str, List[str]] = None,
-        named_session: str = None,
-        cleanup_before: bool = False,
-        wrap_in_screen: bool = True,
-        excluded_exts: list = [".pyc"],
-    ):  
+        suppress: bool = False,
+        get_pty: bool = False,
+        timeout: float = None,
+    ) -> str:
 
-        if cleanup_before:
-            self.cleanup()
+        async def collect():
 
-        if context is not None:
-            self._client.upload(context, self.build_path, excluded_exts)
+            response = []
 
-        self.execute_command(
-            command,
-            named_session=named_session,
-            wrap_in_screen=wrap_in_screen
-        )
+            async for line in self.lines(command, get_pty=get_pty):
+                if not suppress:
+                    print(line, end="")
+                response.append(line)
 
+            return "".join(response)
 
-    def execute_command(
+        return await asyncio.wait_for(collect(), timeout)
+
+    async def upload(self, *args, **kwargs):
+        async with self.semaphore:
+            return await self._in_thread(self._client.upload, *args, **kwargs)
+
+    async def download_file(self, *args, **kwargs):
+        async with self.semaphore:
+            return await self._in_thread(self._client.download_file, *args, **kwargs)
+
+class AsyncReacher(object):
+    """asyncio counterpart of Reacher, wrapping a (sync) Reacher instance.
+
+    Commands go through an AsyncRemoteClient on the same connection,
+    everything else (put, get, setup, cleanup...) is run in worker threads.
+    """
+
+    REACHER = Reacher
+
+    def __init__(self, reacher: Reacher = None, max_concurrency: int = None, **kwargs):
+
+        self._reacher = reacher if reacher is not None else self.REACHER(**kwargs)
+        self._client = AsyncRemoteClient(self._reacher._client, max_concurrency=max_concurrency)
+
+    @property
+    def reacher(self) -> Reacher:
+        return self._reacher
+
+    @property
+    def client(self) -> AsyncRemoteClient:
+        return self._client
+
+    async def _in_thread(self, fn, *args, **kwargs):
+
+        async with self._client.semaphore:
+            return await self._client._in_thread(fn, *args, **kwargs)
+
+    async def setup(self, *args, **kwargs):
+        return await self._in_thread(self._reacher.setup, *args, **kwargs)
+
+    async def cleanup(self, *args, **kwargs):
+        return await self._in_thread(self._reacher.cleanup, *args, **kwargs)
+
+    async def ls(self, *args, **kwargs):
+        return await self._in_thread(self._reacher.ls, *args, **kwargs)
+
+    async def put(self, *args, **kwargs):
+        return await self._in_thread(self._reacher.put, *args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return await self._in_thread(self._reacher.get, *args, **kwargs)
+
+    async def put_artifact(self, *args, **kwargs):
+        return await self._in_thread(self._reacher.put_artifact, *args, **kwargs)
+
+    async def get_artifact(self, *args, **kwargs):
+        return await self._in_thread(self._reacher.get_artifact, *args, **kwargs)
+
+    def lines(
         self,
-        command,
-        stream: bool = True,
+        command: str,
+        named_session: str = None,
+        wrap_in_screen: bool = False,
+        get_pty: bool = True,
+    ):
+        return self._client.lines(
+            self._reacher._build_command(command, named_session, wrap_in_screen),
+            get_pty=get_pty,
+        )
+
+    async def execute_command(
+        self,
+        command: str,
         suppress: bool = False,
         named_session: str = None,
         wrap_in_screen: bool = False,
-        ignore_output: bool = False,
-        timeout: int = None,
-    ):  
+        get_pty: bool = True,
+        timeout: float = None,
+    ) -> str:
 
-        if wrap_in_screen:
-            command = self._wrap_command_in_screen(command, named_session=named_session)
+        return await self._client.execute_command(
+            self._reacher._build_command(command, named_session, wrap_in_screen),
+            suppress=suppress,
+            get_pty=get_pty,
+            timeout=timeout,
+        )
+
+    async def execute(
+        self,
+        command: str,
+        context: Union[str, List[str]] = None,
+        named_session: str = None,
+        cleanup_before: bool = False,
+        wrap_in_screen: bool = True,
+        excluded_exts: list = [".pyc"],
+        method: str = "scp",
+        delete: bool = False,
+        suppress: bool = False,
+        timeout: float = None,
+    ) -> str:
 
-        if self._prefix_cmd is not None:
-            command = self._wrap_command_in_prefix(command)
+        if cleanup_before:
+            await self.cleanup()
 
-        command = f"cd {self.build_path} && {command}"
+        if context is not None:
+            await self._in_thread(
+                self._reacher._client.upload,
+                context, self._reacher.build_path, excluded_exts,
+                method=method, delete=delete, excludes=Reacher.EXCLUDES,
+                objects_path=self._reacher.objects_path,
+            )
 
-        return self._client.execute_command(
+        return await self.execute_command(
             command,
-            stream=stream,
             suppress=suppress,
-            ignore_output=ignore_output,
+            named_session=named_session,
+            wrap_in_screen=wrap_in_screen,
             timeout=timeout,
         )
-    
-    def list_named_sessions(self):
 
-        self.execute_command(f"screen -list")
+class AsyncReacherDocker(AsyncReacher):
+    """asyncio counterpart of ReacherDocker."""
 
-    def attach_named_session(self, named_session: str):
+    REACHER = ReacherDocker
 
-        self.execute_command(f"screen -r -d {named_session}")
+    async def build(self, *args, **kwargs):
+        return await self._in_thread(self._reacher.build, *args, **kwargs)
 
-    def kill_named_session(self, named_session: str):
+    async def setup(self, *args, **kwargs):
+        return await self._in_thread(self._reacher.setup, *args, **kwargs)
 
-        self.execute_command(f"screen -X -S {named_session} quit")
+    async def clear(self):
+        return await self._in_thread(self._reacher.clear)
 
-class ReacherDocker(Reacher):
+class Tunnel(object):
+    """A forwarded local port and its traffic counters."""
 
-    CON_WORKSPACE_PATH = "/workspace"
+    def __init__(self, local_port: int, remote_host: str, remote_port: int, listener: socket.socket):
+        self.local_port = local_port
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.listener = listener
+        self.connections = 0
+        self.active = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.open_latency = 0.0
+        self.max_open_latency = 0.0
 
-    MOUNTED = [
-        Reacher.ARTIFACATS_PATH,
-        Reacher.LOGS_PATH, 
-    ]
+    @property
+    def mean_open_latency(self) -> float:
+        opened = self.connections - self.failed
+        return self.open_latency / opened if opened > 0 else 0.0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "local_port": self.local_port,
+            "remote": f"{self.remote_host}:{self.remote_port}",
+            "connections": self.connections,
+            "active": self.active,
+            "failed": self.failed,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "mean_open_latency": self.mean_open_latency,
+            "max_open_latency": self.max_open_latency,
+        }
+
+class _Pipe(object):
+    """One forwarded connection: a local socket bridged to an SSH channel."""
+
+    def __init__(self, tunnel: Tunnel, sock: socket.socket, chan, span=NULL_SPAN):
+        self.tunnel = tunnel
+        self.sock = sock
+        self.chan = chan
+        self.span = span
+        self.to_chan = bytearray()
+        self.to_sock = bytearray()
+        self.sock_eof = False
+        self.chan_eof = False
+        self.chan_shut = False
+        self.sock_shut = False
+
+class ForwardingEngine(object):
+    """Serves any number of forwarded ports from a single selector thread.
+
+    Each accepted local connection gets a direct-tcpip channel on the
+    transport returned by get_transport. Data is moved in blocks of
+    buffer_size; a direction stops reading once max_buffer bytes are
+    pending on the other side, so a slow peer pushes back instead of
+    growing memory. Opening channels is a round trip to the remote and is
+    done on a few helper threads so it never stalls established tunnels.
+    """
 
     def __init__(
         self,
-        build_name: str,
-        image_name: str,
-        build_context: str,
-        client: RemoteClient = None,
-        host: str = None,
-        port: int = 22,
-        user: str = None,
-        password: str = None,
-        ssh_key_filepath: str = None
+        get_transport,
+        buffer_size: int = 256 * 1024,
+        max_buffer: int = 4 * 1024 * 1024,
+        window_size: int = None,
+        metrics: Metrics = None,
     ):
+        self._get_transport = get_transport
+        self.buffer_size = buffer_size
+        self.max_buffer = max_buffer
+        self.window_size = window_size
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        self.tunnels = []
+
+        self._selector = selectors.DefaultSelector()
+        self._pipes = set()
+        self._opened = collections.deque()
+        self._openers = None
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, ("wakeup", None))
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
 
-        super().__init__(
-            build_name=build_name,
-            client=client,
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            ssh_key_filepath=ssh_key_filepath
-        )
+    def add(self, local_port: int, remote_host: str, remote_port: int, bind: str = "") -> Tunnel:
 
-        self._image_name = image_name
-        self._build_context = build_context 
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((bind, local_port))
+        listener.listen(128)
+        listener.setblocking(False)
 
-    def _setup_remote(self):
+        tunnel = Tunnel(listener.getsockname()[1], remote_host, remote_port, listener)
 
-        super().setup()
+        with self._lock:
+            self.tunnels.append(tunnel)
+            self._selector.register(listener, selectors.EVENT_READ, ("accept", tunnel))
 
-        self._client.upload(
-            self._build_context,
-            self.build_path,
-        )
+        self._wakeup()
 
-    def clear(self):
+        logging.info(f"Forwarding local port {tunnel.local_port} to {remote_host}:{remote_port}")
 
-        if self.is_running:
-            self._client.execute_command(
-                f"docker stop {self._build_name}", suppress=True,
-            )
+        return tunnel
 
-        if self.exists:
-            self._client.execute_command(
-                f"docker rm {self._build_name}", suppress=True,
-            )
+    def remove(self, tunnel: Tunnel):
+        """Stop accepting connections on tunnel, the open ones are kept until they finish."""
 
-    def ls(self, folder: str = None):
+        with self._lock:
+            if tunnel not in self.tunnels:
+                return
+            self.tunnels.remove(tunnel)
+            self._selector.unregister(tunnel.listener)
+            tunnel.listener.close()
 
-        if folder is None:
-            folder = "."
+        self._wakeup()
 
-        r = self.execute_command(
-            f"find {folder} -mindepth 1 -print",
-            suppress=True,
-            stream=False,
-        ).replace("\n", "").split("\r")
+        logging.info(f"Stopped forwarding local port {tunnel.local_port}")
 
-        r = [x for x in r if x != "" and x != "."]
+    def start(self):
 
-        return r
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
 
-    def build(self):
+    def stop(self):
+        """Close every tunnel and forwarded connection and stop the loop."""
 
-        self.clear()
+        self._running = False
+        self._wakeup()
 
-        self._setup_remote()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
 
-        self._client.execute_command(
-            f"docker build -t {self._build_name} {os.path.join(self.build_path, self._build_context)}",
-            stream=True,
-        )
+    @property
+    def stats(self) -> List[dict]:
+        return [t.stats for t in self.tunnels]
 
-    def execute_command(
-        self,
-        command,
-        stream: bool = True,
-        suppress: bool = False,
-        named_session: str = None,
-        wrap_in_screen: bool = False,
-        ignore_output: bool = False,
-    ):  
+    def _open(self, tunnel: Tunnel, sock: socket.socket, peer, span):
 
-        if wrap_in_screen or named_session is not None:
-            command = self._wrap_command_in_screen(command, named_session=named_session)
+        t0 = time.time()
 
-        command = f"docker exec -it {self._build_name} {command}"
+        try:
+            kwargs = {"window_size": self.window_size} if self.window_size else {}
+            chan = self._get_transport().open_channel(
+                "direct-tcpip", (tunnel.remote_host, tunnel.remote_port), peer, **kwargs,
+            )
+        except Exception as e:
+            logging.warning(
+                f"Forwarding to {tunnel.remote_host}:{tunnel.remote_port} failed: {e!r}"
+            )
+            chan = None
 
-        return self._client.execute_command(
-            command,
-            stream=stream,
-            suppress=suppress,
-            ignore_output=ignore_output,
+        self._opened.append((tunnel, sock, chan, span, time.time() - t0))
+        self._wakeup()
+
+    def _accept(self, tunnel: Tunnel):
+
+        try:
+            sock, peer = tunnel.listener.accept()
+        except OSError:
+            # nothing to accept, or the tunnel was removed meanwhile
+            return
+
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        tunnel.connections += 1
+
+        span = self.metrics.span(
+            "tunnel", local_port=tunnel.local_port, remote=f"{tunnel.remote_host}:{tunnel.remote_port}",
         )
 
-    def setup(
-        self,
-        ports: List[int] = None,
-        envs: Dict[str, str] = None,
-        command: str = "sleep infinity",
-        gpu: bool = False,
-    ):
+        self._openers.submit(self._open, tunnel, sock, peer, span)
 
-        self.clear()
+    def _attach_opened(self):
 
-        extra_args = ""
+        while self._opened:
 
-        if gpu:
-            extra_args = "--runtime=nvidia --gpus all"
+            tunnel, sock, chan, span, latency = self._opened.popleft()
 
-        ctx = f"docker run -dt {extra_args} -w {ReacherDocker.CON_WORKSPACE_PATH} --name {self._build_name}"
+            if chan is None:
+                tunnel.failed += 1
+                sock.close()
+                span.finish("channel open failed")
+                continue
 
-        ctx = f"{ctx} -v {self.build_path}:{ReacherDocker.CON_WORKSPACE_PATH}"
+            tunnel.active += 1
+            tunnel.open_latency += latency
+            tunnel.max_open_latency = max(tunnel.max_open_latency, latency)
 
-        if ports is not None:
-            for p in ports:
-                ctx = f"{ctx} -p {p}:{p}"
+            chan.settimeout(0.0)
 
-        if envs is not None:
-            for k, v in envs.items():
-                ctx = f"{ctx} -e {k}={v}"
+            pipe = _Pipe(tunnel, sock, chan, span)
+            self._pipes.add(pipe)
+            self._update(pipe)
 
-        ctx = f"{ctx} {self._image_name} {command}"
+    def _register(self, fileobj, events: int, data):
 
-        self._client.execute_command(ctx)
+        key = self._selector.get_map().get(fileobj)
 
-        # Install screen in container
-        self.execute_command(
-            "apt-get -y install screen",
-            wrap_in_screen=False,
-        )
+        if key is None:
+            if events:
+                self._selector.register(fileobj, events, data)
+        elif events:
+            if key.events != events:
+                self._selector.modify(fileobj, events, data)
+        else:
+            self._selector.unregister(fileobj)
 
-    @property
-    def is_running(self):
+    def _update(self, pipe: _Pipe):
 
-        r = self._client.execute_command(
-                'docker ps --format {{.Names}}', suppress=True,
-        ).replace("\r", "").split("\n")
+        sock_events = 0
+        if not pipe.sock_eof and len(pipe.to_chan) < self.max_buffer:
+            sock_events |= selectors.EVENT_READ
+        if pipe.to_sock:
+            sock_events |= selectors.EVENT_WRITE
 
-        return self._build_name in r
+        chan_events = 0
+        if not pipe.chan_eof and len(pipe.to_sock) < self.max_buffer:
+            chan_events |= selectors.EVENT_READ
 
-    @property
-    def exists(self):
+        self._register(pipe.sock, sock_events, ("sock", pipe))
+        self._register(pipe.chan.fileno(), chan_events, ("chan", pipe))
 
-        r = self._client.execute_command(
-                'docker ps -a --format {{.Names}}', suppress=True,
-        ).replace("\r", "").split("\n")
+    def _close(self, pipe: _Pipe):
 
-        return self._build_name in r
+        self._register(pipe.sock, 0, None)
+        self._register(pipe.chan.fileno(), 0, None)
 
-    if __name__ == "__main__":
+        pipe.chan.close()
+        pipe.sock.close()
 
-        pass
+        pipe.tunnel.active -= 1
+        self._pipes.discard(pipe)
 
-class ForwardServer(SocketServer.ThreadingTCPServer):
-    daemon_threads = True
-    allow_reuse_address = True
+        pipe.span.finish()
+
+    def _flush_chan(self, pipe: _Pipe):
+
+        while pipe.to_chan and pipe.chan.send_ready():
+            try:
+                sent = pipe.chan.send(bytes(pipe.to_chan[:self.buffer_size]))
+            except socket.timeout:
+                break
+            if sent <= 0:
+                break
+            del pipe.to_chan[:sent]
+            pipe.tunnel.bytes_sent += sent
+            pipe.span.add(sent)
+
+        if pipe.sock_eof and not pipe.to_chan and not pipe.chan_shut:
+            pipe.chan.shutdown_write()
+            pipe.chan_shut = True
+
+    def _flush_sock(self, pipe: _Pipe):
+
+        while pipe.to_sock:
+            try:
+                sent = pipe.sock.send(pipe.to_sock[:self.buffer_size])
+            except (BlockingIOError, InterruptedError):
+                break
+            del pipe.to_sock[:sent]
+            pipe.tunnel.bytes_received += sent
+            pipe.span.add(sent)
+
+        if pipe.chan_eof and not pipe.to_sock and not pipe.sock_shut:
+            try:
+                pipe.sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            pipe.sock_shut = True
+
+    def _read_sock(self, pipe: _Pipe):
 
-class Handler(SocketServer.BaseRequestHandler):
-    
-    def handle(self):
         try:
-            chan = self.ssh_transport.open_channel(
-                "direct-tcpip",
-                (self.chain_host, self.chain_port),
-                self.request.getpeername(),
-            )
-        except Exception as e:
-            print(
-                "Incoming request to %s:%d failed: %s"
-                % (self.chain_host, self.chain_port, repr(e))
-            )
+            data = pipe.sock.recv(self.buffer_size)
+        except (BlockingIOError, InterruptedError):
             return
-        if chan is None:
-            print(
-                "Incoming request to %s:%d was rejected by the SSH server."
-                % (self.chain_host, self.chain_port)
-            )
+
+        if data:
+            pipe.to_chan += data
+        else:
+            pipe.sock_eof = True
+
+    def _read_chan(self, pipe: _Pipe):
+
+        while pipe.chan.recv_ready() and len(pipe.to_sock) < self.max_buffer:
+            pipe.to_sock += pipe.chan.recv(self.buffer_size)
+
+        if (pipe.chan.eof_received or pipe.chan.closed) and not pipe.chan.recv_ready():
+            pipe.chan_eof = True
+
+    def _step(self, pipe: _Pipe):
+
+        try:
+            self._flush_chan(pipe)
+            self._flush_sock(pipe)
+        except (OSError, EOFError):
+            self._close(pipe)
             return
 
-        print(
-            "Connected!  Tunnel open %r -> %r -> %r"
-            % (
-                self.request.getpeername(),
-                chan.getpeername(),
-                (self.chain_host, self.chain_port),
-            )
+        # a closed channel can still hold data that was not read yet
+        finished = (
+            (pipe.sock_shut and pipe.chan_shut)
+            or (pipe.chan.closed and not pipe.to_sock and not pipe.chan.recv_ready())
         )
-        while True:
-            r, w, x = select.select([self.request, chan], [], [])
-            if self.request in r:
-                data = self.request.recv(1024)
-                if len(data) == 0:
-                    break
-                chan.send(data)
-            if chan in r:
-                data = chan.recv(1024)
-                if len(data) == 0:
-                    break
-                self.request.send(data)
 
-        peername = self.request.getpeername()
-        chan.close()
-        self.request.close()
-        print("Tunnel closed from %r" % (peername,))
+        if finished:
+            self._close(pipe)
+        else:
+            self._update(pipe)
+
+    def run(self):
 
-def forward_tunnel(local_port, remote_host, remote_port, transport):
+        self._running = True
+        self._openers = ThreadPoolExecutor(max_workers=4)
 
-    class SubHander(Handler):
-        chain_host = remote_host
-        chain_port = remote_port
-        ssh_transport = transport
+        try:
+            while self._running:
+
+                # writes into a channel can stall on the SSH window, which
+                # has no fd to wait on, so poll while any is pending
+                pending = any(p.to_chan for p in self._pipes)
+
+                for key, mask in self._selector.select(timeout=0.01 if pending else 1.0):
+
+                    kind, obj = key.data
+
+                    if kind == "wakeup":
+                        try:
+                            while self._wakeup_r.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    elif kind == "accept":
+                        self._accept(obj)
+                    elif kind == "sock" and obj in self._pipes:
+                        if mask & selectors.EVENT_READ:
+                            try:
+                                self._read_sock(obj)
+                            except OSError:
+                                self._close(obj)
+                                continue
+                        self._step(obj)
+                    elif kind == "chan" and obj in self._pipes:
+                        self._read_chan(obj)
+                        self._step(obj)
+
+                self._attach_opened()
+
+                if pending:
+                    for pipe in list(self._pipes):
+                        if pipe.to_chan:
+                            self._step(pipe)
+        finally:
+            for pipe in list(self._pipes):
+                self._close(pipe)
+            with self._lock:
+                for tunnel in self.tunnels:
+                    self._selector.unregister(tunnel.listener)
+                    tunnel.listener.close()
+                self.tunnels = []
+            self._openers.shutdown(wait=False)
 
-    ForwardServer(("", local_port), SubHander).serve_forever()
-    
+def forward_tunnel(local_port, remote_host, remote_port, transport):
+
+    engine = ForwardingEngine(lambda: transport)
+    engine.add(local_port, remote_host, remote_port)
+    engine.run()
 
 def forward_tunnel_system(
         local_port,
@@ -686,9 +5800,36 @@ def forward_tunnel_system(
 
     command = f"ssh -o StrictHostKeyChecking=no -i {client.ssh_key_filepath} -L 0.0.0.0:{local_port}:localhost:{remote_port} -N {client.user}@{client.host} -p {client.port}"
     
-    os.system(command)
-    
-import threading
+    return subprocess.Popen(shlex.split(command))
+
+class SystemTunnel(object):
+    """A forwarded local port served by an `ssh -L` process."""
+
+    def __init__(self, local_port: int, remote_port: int, process):
+        self.local_port = local_port
+        self.remote_port = remote_port
+        self.process = process
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "local_port": self.local_port,
+            "remote": f"localhost:{self.remote_port}",
+            "running": self.process.poll() is None,
+        }
+
+    def close(self):
+
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def __repr__(self):
+        return f"SystemTunnel(localhost:{self.local_port} -> localhost:{self.remote_port})"
     
 class PortForwarding(object):
     
@@ -700,6 +5841,9 @@ class PortForwarding(object):
         ssh_key_file_path: str = None,
         password: str = None,
         client: RemoteClient = None,
+        buffer_size: int = 256 * 1024,
+        max_buffer: int = 4 * 1024 * 1024,
+        window_size: int = None,
     ):
         
         if client is None:
@@ -708,7 +5852,7 @@ class PortForwarding(object):
                 host=host,
                 user=user,
                 password=password,
-                ssh_key_file_path=ssh_key_file_path,
+                ssh_key_filepath=ssh_key_file_path,
                 port=ssh_port,
             )
             
@@ -716,60 +5860,351 @@ class PortForwarding(object):
             
             self._client = client
 
-        self._threads = []
+        self._system_tunnels = []
+
+        # all paramiko forwards share one selector thread and the pooled
+        # transport of the client
+        self._engine = ForwardingEngine(
+            lambda: self._client._connections.transport,
+            buffer_size=buffer_size,
+            max_buffer=max_buffer,
+            window_size=window_size,
+            metrics=self._client.metrics,
+        )
     
-    def add_port_forward(self, remote_port: int, local_port: int, paramiko: bool = True):
+    def add_port_forward(
+        self,
+        remote_port: int,
+        local_port: int,
+        paramiko: bool = True,
+        remote_host: str = None,
+    ):
         
         if paramiko:
 
-            transport = self._client.connection.get_transport()
-        
-            x = threading.Thread(
-                target=forward_tunnel,
-                args=(local_port, self._client.host, remote_port, transport),
-                daemon=True
+            tunnel = self._engine.add(
+                local_port,
+                remote_host if remote_host is not None else self._client.host,
+                remote_port,
             )
 
-        else:
-                
-            x = threading.Thread(
-                target=forward_tunnel_system,
-                args=(local_port, remote_port, self._client),
-                daemon=True
+            self._engine.start()
+
+            return tunnel
+
+        tunnel = SystemTunnel(
+            local_port, remote_port, forward_tunnel_system(local_port, remote_port, self._client),
+        )
+
+        self._system_tunnels.append(tunnel)
+
+        return tunnel
+
+    def remove_port_forward(self, tunnel: Union[Tunnel, SystemTunnel]):
+
+        if isinstance(tunnel, SystemTunnel):
+            tunnel.close()
+            if tunnel in self._system_tunnels:
+                self._system_tunnels.remove(tunnel)
+            return
+
+        self._engine.remove(tunnel)
+
+    @property
+    def tunnels(self) -> List[Union[Tunnel, SystemTunnel]]:
+        return list(self._engine.tunnels) + list(self._system_tunnels)
+
+    @property
+    def stats(self) -> List[dict]:
+        return self._engine.stats + [tunnel.stats for tunnel in self._system_tunnels]
+
+    def stop(self):
+        """Close all forwards, the ssh processes of system ones included."""
+
+        self._engine.stop()
+
+        for tunnel in self._system_tunnels:
+            tunnel.close()
+
+        self._system_tunnels = []
+
+
+class Service(object):
+    """A server to run on the remote, see ServiceLauncher.
+
+    command runs in the build path as the session name and listens on
+    remote_port, which is forwarded to local_port (a free one if None)
+    once it is ready. It is ready once a TCP connection to remote_port
+    succeeds or, with health_path, once a GET of health_path answers
+    with a status below 500. token, if the service needs one, is part of
+    the url of its handle.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        command: str,
+        remote_port: int,
+        local_port: int = None,
+        health_path: str = None,
+        url_path: str = "/",
+        token: str = None,
+        timeout: float = 60.0,
+    ):
+        self.name = name
+        self.command = command
+        self.remote_port = remote_port
+        self.local_port = local_port
+        self.health_path = health_path
+        self.url_path = url_path
+        self.token = token
+        self.timeout = timeout
+
+class ServiceHandle(object):
+    """A service started by ServiceLauncher, forwarded to local_port."""
+
+    def __init__(
+        self,
+        service: Service,
+        reacher: "Reacher",
+        local_port: int,
+        tunnel: Union[Tunnel, "SystemTunnel"] = None,
+        ready_after: float = None,
+    ):
+        self.service = service
+        self.name = service.name
+        self.remote_port = service.remote_port
+        self.local_port = local_port
+        self.token = service.token
+        self.tunnel = tunnel
+        self.ready_after = ready_after
+        self.pid = None
+        self._reacher = reacher
+
+    @property
+    def url(self) -> str:
+
+        url = f"http://localhost:{self.local_port}{self.service.url_path}"
+
+        return f"{url}?token={self.token}" if self.token else url
+
+    def stop(self) -> bool:
+        """Close the forward and kill the session, returns whether it was running."""
+
+        if self.tunnel is not None:
+            self._reacher.remove_port_forward(self.tunnel)
+            self.tunnel = None
+
+        return self._reacher.kill_named_session(self.name, suppress=True)
+
+    def __repr__(self):
+        return f"ServiceHandle({self.name}, pid {self.pid}, {self.url})"
+
+class _RefusedProbeFilter(logging.Filter):
+    """Drops the errors paramiko logs for channels to ports that do not
+    accept connections yet, which is what a readiness probe expects."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return "Connect failed" not in record.getMessage()
+
+class ServiceLauncher(object):
+    """Starts services on the remote of a Reacher and forwards them once
+    they are ready.
+
+    The services are started in one round trip and probed concurrently
+    over direct-tcpip channels of the SSH transport, so nothing needs to
+    be installed on the remote and the probes see the port exactly like
+    the forwards will. A probe that fails is retried after interval,
+    2 * interval, ... up to max_interval seconds, so starting takes about
+    as long as the slowest service rather than a fixed sleep per service.
+    A service whose session exits or that is not ready within its
+    timeout fails the start, and every service started with it is
+    stopped again.
+    """
+
+    # seconds between checks whether the session of a service that is not
+    # ready yet has exited
+    EXIT_CHECK_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        reacher: "Reacher",
+        interval: float = 0.05,
+        max_interval: float = 0.5,
+        probe_timeout: float = 5.0,
+        paramiko: bool = True,
+    ):
+        self._reacher = reacher
+        self._client = reacher._client
+        self.interval = interval
+        self.max_interval = max_interval
+        self.probe_timeout = probe_timeout
+        self.paramiko = paramiko
+
+    def probe(self, port: int, health_path: str = None) -> bool:
+        """Whether port on the remote accepts connections and, with
+        health_path, answers a GET of it with a status below 500."""
+
+        self._client.metrics.count("round_trips")
+
+        try:
+            with self._client._connections.slot():
+                chan = self._client._connections.transport.open_channel(
+                    "direct-tcpip", (self._client.host, port), ("127.0.0.1", 0), timeout=self.probe_timeout,
+                )
+        except (paramiko.ChannelException, paramiko.SSHException, EOFError, socket.error):
+            return False
+
+        try:
+            if health_path is None:
+                return True
+
+            chan.settimeout(self.probe_timeout)
+            chan.sendall(
+                f"GET {health_path} HTTP/1.0\r\nHost: localhost:{port}\r\nConnection: close\r\n\r\n".encode("ascii")
             )
 
-        self._threads.append(x)
-        
-        self._threads[-1].start()
+            response = b""
+            while b"\r\n" not in response and len(response) < 1024:
+                data = chan.recv(1024)
+                if not data:
+                    break
+                response += data
 
+            status = response.split(b"\r\n", 1)[0].split()
 
-## Some helper functions for creating notebooks and tensorboards
+            return len(status) >= 2 and status[0].startswith(b"HTTP/") and status[1].isdigit() and int(status[1]) < 500
+        except (socket.error, EOFError, paramiko.SSHException):
+            return False
+        finally:
+            chan.close()
 
-def create_notebook(
-    reacher: Reacher,
-    remote_port: int,
-    local_port: int,
-    paramiko: bool = False
-):
+    def _exited(self, name: str) -> bool:
+
+        sessions = self._reacher.list_named_sessions(suppress=True)
+
+        return any(s.name == name and not s.running for s in sessions)
+
+    def _log_tail(self, name: str, size: int = 2048) -> str:
 
-    import time 
+        try:
+            log = self._client.read_file(os.path.join(self._reacher.log_path, f"{name}.log"))
+        except IOError:
+            return ""
+
+        return log[-size:].decode("utf-8", "replace").strip()
+
+    def _wait(self, service: Service) -> float:
+        """Wait until service is ready, returns after how many seconds."""
+
+        started = time.time()
+        interval = self.interval
+        checked = started
+
+        while not self.probe(service.remote_port, service.health_path):
+
+            now = time.time()
+
+            if now - started > service.timeout:
+                raise RuntimeError(
+                    f"{service.name} on {self._client.host} was not ready within {service.timeout}s: "
+                    f"{self._log_tail(service.name)}"
+                )
+
+            if now - checked >= ServiceLauncher.EXIT_CHECK_INTERVAL:
+                checked = now
+                if self._exited(service.name):
+                    raise RuntimeError(
+                        f"{service.name} on {self._client.host} exited before it was ready: "
+                        f"{self._log_tail(service.name)}"
+                    )
+
+            time.sleep(interval)
+            interval = min(interval * 2, self.max_interval)
+
+        return time.time() - started
+
+    def _forward(self, service: Service) -> ServiceHandle:
+
+        ready_after = self._wait(service)
+
+        local_port = service.local_port
+        if local_port is None and not self.paramiko:
+            with socket.socket() as s:
+                s.bind(("", 0))
+                local_port = s.getsockname()[1]
+
+        tunnel = self._reacher.add_port_forward(
+            remote_port=service.remote_port, local_port=local_port or 0, paramiko=self.paramiko,
+        )
+        local_port = tunnel.local_port
 
-    reacher.execute_command(
-        f"jupyter notebook --ip 0.0.0.0 --allow-root --port {remote_port}",
-        wrap_in_screen=True,
-        named_session="notebook",
-        ignore_output=True,
-    )
+        logging.info(f"{service.name} on {self._client.host} is ready after {ready_after:.2f}s, on localhost:{local_port}")
 
-    time.sleep(1)
+        return ServiceHandle(service, self._reacher, local_port, tunnel=tunnel, ready_after=ready_after)
 
-    reacher.add_port_forward(remote_port=remote_port, local_port=local_port, paramiko=paramiko)
+    def start(self, services: List[Service]) -> List[ServiceHandle]:
+        """Start services and return their handles once all of them are
+        ready and forwarded."""
 
-    r = reacher.execute_command("jupyter notebook list", stream=False, suppress=True)
+        self._reacher.start_named_sessions({service.name: service.command for service in services})
 
-    r = r.replace(str(remote_port), str(local_port))
+        refused = _RefusedProbeFilter()
+        logging.getLogger("paramiko.transport").addFilter(refused)
 
-    print(r)
+        try:
+            with ThreadPoolExecutor(max_workers=len(services)) as pool:
+                futures = [pool.submit(self._forward, service) for service in services]
+        finally:
+            logging.getLogger("paramiko.transport").removeFilter(refused)
+
+        handles = [f.result() for f in futures if f.exception() is None]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+
+        if errors:
+            for handle in handles:
+                handle.stop()
+            for service in services:
+                if service.name not in [handle.name for handle in handles]:
+                    self._reacher.kill_named_session(service.name, suppress=True)
+            raise RuntimeError("; ".join(str(e) for e in errors))
+
+        pids = {s.name: s.pid for s in self._reacher.list_named_sessions(suppress=True)}
+        for handle in handles:
+            handle.pid = pids.get(handle.name)
+
+        return handles
+
+## Some helper functions for creating notebooks and tensorboards
+
+def create_notebook(
+    reacher: Reacher,
+    remote_port: int,
+    local_port: int,
+    paramiko: bool = False,
+    token: str = None,
+) -> ServiceHandle:
+
+    token = token if token is not None else secrets.token_hex(24)
+
+    # the token is passed in rather than looked up with `jupyter notebook
+    # list`; ServerApp is the name of the option from notebook 7 on
+    notebook, = ServiceLauncher(reacher, paramiko=paramiko).start([
+        Service(
+            "notebook",
+            f"jupyter notebook --ip 0.0.0.0 --allow-root --no-browser --port {remote_port} "
+            f"--NotebookApp.token={token} --ServerApp.token={token}",
+            remote_port,
+            local_port,
+            health_path="/api",
+            url_path="/tree",
+            token=token,
+        ),
+    ])
+
+    print(f"notebook running on\n{notebook.url}")
+
+    return notebook
 
 def create_tensorboard(
     reacher: Reacher,
@@ -777,21 +6212,18 @@ def create_tensorboard(
     local_port: int,
     paramiko: bool = False,
     logdir: str = "artifacts"
-):
-    
-    import time 
-    
-    reacher.execute_command(f"mkdir -p {logdir}")
-
-    reacher.execute_command(
-        f"tensorboard --host 0.0.0.0 --port {remote_port} --logdir {logdir}",
-        wrap_in_screen=True,
-        named_session="tensorboard",
-        ignore_output=True,
-    )
+) -> ServiceHandle:
 
-    time.sleep(1)
+    tensorboard, = ServiceLauncher(reacher, paramiko=paramiko).start([
+        Service(
+            "tensorboard",
+            f"mkdir -p {logdir} && tensorboard --host 0.0.0.0 --port {remote_port} --logdir {logdir}",
+            remote_port,
+            local_port,
+            health_path="/",
+        ),
+    ])
 
-    reacher.add_port_forward(remote_port=remote_port, local_port=local_port, paramiko=paramiko)
+    print(f"tensorboard running on\n{tensorboard.url}")
 
-    print(f"tensorboard running on\nhttp://0.0.0.0:{local_port}/")
+    return tensorboard
@@ -17,6 +17,12 @@ setuptools.setup(
      install_requires=[
         'scp', "paramiko",
      ],
+     extras_require={
+        "zstd": ["zstandard"],
+     },
+     entry_points={
+        "console_scripts": ["reacher=reacher.cli:main"],
+     },
      classifiers=[
          "Programming Language :: Python :: 3",
          "License :: OSI Approved :: MIT License",
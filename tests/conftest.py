@@ -0,0 +1,79 @@
+"""Fixtures running reacher against the local SSH server of the benchmarks.
+
+The server serves exec, SFTP and direct-tcpip on the local machine, so
+the "remote" paths of the tests are directories under tmp_path.
+"""
+
+import logging
+
+import paramiko
+import pytest
+
+from benchmarks.server import serve
+from reacher import reacher as reacher_module
+from reacher.reacher import MetricsRecorder, Reacher, RemoteClient
+
+@pytest.fixture(scope="session")
+def server_port() -> int:
+
+    # clients that exit without closing their connection are expected
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    return serve()
+
+@pytest.fixture(scope="session")
+def ssh_key(tmp_path_factory) -> str:
+
+    path = str(tmp_path_factory.mktemp("key") / "id_rsa")
+    paramiko.RSAKey.generate(2048).write_private_key_file(path)
+
+    return path
+
+@pytest.fixture(autouse=True)
+def local_state(tmp_path, monkeypatch) -> str:
+    """Keep journals, manifests and hash indexes of a test to itself."""
+
+    path = str(tmp_path / "state")
+    monkeypatch.setattr(reacher_module, "LOCAL_STATE_PATH", path)
+
+    return path
+
+@pytest.fixture
+def client(server_port, ssh_key):
+
+    client = RemoteClient(
+        host="127.0.0.1", port=server_port, user="test", ssh_key_filepath=ssh_key, metrics=MetricsRecorder(),
+    )
+
+    yield client
+
+    client.disconnect()
+
+def make_reacher(client: RemoteClient, workspace: str, build_name: str = "build") -> Reacher:
+    """A Reacher whose workspace is the local directory workspace."""
+
+    class LocalReacher(Reacher):
+
+        @property
+        def workspace_path(self):
+            return workspace
+
+    reacher = LocalReacher(build_name=build_name, client=client)
+    reacher.setup()
+
+    return reacher
+
+@pytest.fixture
+def reacher(client, tmp_path) -> Reacher:
+
+    return make_reacher(client, str(tmp_path / "workspace"))
+
+@pytest.fixture
+def cwd(tmp_path, monkeypatch) -> str:
+    """A scratch working directory for relative local paths."""
+
+    path = tmp_path / "local"
+    path.mkdir()
+    monkeypatch.chdir(path)
+
+    return str(path)
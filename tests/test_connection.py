@@ -0,0 +1,67 @@
+def test_run(client):
+
+    with client.run("echo out; echo err >&2; exit 4") as result:
+        assert result.wait() == 4
+
+    assert result.stdout == "out\n"
+    assert result.stderr == "err\n"
+    assert not result.ok
+
+def test_commands_share_one_transport(client):
+
+    transport = client._connections.transport
+
+    for i in range(5):
+        with client.run(f"echo {i}") as result:
+            result.wait()
+        assert result.stdout == f"{i}\n"
+
+    assert client._connections.transport is transport
+
+def test_reconnects_after_the_connection_dropped(client):
+
+    with client.run("true") as result:
+        result.wait()
+
+    transport = client._connections.transport
+    transport.close()
+
+    with client.run("echo again") as result:
+        assert result.wait() == 0
+    assert result.stdout == "again\n"
+
+    assert client._connections.transport is not transport
+
+def test_sftp_sessions_are_pooled_and_renewed(client, tmp_path):
+
+    path = str(tmp_path / "f")
+    client.write_file(path, b"data")
+
+    with client._connections.sftp() as sftp:
+        first = sftp
+    with client._connections.sftp() as sftp:
+        assert sftp is first
+
+    client._connections.transport.close()
+
+    assert client.read_file(path) == b"data"
+
+def test_batch_step_status(client):
+
+    results = client.batch().add("echo one", name="one").add(
+        "echo two; exit 3", name="two", check=False,
+    ).add("echo three; exit 5", name="three").add("echo four", name="four").run()
+
+    assert [(r.name, r.exit_status) for r in results] == [("one", 0), ("two", 3), ("three", 5), ("four", None)]
+    assert [r.output for r in results[:3]] == ["one\n", "two\n", "three\n"]
+    assert results[3].skipped
+
+def test_batch_is_one_round_trip(client, tmp_path):
+
+    client.run("true").wait()
+    before = client.metrics.counters["round_trips"]
+
+    client.batch().mkdir(str(tmp_path / "a"), str(tmp_path / "b")).add(f"touch {tmp_path}/a/x").run()
+
+    assert client.metrics.counters["round_trips"] - before == 1
+    assert (tmp_path / "a" / "x").exists() and (tmp_path / "b").is_dir()
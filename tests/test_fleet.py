@@ -0,0 +1,64 @@
+import os
+
+from reacher.reacher import RemoteClient, ReacherFleet
+
+from tests.conftest import make_reacher
+
+def _fleet(server_port, ssh_key, tmp_path, n: int = 2, **kwargs) -> ReacherFleet:
+
+    reachers = [
+        make_reacher(
+            RemoteClient(host="127.0.0.1", port=server_port, user="test", ssh_key_filepath=ssh_key),
+            str(tmp_path / f"host{i}"),
+        )
+        for i in range(n)
+    ]
+
+    return ReacherFleet(reachers, **kwargs)
+
+def _context(cwd):
+
+    os.makedirs("src")
+    with open("src/job.py", "w") as f:
+        f.write("print('hi')\n")
+
+def test_execute(server_port, ssh_key, tmp_path, cwd):
+
+    _context(cwd)
+    fleet = _fleet(server_port, ssh_key, tmp_path)
+
+    results = fleet.execute("python3 src/job.py; exit 3", context="src")
+
+    assert [r.exit_status for r in results] == [3, 3]
+    assert all(list(r.output) == ["hi\n"] for r in results)
+    assert all(not r.ok for r in results)
+
+def test_execute_skips_hosts_whose_upload_failed(server_port, ssh_key, tmp_path, cwd):
+
+    _context(cwd)
+    fleet = _fleet(server_port, ssh_key, tmp_path, fail_fast=False)
+
+    # a file where the context goes makes the upload to the second host fail
+    broken = fleet.reachers[1]
+    with open(os.path.join(broken.build_path, "src"), "w") as f:
+        f.write("")
+
+    results = fleet.execute("touch ran", context="src")
+
+    assert results[0].ok and results[0].exit_status == 0
+    assert results[1].error is not None and results[1].exit_status is None
+    assert os.path.exists(os.path.join(fleet.reachers[0].build_path, "ran"))
+    assert not os.path.exists(os.path.join(broken.build_path, "ran"))
+
+def test_execute_fail_fast_stops_after_failed_upload(server_port, ssh_key, tmp_path, cwd):
+
+    _context(cwd)
+    fleet = _fleet(server_port, ssh_key, tmp_path, fail_fast=True)
+
+    with open(os.path.join(fleet.reachers[1].build_path, "src"), "w") as f:
+        f.write("")
+
+    results = fleet.execute("touch ran", context="src")
+
+    assert results[1].error is not None
+    assert not any(os.path.exists(os.path.join(r.build_path, "ran")) for r in fleet.reachers)
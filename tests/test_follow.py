@@ -0,0 +1,113 @@
+import os
+
+from reacher.reacher import LogFollower
+
+def _follower(client, tmp_path, **kwargs):
+
+    log, exit_path = str(tmp_path / "job.log"), str(tmp_path / "job.exit")
+    follower = LogFollower(interval=0.01, **kwargs)
+    follower.add(client, log, name="job", exit_path=exit_path)
+
+    return follower, log, exit_path
+
+def _text(chunks, name="job"):
+
+    return "".join(text for n, text in chunks if n == name)
+
+def test_follow_until_the_session_exits(client, tmp_path):
+
+    follower, log, exit_path = _follower(client, tmp_path)
+
+    assert follower.poll() == []
+
+    with open(log, "w") as f:
+        f.write("one\n")
+    assert follower.poll() == [("job", "one\n")]
+
+    with open(log, "a") as f:
+        f.write("two\n")
+    with open(exit_path, "w") as f:
+        f.write("7\n")
+
+    assert _text(follower.follow(until_finished=True)) == "two\n"
+    assert follower.exit_status("job") == 7
+    assert follower.finished
+
+def test_output_written_just_before_the_exit_is_not_lost(client, tmp_path):
+
+    follower, log, exit_path = _follower(client, tmp_path)
+
+    with open(log, "w") as f:
+        f.write("first\n")
+
+    check_exit = follower._check_exit
+
+    def racing(followed):
+        # the session writes its last line and exits between the read of
+        # the poll and the check of its exit status
+        if not os.path.exists(exit_path):
+            with open(log, "a") as f:
+                f.write("LAST LINE\n")
+            with open(exit_path, "w") as f:
+                f.write("0\n")
+        return check_exit(followed)
+
+    follower._check_exit = racing
+
+    assert _text(follower.follow(until_finished=True)) == "first\nLAST LINE\n"
+    assert follower.exit_status("job") == 0
+
+def test_multi_byte_characters_split_across_reads(client, tmp_path):
+
+    follower, log, exit_path = _follower(client, tmp_path)
+    data = "αβγ\n".encode("utf-8")
+
+    with open(log, "wb") as f:
+        f.write(data[:1])
+    chunks = follower.poll()
+
+    with open(log, "ab") as f:
+        f.write(data[1:])
+    with open(exit_path, "w") as f:
+        f.write("0\n")
+
+    assert _text(chunks + list(follower.follow(until_finished=True))) == "αβγ\n"
+
+def test_truncated_logs_are_read_from_the_start(client, tmp_path):
+
+    follower, log, _ = _follower(client, tmp_path)
+
+    with open(log, "w") as f:
+        f.write("a long first line\n")
+    follower.poll()
+
+    with open(log, "w") as f:
+        f.write("new\n")
+
+    assert follower.poll() == [("job", "new\n")]
+
+def test_mirror(client, tmp_path):
+
+    mirror = str(tmp_path / "mirror")
+    follower, log, exit_path = _follower(client, tmp_path, mirror=mirror)
+
+    with open(log, "w") as f:
+        f.write("mirrored\n")
+    with open(exit_path, "w") as f:
+        f.write("0\n")
+
+    list(follower.follow(until_finished=True))
+
+    with open(os.path.join(mirror, client.host, "job.log")) as f:
+        assert f.read() == "mirrored\n"
+
+def test_reacher_follow_sessions(reacher):
+
+    reacher.execute("echo start; sleep 0.3; echo done; exit 2", named_session="job")
+    reacher.execute("echo other", named_session="other")
+
+    chunks = list(reacher.follow(["job", "other"], interval=0.05))
+
+    assert _text(chunks, "job") == "start\ndone\n"
+    assert _text(chunks, "other") == "other\n"
+    assert {s.name: s.exit_status for s in reacher.list_named_sessions()} == {"job": 2, "other": 0}
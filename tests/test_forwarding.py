@@ -0,0 +1,114 @@
+import socket
+import threading
+
+import pytest
+
+@pytest.fixture
+def echo_port():
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+
+    def echo(conn):
+        with conn:
+            for data in iter(lambda: conn.recv(65536), b""):
+                conn.sendall(data)
+
+    def serve():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=echo, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    yield server.getsockname()[1]
+
+    server.close()
+
+def _roundtrip(port: int, data: bytes) -> bytes:
+    """Send data and read as much back. The test server closes a forwarded
+    connection on the first EOF, so the sending side is not shut down."""
+
+    received = b""
+
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+        sock.sendall(data)
+        while len(received) < len(data):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            received += chunk
+
+    return received
+
+def test_forward(reacher, echo_port):
+
+    tunnel = reacher.add_port_forward(remote_port=echo_port, local_port=0)
+
+    try:
+        assert tunnel.local_port != 0
+        assert _roundtrip(tunnel.local_port, b"hello") == b"hello"
+    finally:
+        reacher.stop_port_forwards()
+
+def test_concurrent_connections_and_stats(reacher, echo_port):
+
+    tunnel = reacher.add_port_forward(remote_port=echo_port, local_port=0)
+    payloads = [bytes([i]) * (1 << 20) for i in range(4)]
+    received = [None] * len(payloads)
+
+    def run(i):
+        received[i] = _roundtrip(tunnel.local_port, payloads[i])
+
+    try:
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(payloads))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        reacher.stop_port_forwards()
+
+    assert received == payloads
+
+    stats = tunnel.stats
+    assert stats["connections"] == len(payloads)
+    assert stats["failed"] == 0
+    assert stats["bytes_sent"] == stats["bytes_received"] == sum(map(len, payloads))
+
+def test_unreachable_remote_port(reacher):
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        closed_port = s.getsockname()[1]
+
+    tunnel = reacher.add_port_forward(remote_port=closed_port, local_port=0)
+
+    try:
+        with socket.create_connection(("127.0.0.1", tunnel.local_port), timeout=10) as sock:
+            try:
+                assert sock.recv(1) == b""
+            except ConnectionResetError:
+                pass
+        assert tunnel.stats["failed"] == 1
+    finally:
+        reacher.stop_port_forwards()
+
+def test_remove_closes_the_listener(reacher, echo_port):
+
+    tunnel = reacher.add_port_forward(remote_port=echo_port, local_port=0)
+    other = reacher.add_port_forward(remote_port=echo_port, local_port=0)
+
+    try:
+        reacher.remove_port_forward(tunnel)
+
+        with pytest.raises(ConnectionRefusedError):
+            socket.create_connection(("127.0.0.1", tunnel.local_port), timeout=10)
+
+        assert _roundtrip(other.local_port, b"still there") == b"still there"
+    finally:
+        reacher.stop_port_forwards()
@@ -0,0 +1,114 @@
+import hashlib
+import os
+
+import pytest
+
+from reacher.reacher import MetricsRecorder, RemoteClient
+
+from tests.conftest import make_reacher
+from tests.test_follow import _text
+from tests.test_ignore import _tree
+from tests.test_sync import FILES, _remote_files
+
+@pytest.fixture
+def helper_client(server_port, ssh_key):
+
+    client = RemoteClient(
+        host="127.0.0.1", port=server_port, user="test", ssh_key_filepath=ssh_key,
+        metrics=MetricsRecorder(), use_helper=True,
+    )
+
+    yield client
+
+    client.disconnect()
+
+def test_off_by_default(client):
+
+    assert client.helper is None
+
+def test_ops(helper_client, tmp_path):
+
+    root = str(tmp_path / "root")
+    _tree(root, {"a": "a", "sub/b": "bb"})
+    helper = helper_client.helper
+
+    assert sorted(helper.request("ls", path=root)) == [os.path.join(root, p) for p in ("a", "sub", "sub/b")]
+    assert helper.request("ls", path=os.path.join(root, "nothing")) == []
+
+    entries = helper.request("stat", path=root, hashes=True)
+    assert sorted(entries) == ["a", "sub/b"]
+    assert entries["sub/b"][0] == 2
+    assert entries["sub/b"][2] == hashlib.sha256(b"bb").hexdigest()
+
+    assert helper.request("hash", paths=[os.path.join(root, "a"), os.path.join(root, "c")]) == {
+        os.path.join(root, "a"): hashlib.sha256(b"a").hexdigest(),
+        os.path.join(root, "c"): None,
+    }
+    assert helper.request("missing", paths=["a", "c", "sub/b"], base=root) == ["c"]
+
+    helper_client.mkdir(os.path.join(root, "x/y"))
+    assert os.path.isdir(os.path.join(root, "x/y"))
+
+    helper_client.remove(os.path.join(root, "x"), os.path.join(root, "a"))
+    assert sorted(os.listdir(root)) == ["sub"]
+
+    tail = helper.request("tail", path=os.path.join(root, "sub/b"), offset=1)
+    assert (tail["offset"], tail["size"]) == (2, 2)
+
+def test_errors_keep_their_type(helper_client, tmp_path):
+
+    with pytest.raises(FileNotFoundError):
+        helper_client.helper.request("stat", path=str(tmp_path / "nothing"))
+
+    with pytest.raises(FileNotFoundError):
+        helper_client.helper.request("tail", path=str(tmp_path / "nothing"))
+
+    # the helper keeps serving after an error
+    assert helper_client.helper.request("ls", path=str(tmp_path / "nothing")) == []
+
+def test_one_round_trip_per_request(helper_client, tmp_path):
+
+    helper = helper_client.helper
+    before = helper_client.metrics.counters["round_trips"]
+
+    helper.request("ls", path=str(tmp_path))
+
+    assert helper_client.metrics.counters["round_trips"] - before == 1
+
+def test_restarted_when_it_went_away(helper_client, tmp_path):
+
+    helper = helper_client.helper
+    helper._chan.close()
+
+    assert helper.request("missing", paths=["a"], base=str(tmp_path)) == ["a"]
+
+    helper_client._connections.transport.close()
+
+    assert helper.request("missing", paths=["a"], base=str(tmp_path)) == ["a"]
+
+def test_same_results_as_shell_commands(client, helper_client, tmp_path, cwd):
+
+    _tree(cwd, FILES)
+    results = []
+
+    for i, c in enumerate([client, helper_client]):
+
+        reacher = make_reacher(c, str(tmp_path / f"workspace{i}"))
+        reacher.put("proj", method="sync")
+        _tree(cwd, {"proj/src/a.py": f"print({i})\n"})
+        reacher.put("proj", method="sync")
+
+        reacher.execute("echo out; exit 4", named_session="job")
+        output = _text(reacher.follow(["job"], interval=0.05))
+        sessions = [(s.name, s.exit_status, s.running) for s in reacher.list_named_sessions(suppress=True)]
+
+        files = _remote_files(reacher)
+        reacher.cleanup()
+        results.append((files, output, sessions, sorted(os.listdir(reacher.build_path))))
+
+    shell, helper = results
+
+    assert shell[0]["proj/src/a.py"] == "print(0)\n"
+    assert helper[0]["proj/src/a.py"] == "print(1)\n"
+    assert helper[0].keys() == shell[0].keys()
+    assert helper[1:] == shell[1:] == ("out\n", [("job", 4, False)], ["artifacts", "logs"])
@@ -0,0 +1,146 @@
+import os
+import time
+
+import pytest
+
+from reacher import reacher as reacher_module
+from reacher.reacher import IgnoreRules, Manifest, Reacher, TreeScanner
+
+def _tree(root, files):
+
+    for path, content in files.items():
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+def _walk(path, **kwargs):
+
+    return sorted(rel for _, rel in TreeScanner(excludes=Reacher.EXCLUDES, **kwargs).walk(path))
+
+@pytest.mark.parametrize("pattern, path, is_dir, ignored", [
+    ("*.log", "a.log", False, True),
+    ("*.log", "deep/dir/a.log", False, True),
+    ("*.log", "a.log.txt", False, False),
+    ("build/", "build", True, True),
+    ("build/", "build", False, False),
+    ("/top.txt", "top.txt", False, True),
+    ("/top.txt", "sub/top.txt", False, False),
+    ("docs/*.md", "docs/a.md", False, True),
+    ("docs/*.md", "docs/sub/a.md", False, False),
+    ("**/cache", "a/b/cache", True, True),
+    ("a/**/z", "a/b/c/z", False, True),
+    ("data?.csv", "data1.csv", False, True),
+    ("data[0-9].csv", "datax.csv", False, False),
+])
+def test_gitignore_patterns(pattern, path, is_dir, ignored):
+
+    assert IgnoreRules.parse([pattern]).ignored(path, is_dir) is ignored
+
+def test_last_matching_pattern_wins():
+
+    rules = IgnoreRules.parse(["# comment", "", "*.csv", "!keep.csv", "keep.csv.bak"])
+
+    assert rules.ignored("data.csv")
+    assert not rules.ignored("keep.csv")
+    assert not rules.ignored("sub/keep.csv")
+    assert rules.ignored("keep.csv.bak")
+
+def test_patterns_of_nested_files_are_relative_to_them():
+
+    rules = IgnoreRules.parse(["/out", "tmp/*.txt"], base="sub")
+
+    assert rules.ignored("sub/out", True)
+    assert not rules.ignored("out", True)
+    assert rules.ignored("sub/tmp/a.txt")
+    assert not rules.ignored("tmp/a.txt")
+
+def test_dockerignore_patterns():
+
+    rules = IgnoreRules.parse_docker(["data", "!data/keep.csv", "*.md", "/tmp/"])
+
+    assert rules.docker_ignored("data/a.csv")
+    assert not rules.docker_ignored("data/keep.csv")
+    assert rules.docker_ignored("README.md")
+    assert not rules.docker_ignored("docs/README.md")
+    assert rules.docker_ignored("tmp/x/y")
+
+def test_scanner_applies_ignore_files_and_excludes(cwd):
+
+    _tree(cwd, {
+        "proj/.gitignore": "*.log\nout/\n",
+        "proj/src/.reacherignore": "secret.txt\n",
+        "proj/src/a.py": "a",
+        "proj/src/a.pyc": "",
+        "proj/src/secret.txt": "",
+        "proj/src/__pycache__/a.cpython.pyc": "",
+        "proj/run.log": "",
+        "proj/out/result": "",
+        "proj/.git/HEAD": "",
+        "proj/env/pyvenv.cfg": "",
+        "proj/env/lib/site.py": "",
+        "proj/logs/job.log": "",
+    })
+
+    assert _walk("proj") == ["proj/.gitignore", "proj/src/.reacherignore", "proj/src/a.py"]
+    # the rules of enclosing directories apply to a subfolder too
+    with open("proj/src/b.log", "w"):
+        pass
+    assert _walk("proj/src") == ["proj/src/.reacherignore", "proj/src/a.py"]
+
+def test_scanner_root(cwd, tmp_path):
+
+    _tree(cwd, {"proj/.gitignore": "*.log\n", "proj/src/a.py": "", "proj/src/b.log": "", "proj/c.txt": ""})
+
+    expected = _walk("proj")
+
+    os.chdir(str(tmp_path))
+
+    assert _walk("proj", root=cwd) == expected
+    assert _walk("src", root=os.path.join(cwd, "proj")) == ["src/a.py"]
+
+def test_explicit_files_are_only_checked_for_excluded_exts(cwd):
+
+    _tree(cwd, {".gitignore": "*.log\n", "a.log": "", "b.pyc": ""})
+
+    assert _walk("a.log") == ["a.log"]
+    assert _walk("b.pyc") == []
+
+def test_manifest_diff(cwd):
+
+    _tree(cwd, {"src/a.py": "a", "src/b.py": "b"})
+    old = Manifest.scan("src")
+
+    _tree(cwd, {"src/a.py": "changed", "src/c.py": "c"})
+    os.remove("src/b.py")
+    new = Manifest.scan("src", previous=old)
+
+    changed, stale = new.diff(old)
+
+    assert sorted(changed) == ["src/a.py", "src/c.py"]
+    assert stale == ["src/b.py"]
+    assert new.entries["src/a.py"]["hash"] != old.entries["src/a.py"]["hash"]
+
+def test_unchanged_files_are_not_hashed_again(cwd, monkeypatch):
+
+    _tree(cwd, {"src/a.py": "a", "src/b.py": "b"})
+    past = time.time() - 60
+    for name in ("a.py", "b.py"):
+        os.utime(os.path.join("src", name), (past, past))
+
+    first = Manifest.scan("src")
+
+    hashed = []
+    hash_files = reacher_module.hash_files
+    monkeypatch.setattr(reacher_module, "hash_files", lambda paths, workers=None: hashed.extend(paths) or hash_files(paths))
+
+    # the hash index remembers the files without a previous manifest
+    assert Manifest.scan("src").entries == first.entries
+    assert hashed == []
+
+    _tree(cwd, {"src/b.py": "changed"})
+    second = Manifest.scan("src")
+
+    assert hashed == [os.path.join("src", "b.py")]
+    assert second.entries["src/a.py"]["hash"] == first.entries["src/a.py"]["hash"]
+    assert second.entries["src/b.py"]["hash"] != first.entries["src/b.py"]["hash"]
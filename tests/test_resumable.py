@@ -0,0 +1,83 @@
+import os
+
+from reacher.reacher import file_hash
+
+CHUNK_SIZE = 64 * 1024
+
+def _local_file(tmp_path, size: int = 5 * CHUNK_SIZE + 123) -> str:
+
+    path = str(tmp_path / "data.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+    return path
+
+def _interrupted_upload(client, tmp_path):
+    """Upload every chunk but fail the final rename, leaving the journal and
+    the .part behind: the destination is a directory that cannot be replaced."""
+
+    source = _local_file(tmp_path)
+    destination = str(tmp_path / "remote" / "data.bin")
+    os.makedirs(os.path.join(destination, "blocker"))
+
+    result = client.put_resumable(source, destination, chunk_size=CHUNK_SIZE, retries=0)
+
+    assert not result.ok
+    assert os.path.isfile(f"{destination}.part")
+
+    os.rmdir(os.path.join(destination, "blocker"))
+    os.rmdir(destination)
+
+    return source, destination
+
+def test_put_resumable(client, tmp_path, local_state):
+
+    source = _local_file(tmp_path)
+    destination = str(tmp_path / "remote.bin")
+
+    result = client.put_resumable(source, destination, chunk_size=CHUNK_SIZE, workers=3, retries=0)
+
+    assert result.ok, result.error
+    assert file_hash(destination) == file_hash(source)
+    assert not os.path.exists(f"{destination}.part")
+    assert os.listdir(os.path.join(local_state, "journals")) == []
+
+def test_put_resumable_skips_verified_chunks(client, tmp_path):
+
+    source, destination = _interrupted_upload(client, tmp_path)
+
+    # one chunk got corrupted on the remote, only it is sent again
+    with open(f"{destination}.part", "r+b") as f:
+        f.seek(CHUNK_SIZE)
+        f.write(b"corrupt")
+
+    sent = client.metrics.counters["bytes_sent"]
+    result = client.put_resumable(source, destination, chunk_size=CHUNK_SIZE, retries=0)
+
+    assert result.ok, result.error
+    assert client.metrics.counters["bytes_sent"] - sent == CHUNK_SIZE
+    assert file_hash(destination) == file_hash(source)
+
+def test_put_resumable_without_part(client, tmp_path):
+
+    source, destination = _interrupted_upload(client, tmp_path)
+
+    # e.g. Reacher.cleanup removed it, the journal is stale
+    os.remove(f"{destination}.part")
+
+    result = client.put_resumable(source, destination, chunk_size=CHUNK_SIZE, retries=0)
+
+    assert result.ok, result.error
+    assert file_hash(destination) == file_hash(source)
+
+def test_put_resumable_restarts_after_local_change(client, tmp_path):
+
+    source, destination = _interrupted_upload(client, tmp_path)
+
+    with open(source, "ab") as f:
+        f.write(b"more")
+
+    result = client.put_resumable(source, destination, chunk_size=CHUNK_SIZE, retries=0)
+
+    assert result.ok, result.error
+    assert file_hash(destination) == file_hash(source)
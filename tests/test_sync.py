@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+from reacher.reacher import Manifest
+
+from tests.conftest import make_reacher
+from tests.test_ignore import _tree
+
+METHODS = ["scp", "tar", "sync", "objects", "resumable"]
+
+FILES = {
+    "proj/.gitignore": "*.log\nout/\n",
+    "proj/src/a.py": "print('a')\n",
+    "proj/src/sub/b.txt": "b" * 100000,
+    "proj/src/a.pyc": "",
+    "proj/run.log": "",
+    "proj/out/result": "",
+    "proj/.git/HEAD": "",
+}
+
+def _remote_files(reacher):
+
+    files = {}
+
+    for dirpath, _, filenames in os.walk(reacher.build_path):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(path, reacher.build_path)
+            if rel_path.split(os.sep)[0] in ("artifacts", "logs") or filename == Manifest.FILENAME:
+                continue
+            with open(path) as f:
+                files[rel_path] = f.read()
+
+    return files
+
+@pytest.mark.parametrize("method", METHODS)
+def test_put(reacher, cwd, method):
+
+    _tree(cwd, FILES)
+
+    reacher.put("proj", method=method)
+
+    assert _remote_files(reacher) == {
+        "proj/.gitignore": FILES["proj/.gitignore"],
+        "proj/src/a.py": FILES["proj/src/a.py"],
+        "proj/src/sub/b.txt": FILES["proj/src/sub/b.txt"],
+    }
+
+@pytest.mark.parametrize("method", ["scp", "tar", "sync"])
+def test_put_with_root(reacher, cwd, tmp_path, method):
+
+    _tree(cwd, FILES)
+    os.chdir(str(tmp_path))
+
+    reacher.put(["src", ".gitignore"], destination_folder="dst", method=method, root=os.path.join(cwd, "proj"))
+
+    assert sorted(_remote_files(reacher)) == ["dst/.gitignore", "dst/src/a.py", "dst/src/sub/b.txt"]
+
+def test_sync_only_sends_changes(reacher, cwd):
+
+    _tree(cwd, FILES)
+    reacher.put("proj", method="sync")
+
+    metrics = reacher.metrics
+    before = metrics.counters["bytes_sent"]
+
+    _tree(cwd, {"proj/src/a.py": "print('changed')\n"})
+    reacher.put("proj", method="sync")
+
+    sent = metrics.counters["bytes_sent"] - before
+
+    # a.py again, not the 100k of b.txt
+    assert 0 < sent < 50000
+    assert _remote_files(reacher)["proj/src/a.py"] == "print('changed')\n"
+
+def test_sync_delete(reacher, cwd):
+
+    _tree(cwd, FILES)
+    reacher.put("proj", method="sync")
+
+    os.remove("proj/src/a.py")
+    reacher.put("proj", method="sync")
+    assert "proj/src/a.py" in _remote_files(reacher)
+
+    reacher.put("proj", method="sync", delete=True)
+    assert "proj/src/a.py" not in _remote_files(reacher)
+
+def test_sync_after_cleanup(reacher, cwd):
+
+    _tree(cwd, FILES)
+    reacher.put("proj", method="sync")
+
+    # the remote manifest is compared against, so a cleaned up build gets everything again
+    reacher.cleanup()
+    reacher.put("proj", method="sync")
+
+    assert sorted(_remote_files(reacher)) == ["proj/.gitignore", "proj/src/a.py", "proj/src/sub/b.txt"]
+
+def test_objects_are_shared_and_protected(reacher, cwd, client):
+
+    _tree(cwd, FILES)
+    other = make_reacher(client, reacher.workspace_path, build_name="other")
+
+    reacher.put("proj", method="objects")
+    other.put("proj", method="objects")
+
+    a = os.path.join(reacher.build_path, "proj", "src", "a.py")
+    b = os.path.join(other.build_path, "proj", "src", "a.py")
+    assert os.stat(a).st_ino == os.stat(b).st_ino
+    assert not os.stat(a).st_mode & 0o222
+
+    # other methods replace the linked file instead of writing through it
+    _tree(cwd, {"proj/src/a.py": "changed\n"})
+    reacher.put("proj", method="scp")
+
+    assert open(a).read() == "changed\n"
+    assert open(b).read() == FILES["proj/src/a.py"]